@@ -10,47 +10,96 @@ Common imports for projects
 Reads config files from f"~/.config/ongpi/{project_name}.{extension}"
 where extension can be yaml, yml, json or js
 Path can be overridden either with ONG_CONFIG_PATH environ variable
+
+Names are imported lazily: the submodule that defines a name (and its dependencies, such as yaml, keyring,
+pandas or tkinter) is only imported the first time that name is accessed
 """
-from ong_utils.import_utils import AdditionalRequirementException, raise_extra_install
+import importlib
 
-from ong_utils.config import OngConfig
-from ong_utils.internal_storage import InternalStorage
-from ong_utils.parse_html import find_js_variable
-from ong_utils.timers import OngTimer
-from ong_utils.urllib3_utils import create_pool_manager, cookies2header, get_cookies
-from ong_utils.utils import (LOCAL_TZ, is_debugging, to_list, is_mac, is_linux, is_windows, get_current_user,
-                             get_current_domain)
-from ong_utils.web import find_available_port
+from ong_utils.import_utils import AdditionalRequirementException, raise_extra_install
 
 __version__ = "1.0.5"
 
-try:
-    from ong_utils.ui import simple_dialog, user_domain_password_dialog, fix_windows_gui_scale, OngFormDialog
-    from ong_utils.ui_logging_utils import print2widget, logger2widget
-except ModuleNotFoundError as mnfe:
+import_excepts = (ModuleNotFoundError, NameError, AdditionalRequirementException)
+
+# Exported name -> (submodule that defines it, extra to install if its dependencies are missing)
+_lazy_exports = {
+    "OngConfig": ("ong_utils.config", None),
+    "InternalStorage": ("ong_utils.internal_storage", None),
+    "InternalStorageV2": ("ong_utils.internal_storage", None),
+    "find_js_variable": ("ong_utils.parse_html", None),
+    "OngTimer": ("ong_utils.timers", None),
+    "create_pool_manager": ("ong_utils.urllib3_utils", None),
+    "cookies2header": ("ong_utils.urllib3_utils", None),
+    "get_cookies": ("ong_utils.urllib3_utils", None),
+    "LOCAL_TZ": ("ong_utils.utils", None),
+    "is_debugging": ("ong_utils.utils", None),
+    "to_list": ("ong_utils.utils", None),
+    "is_mac": ("ong_utils.utils", None),
+    "is_linux": ("ong_utils.utils", None),
+    "is_windows": ("ong_utils.utils", None),
+    "get_current_user": ("ong_utils.utils", None),
+    "get_current_domain": ("ong_utils.utils", None),
+    "find_available_port": ("ong_utils.web", None),
+    "asyncio_run": ("ong_utils.async_utils", None),
     # In some systems tkinter is not installed by default and must be installed manually
-    print(mnfe)
+    "simple_dialog": ("ong_utils.ui", None),
+    "user_domain_password_dialog": ("ong_utils.ui", None),
+    "fix_windows_gui_scale": ("ong_utils.ui", None),
+    "OngFormDialog": ("ong_utils.ui", None),
+    "print2widget": ("ong_utils.ui_logging_utils", None),
+    "logger2widget": ("ong_utils.ui_logging_utils", None),
+    # Optional dependencies
+    "df_to_excel": ("ong_utils.excel", "xlsx"),
+    "SensitivityLabel": ("ong_utils.sensitivity_labels", "xlsx"),
+    "decode_jwt_token": ("ong_utils.jwt_tokens", "jwt"),
+    "decode_jwt_token_expiry": ("ong_utils.jwt_tokens", "jwt"),
+    "Chrome": ("ong_utils.selenium_chrome", "selenium"),
+    "verify_credentials": ("ong_utils.credentials", "credentials"),
+}
 
-from ong_utils.async_utils import asyncio_run
+# Names always available. __all__ is computed when first accessed (e.g. by "from ong_utils import *"), with the
+# names of _lazy_exports whose dependencies are installed, so a star import never fails
+_static_names = ["AdditionalRequirementException", "raise_extra_install", "__version__"]
 
 
-import_excepts = (ModuleNotFoundError, NameError, AdditionalRequirementException)
-try:
-    from ong_utils.excel import df_to_excel
-    from ong_utils.sensitivity_labels import SensitivityLabel
-except import_excepts:
-    df_to_excel = raise_extra_install("xlsx")
-try:
-    from ong_utils.jwt_tokens import decode_jwt_token, decode_jwt_token_expiry
-except import_excepts:
-    decode_jwt_token = decode_jwt_token_expiry = raise_extra_install("jwt")
-    pass
-try:
-    from ong_utils.selenium_chrome import Chrome
-except import_excepts:
-    Chrome = raise_extra_install("selenium")
-try:
-    from ong_utils.credentials import verify_credentials
-except import_excepts:
-    verify_credentials = raise_extra_install("credentials")
+def _import_export(name: str, verbose: bool = True):
+    """Imports the submodule that defines name and caches the value in this module. Raises AttributeError if the
+    submodule cannot be imported and its dependencies are not optional"""
+    module_name, extras = _lazy_exports[name]
+    try:
+        value = getattr(importlib.import_module(module_name), name)
+    except import_excepts as ie:
+        if extras is None:
+            # Dependencies are not optional (e.g. tkinter not installed in the system)
+            if verbose:
+                print(ie)
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from ie
+        value = raise_extra_install(extras)
+    globals()[name] = value
+    return value
+
+
+def _available_names() -> list:
+    names = list(_static_names)
+    for name in _lazy_exports:
+        try:
+            _import_export(name, verbose=False)
+        except AttributeError:
+            continue
+        names.append(name)
+    return names
+
+
+def __getattr__(name: str):
+    """Imports the submodule that defines name on first access and caches the value in this module"""
+    if name == "__all__":
+        value = globals()["__all__"] = _available_names()
+        return value
+    if name not in _lazy_exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return _import_export(name)
+
 
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_exports))
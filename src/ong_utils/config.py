@@ -1,8 +1,14 @@
+import copy
 import getpass
 import logging
 import logging.config
 import os
+import re
+import secrets
+import stat
+import threading
 import warnings
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 
 import keyring
@@ -11,11 +17,88 @@ import yaml
 
 _missing = object()  # In order to use None as default value for function args, this value must be used
 
+# libyaml based loader and dumper are much faster than the pure python ones, but might not be available
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CDumper", yaml.Dumper)
+
+
+def yaml_load(stream):
+    """Same as yaml.safe_load, but using libyaml if available"""
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+def yaml_dump(data, stream=None, **kwargs):
+    """Same as yaml.dump, but using libyaml if available"""
+    return yaml.dump(data, stream, Dumper=YamlDumper, **kwargs)
+
+
+# Environment variables used for other purposes, that are never taken as config items (e.g. ONG_CONFIG_PATH would
+# be item "path" of project "config")
+_reserved_environ = {"ONG_CONFIG_PATH", "ONG_LOG_PATH", "ONG_SYSTEM_CONFIG_PATH", "ONG_TIMERS_DISABLED"}
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Advisory exclusive lock of path, using a f"{path}.lock" file (path itself is replaced when written, so it
+    cannot be locked). Waits until the lock is acquired"""
+    with open(f"{path}.lock", "a+b") as f_lock:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    f_lock.seek(0)
+                    msvcrt.locking(f_lock.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:     # LK_LOCK gives up after 10 seconds
+                    continue
+            try:
+                yield
+            finally:
+                f_lock.seek(0)
+                msvcrt.locking(f_lock.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f_lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f_lock.fileno(), fcntl.LOCK_UN)
+
+
+def _atomic_write(path: str, writer, data):
+    """Writes data to path using writer(data, file) into a temporary file that replaces path once completely
+    written, so readers (and crashes) never see a partially written file. Keeps permissions of the existing file"""
+    directory, filename = os.path.split(path)
+    while True:
+        tmp_path = os.path.join(directory, f".{filename}.{secrets.token_hex(4)}.tmp")
+        try:
+            # Kernel applies the umask to new files, so they get the same permissions open() would give them
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        with os.fdopen(fd, "w") as f_tmp:
+            writer(data, f_tmp)
+            f_tmp.flush()
+            os.fsync(f_tmp.fileno())
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
 
 class OngConfig:
     extensions_cfg = {
-        '.yaml': (yaml.safe_load, yaml.dump),
-        '.yml': (yaml.safe_load, yaml.dump),
+        '.yaml': (yaml_load, yaml_dump),
+        '.yml': (yaml_load, yaml_dump),
         '.json': (ujson.load, ujson.dump),
         '.js': (ujson.load, ujson.dump),
     }
@@ -27,6 +110,32 @@ class OngConfig:
 
     __logger = dict()
 
+    # Parsed config files shared among all instances, by absolute path: (file stats, parsed contents). Files are
+    # parsed again only if their stats (modification time, size or inode) change
+    __parsed_files = dict()
+
+    # Default app, test and log config of each project, and "log" section read from its file, needed for reload
+    __defaults_global = dict()
+    __file_log_cfg_global = dict()
+    # Watchers of config files and functions called when config is reloaded, by project
+    __watchers = dict()
+    __reload_callbacks = dict()
+    __reload_lock = threading.RLock()
+    # App config resolved from all sources (defaults < system file < user file < environment variables), source of
+    # each item, items read from (or written to) the user config file and environment variables read, by project
+    __resolved_cfg_global = dict()
+    __sources_global = dict()
+    __user_items_global = dict()
+    __environ_global = dict()
+    # Compiled schemas (ong_utils.config_schema.ConfigSchema) and typed app config built with them, by project
+    __schemas_global = dict()
+    __settings_global = dict()
+    # Projects whose logger handlers run in a QueueListener thread
+    __queue_logging_global = dict()
+    # Serializes writes of config files among threads (and, with the file lock, among processes)
+    __write_lock = threading.RLock()
+    __file_lock_depths = dict()
+
     # Setters and getters for accessing to the app, log and test config
     @property
     def __app_cfg(self) -> dict:
@@ -55,7 +164,9 @@ class OngConfig:
     def __init__(self, project_name: str, cfg_filename: str = None,
                  default_app_cfg: dict = None, default_log_cfg: dict = None,
                  default_test_cfg: dict = None, write_default_file: bool = False,
-                 config_path: str | Path = None, log_config_path: Path | str = None):
+                 config_path: str | Path = None, log_config_path: Path | str = None,
+                 system_config_path: str | Path = None, schema=None, queue_logging: bool = None,
+                 log_options: dict = None):
         """
         Reads configurations from f"{config_path}/{project_name}.{extension}" and writes logs to
         f"{config_path}../.logs/{project_name}.{extension}"
@@ -71,17 +182,45 @@ class OngConfig:
          values
         :param config_path: Path from where config file will be read. Defaults to ~/.config/ongpi
         :param log_config_path: Path where logs will be written. Defaults to ~/.logs
+        :param system_config_path: Path of a system-wide config file with the same name as the config file, whose
+            values are overridden by the ones in the config file. Defaults to /etc/ongpi (%PROGRAMDATA%/ongpi in
+            windows). Values in environment variables named ONG_{PROJECT_NAME}_{ITEM} (in upper case) override both
+        :param schema: an optional dataclass, or dict of item -> type or item -> (type, default), used to validate
+            and convert the app config each time it is loaded (see ong_utils.config_schema). Converted values are
+            returned by config() and are available as attributes of self.settings. Raises ValueError if the app
+            config does not match the schema
+        :param queue_logging: if True, log handlers of the project logger are run in a background thread (a
+            logging.handlers.QueueListener), and the logger just puts records in a queue (QueueHandler), so log calls
+            do not wait for file I/O. Call close_handlers to flush queued records and stop the thread. If None
+            (default), keeps the value given by previous instances of the same project (False if none was given)
+        :param log_options: optional dict of keyword arguments for the default log config (ignored if
+            default_log_cfg is given), e.g. dict(json_format=True, compress=True, when="midnight"). See
+            _default_logger_config
         """
         self.project_name = project_name
+        if queue_logging is not None:
+            self.__queue_logging_global[project_name] = queue_logging
+        self.__transaction_depth = 0
+        self.__pending_items = dict()
+        self.__pending_save = False
         self.test_project_name = f"{self.project_name}_test"
         self.config_path = Path(config_path or os.environ.get("ONG_CONFIG_PATH", "~/.config/ongpi")).expanduser()
         self.log_config_path = Path(log_config_path or os.environ.get("ONG_LOG_PATH", "~/.logs")).expanduser()
+        self.system_config_path = Path(system_config_path or os.environ.get("ONG_SYSTEM_CONFIG_PATH",
+                                                                            _default_system_config_path()))
         self.config_path.mkdir(exist_ok=True, parents=True)
         self.log_config_path.mkdir(exist_ok=True, parents=True)
+        if schema is not None:
+            from ong_utils.config_schema import ConfigSchema
+            self.__schemas_global[self.project_name] = ConfigSchema(schema, name=f"{project_name}_settings")
+        default_log_cfg = default_log_cfg or _default_logger_config(app_name=self.project_name,
+                                                                    log_config_path=self.log_config_path,
+                                                                    **(log_options or dict()))
+        self.__defaults_global[self.project_name] = copy.deepcopy((default_app_cfg or dict(),
+                                                                   default_test_cfg or dict(), default_log_cfg))
         self.__app_cfg = default_app_cfg or dict()
         self.__test_cfg = default_test_cfg or dict()
-        self.__log_cfg = default_log_cfg or _default_logger_config(app_name=self.project_name,
-                                                                   log_config_path=self.log_config_path)
+        self.__log_cfg = default_log_cfg
         self.config_filename = None
         for ext, (loader, _) in self.extensions_cfg.items():
             if cfg_filename:
@@ -104,6 +243,7 @@ class OngConfig:
         if self.config_filename is None:
             self.config_filename = self._get_cfg_filename(list(self.extensions_cfg.keys())[0], filename=cfg_filename)
             self.save()
+            self._resolve(read_environ=True)
             # In case there is a default app config and file must not be overwritten, it does not raise an
             # exception and continues normally creating a file with default values
             if default_app_cfg is not None and write_default_file:
@@ -118,31 +258,208 @@ class OngConfig:
         cfg = self.load()
         if self.project_name in cfg:
             self.__app_cfg.update(cfg[self.project_name])
+            self.__user_items_global[self.project_name] = set(cfg[self.project_name])
             self.__test_cfg.update(cfg.get(self.test_project_name) or dict())
             if self.project_name not in self.__logger:       # Update logger config just in case is not already initialized
+                self.__file_log_cfg_global[self.project_name] = cfg.get("log") or dict()
                 self.__log_cfg.update(cfg.get("log") or dict())
                 self._fix_logger_config()
-                logging.config.dictConfig(self.__log_cfg)
-                self.__logger[self.project_name] = logging.getLogger(self.project_name)
+                self._configure_logging()
+            self._resolve(read_environ=True)
             return True
         else:
             return False
 
+    @property
+    def system_config_filename(self) -> str:
+        """Name of the system-wide config file (it might not exist)"""
+        return os.path.join(self.system_config_path, os.path.basename(self.config_filename))
+
+    @property
+    def env_prefix(self) -> str:
+        """Prefix of the environment variables that override config items"""
+        return "ONG_" + re.sub(r"\W", "_", self.project_name).upper() + "_"
+
+    def _resolve(self, read_environ: bool = False):
+        """Merges the app config from all sources (defaults < system file < user file < environment variables)
+        into a single dict, that is used by config(), recording the source of each item. Environment variables are
+        read just the first time or if read_environ=True"""
+        if read_environ or self.project_name not in self.__environ_global:
+            environ = self.__read_environ()
+        else:
+            environ = self.__environ_global[self.project_name]
+        user_items = self.__user_items_global.get(self.project_name, set())
+        self.__store_resolved(environ, *self.__resolve_sources(self.__app_cfg, user_items, environ))
+
+    def __read_environ(self) -> dict:
+        """Returns the environment variables that override config items"""
+        prefix = self.env_prefix
+        return {name: value for name, value in os.environ.items()
+                if name.startswith(prefix) and len(name) > len(prefix) and name not in _reserved_environ}
+
+    def __resolve_sources(self, app_cfg: dict, user_items: set, environ: dict) -> tuple:
+        """Returns the resolved app config, the source of each item and the settings built with the schema (None
+        if there is no schema) from the given app config, items of the user file and environment variables,
+        without changing the shared config. Raises ValueError if the config does not match the schema"""
+        default_app_cfg = self.__defaults_global.get(self.project_name, (dict(),))[0]
+        resolved = dict()
+        sources = dict()
+        for item, value in default_app_cfg.items():
+            resolved[item], sources[item] = value, "default"
+        system_cfg = self.load(self.system_config_filename) or dict()
+        for item, value in (system_cfg.get(self.project_name) or dict()).items():
+            resolved[item], sources[item] = value, f"system file {self.system_config_filename}"
+        for item, value in app_cfg.items():
+            if item in user_items or item not in default_app_cfg:
+                resolved[item], sources[item] = value, f"file {self.config_filename}"
+        schema = self.__schemas_global.get(self.project_name)
+        items_upper = {item.upper(): item for item in resolved}
+        if schema is not None:
+            items_upper.update({item.upper(): item for item, *_ in schema.fields})
+        for name, value in environ.items():
+            env_item = name[len(self.env_prefix):]
+            item = items_upper.get(env_item, env_item.lower())
+            # Values are strings (converted by the schema, if any), except for lists or dicts in the schema
+            if schema is not None and item in schema.structured_items:
+                try:
+                    value = yaml_load(value)
+                except yaml.YAMLError:
+                    pass
+            resolved[item], sources[item] = value, f"env {name}"
+        settings = None
+        if schema is not None:
+            settings = schema.build(resolved, section=self.project_name)
+            for item, *_ in schema.fields:
+                resolved[item] = getattr(settings, item)
+                sources.setdefault(item, "default")
+        return resolved, sources, settings
+
+    def __store_resolved(self, environ: dict, resolved: dict, sources: dict, settings):
+        # Dicts are replaced instead of updated, so readers never see a partially resolved config
+        self.__environ_global[self.project_name] = environ
+        if settings is not None:
+            self.__settings_global[self.project_name] = settings
+        self.__resolved_cfg_global[self.project_name] = resolved
+        self.__sources_global[self.project_name] = sources
+
+    @property
+    def settings(self):
+        """The app config validated and converted with the schema, with an attribute per item. Raises ValueError
+        if no schema was given"""
+        try:
+            return self.__settings_global[self.project_name]
+        except KeyError:
+            raise ValueError(f"No schema defined for {self.project_name}") from None
+
+    def config_sources(self) -> dict:
+        """Returns a dict with the source of each item of the app config: "default", "system file {filename}",
+        "file {filename}" or "env {variable name}". Useful for debugging where a value comes from"""
+        return dict(self.__sources_global.get(self.project_name, dict()))
+
+    def resolved_config(self) -> dict:
+        """Returns a copy of the app config resolved from all sources, as seen by config()"""
+        return copy.deepcopy(self.__resolved_cfg_global.get(self.project_name, dict()))
+
+    def reload(self) -> set:
+        """
+        Reads the config file again and replaces the app and test config of the project (shared by all instances)
+        with its contents on top of the default values. Logging is configured again only if the "log" section of
+        the file changed. If any app config item changed, calls the reload callbacks with the changed items
+        :return: a set with the names of the app config items that changed (added, modified or removed)
+        """
+        with self.__reload_lock:
+            cfg = self.load()
+            if not cfg or self.project_name not in cfg:
+                return set()
+            default_app_cfg, default_test_cfg, default_log_cfg = copy.deepcopy(
+                self.__defaults_global.get(self.project_name, (dict(), dict(), None)))
+            app_cfg = default_app_cfg
+            app_cfg.update(cfg[self.project_name])
+            test_cfg = default_test_cfg
+            test_cfg.update(cfg.get(self.test_project_name) or dict())
+            old_resolved_cfg = self.__resolved_cfg_global.get(self.project_name, dict())
+            user_items = set(cfg[self.project_name])
+            environ = self.__read_environ()
+            # Validated before changing anything, so an invalid file leaves the previous config untouched
+            resolved_cfg, sources, settings = self.__resolve_sources(app_cfg, user_items, environ)
+            # Dicts are replaced instead of updated, so readers never see a partially updated config
+            self.__app_cfg = app_cfg
+            self.__test_cfg = test_cfg
+            self.__user_items_global[self.project_name] = user_items
+            self.__store_resolved(environ, resolved_cfg, sources, settings)
+            changed = {item for item in old_resolved_cfg.keys() | resolved_cfg.keys()
+                       if old_resolved_cfg.get(item, _missing) != resolved_cfg.get(item, _missing)}
+            file_log_cfg = cfg.get("log") or dict()
+            if file_log_cfg != self.__file_log_cfg_global.get(self.project_name):
+                self.__file_log_cfg_global[self.project_name] = file_log_cfg
+                log_cfg = default_log_cfg or _default_logger_config(app_name=self.project_name,
+                                                                    log_config_path=self.log_config_path)
+                log_cfg.update(file_log_cfg)
+                self.__log_cfg = log_cfg
+                self._fix_logger_config()
+                self._configure_logging()
+            callbacks = list(self.__reload_callbacks.get(self.project_name, ()))
+        if changed:
+            for callback in callbacks:
+                callback(changed)
+        return changed
+
+    def add_reload_callback(self, callback):
+        """Adds a function to be called as callback(changed_items) each time the app config is reloaded with
+        changes, where changed_items is a set with the names of the items that changed"""
+        self.__reload_callbacks.setdefault(self.project_name, list()).append(callback)
+
+    def watch(self, callback=None, interval: float = 1.0, use_inotify: bool = True):
+        """
+        Starts watching the config file in a background thread, reloading it (see reload) each time it changes.
+        Only one watcher is started per project, calling it again just adds the callback
+        :param callback: an optional function to be called with the set of changed items after each reload
+        :param interval: seconds between checks of the file when inotify is not available
+        :param use_inotify: if True (default) uses inotify when available (linux), otherwise polls the file
+        :return: the ong_utils.file_watcher.FileWatcher thread
+        """
+        from ong_utils.file_watcher import FileWatcher
+        if callback is not None:
+            self.add_reload_callback(callback)
+        with self.__reload_lock:
+            watcher = self.__watchers.get(self.project_name)
+            if watcher is None or not watcher.is_alive():
+                watcher = FileWatcher(self.config_filename, lambda _: self.reload(), interval=interval,
+                                      use_inotify=use_inotify)
+                self.__watchers[self.project_name] = watcher
+                watcher.start()
+        return watcher
+
+    def unwatch(self):
+        """Stops watching the config file and removes all reload callbacks of the project"""
+        watcher = self.__watchers.pop(self.project_name, None)
+        if watcher is not None:
+            watcher.stop()
+        self.__reload_callbacks.pop(self.project_name, None)
+
     def _get_cfg_filename(self, ext: str = None, filename: str = None):
         if not filename:
             filename = self.project_name + ext
         return os.path.join(self.config_path, filename)
 
-    def load(self) -> dict | None:
-        """Loads contents of self.config_filename. Returns None if file does not exist,
+    def load(self, filename: str = None) -> dict | None:
+        """Loads contents of filename (defaults to self.config_filename). Returns None if file does not exist,
         a dictionary otherwise"""
-        ext = os.path.splitext(self.config_filename)[-1]
+        filename = filename or self.config_filename
+        ext = os.path.splitext(filename)[-1]
         loader, writer = self.extensions_cfg[ext]
-        if os.path.isfile(self.config_filename):
-            with open(self.config_filename, "r") as f_cfg:
+        if not os.path.isfile(filename):
+            return None
+        path = os.path.abspath(filename)
+        file_stat = os.stat(path)
+        file_stats = file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino
+        cached_stats, cfg = self.__parsed_files.get(path, (None, None))
+        if cached_stats != file_stats:
+            with open(filename, "r") as f_cfg:
                 cfg = loader(f_cfg)
-                return cfg
-        return None
+            self.__parsed_files[path] = file_stats, cfg
+        # A copy is returned, so changes in the returned value do not change the cached one
+        return copy.deepcopy(cfg)
 
     def create_default_config(self):
         """Creates a config file with the contents of the current configuration"""
@@ -150,18 +467,91 @@ class OngConfig:
         self.save()
 
     def save(self):
-        """Saves current config to the config file self.config_filename"""
-        cfg = {self.project_name: self.__app_cfg,
-               self.test_project_name: self.__test_cfg, "log": dict()}
+        """Saves current config to the config file self.config_filename. Inside a transaction, the file is written
+        when the transaction ends"""
+        if self.__transaction_depth:
+            self.__pending_save = True
+            return
+        self.__write(lambda cfg: cfg.update({self.project_name: self.__app_cfg,
+                                             self.test_project_name: self.__test_cfg}))
+
+    def __save_items(self, items: dict):
+        """Saves the given app config items to the config file, keeping the rest of items as they are in the file
+        (so items changed by other processes are not lost). Inside a transaction, they are saved when it ends"""
+        if self.__transaction_depth:
+            self.__pending_items.update(items)
+            return
+        self.__write(lambda cfg: cfg.setdefault(self.project_name, dict()).update(items))
+
+    @contextmanager
+    def __locked(self):
+        """Locks the config file for writing, both for other threads and other processes. Reentrant"""
+        path = os.path.abspath(self.config_filename)
+        with self.__write_lock:
+            if self.__file_lock_depths.get(path):
+                lock = nullcontext()
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                lock = _file_lock(path)
+            with lock:
+                self.__file_lock_depths[path] = self.__file_lock_depths.get(path, 0) + 1
+                try:
+                    yield
+                finally:
+                    self.__file_lock_depths[path] -= 1
+
+    def __write(self, modify):
+        """Reads the config file (if it exists), changes it calling modify(cfg) and writes it atomically, keeping
+        the file locked meanwhile"""
         _, ext = os.path.splitext(self.config_filename)
         loader, writer = self.extensions_cfg[ext]
-        os.makedirs(os.path.dirname(self.config_filename), exist_ok=True)
-        if os.path.isfile(self.config_filename):
-            cfg = self.load()
-            cfg[self.project_name] = self.__app_cfg
-            cfg[self.test_project_name] = self.__test_cfg
-        with open(self.config_filename, "w") as f_cfg:
-            writer(cfg, f_cfg)
+        with self.__locked():
+            cfg = self.load() or {self.project_name: self.__app_cfg,
+                                  self.test_project_name: self.__test_cfg, "log": dict()}
+            modify(cfg)
+            _atomic_write(self.config_filename, writer, cfg)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager that groups all changes of the config (add_app_config, update_app_config and save) in a
+        single write of the config file when it ends, keeping the file locked meanwhile. If an exception is
+        raised, the file is not written and the changes of the app config are undone. Can be nested.
+        Sample use:
+            with cfg.transaction():
+                cfg.update_app_config("key1", "value1")
+                cfg.update_app_config("key2", "value2")
+        """
+        with self.__locked():
+            snapshot = copy.deepcopy(self.__app_cfg), dict(self.__pending_items), self.__pending_save
+            self.__transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.__app_cfg, self.__pending_items, self.__pending_save = snapshot
+                self._resolve()
+                raise
+            finally:
+                self.__transaction_depth -= 1
+            if self.__transaction_depth == 0:
+                pending_items, self.__pending_items = self.__pending_items, dict()
+                pending_save, self.__pending_save = self.__pending_save, False
+                if pending_save:
+                    self.save()
+                elif pending_items:
+                    self.__save_items(pending_items)
+
+    def _configure_logging(self):
+        """Configures logging with the current log config, moving handlers of the project logger to a
+        QueueListener thread if queue_logging was requested"""
+        from ong_utils.logging_utils import start_queue_listener, stop_queue_listener
+        logger = logging.getLogger(self.project_name)
+        # Stop the previous listener (if any) before dictConfig closes its handlers
+        stop_queue_listener(logger, restore_handlers=True)
+        logging.config.dictConfig(self.__log_cfg)
+        if self.__queue_logging_global.get(self.project_name):
+            start_queue_listener(logger)
+        self.__logger[self.project_name] = logger
 
     def _fix_logger_config(self):
         """Replaces log_filename with the current project name, creates directories  for file logs if they don't
@@ -178,8 +568,9 @@ class OngConfig:
     def config(self, item: str, default_value=_missing):
         """Checks for a parameter in the configuration, and raises exception if not found.
         If not found but a non-None default_value is used, then default value is returned and no Exception raised"""
-        if item in self.__app_cfg:
-            return self.__app_cfg[item]
+        resolved_cfg = self.__resolved_cfg_global.get(self.project_name, self.__app_cfg)
+        if item in resolved_cfg:
+            return resolved_cfg[item]
         elif default_value is not _missing:
             return default_value
         else:
@@ -221,21 +612,43 @@ class OngConfig:
     def add_app_config(self, item: str, value):
         """Adds a new value to app_config and stores it. Raises value error if item already existed"""
         if item not in self.__app_cfg:
-            self.__app_cfg[item] = value
-            self.save()
+            self.__set_item(item, value)
         else:
             raise ValueError(f"Item {item} already existed in app config. Edit it manually")
 
     def update_app_config(self, item: str, value):
-        """Updates a value into app_config and stores it. Raises value error if item did not exist"""
-        if item in self.__app_cfg:
-            self.__app_cfg[item] = value
-            self.save()
+        """Updates a value into app_config and stores it in the config file. Raises value error if item did not
+        exist in any source (file, defaults, system file or environment variables)"""
+        if item in self.__app_cfg or item in self.__resolved_cfg_global.get(self.project_name, dict()):
+            self.__set_item(item, value)
         else:
             raise ValueError(f"Item {item} already did not existed in app config.")
 
+    def __set_item(self, item: str, value):
+        """Sets an item of the app config and saves it. If the config does not match the schema with the new value,
+        the item is restored and ValueError is raised"""
+        previous = self.__app_cfg.get(item, _missing)
+        user_items = self.__user_items_global.setdefault(self.project_name, set())
+        previous_user_item = item in user_items
+        self.__app_cfg[item] = value
+        user_items.add(item)
+        try:
+            self._resolve()
+        except ValueError:
+            if previous is _missing:
+                del self.__app_cfg[item]
+            else:
+                self.__app_cfg[item] = previous
+            if not previous_user_item:
+                user_items.discard(item)
+            raise
+        self.__save_items({item: value})
+
     def close_handlers(self, remove_handlers: bool = True):
-        """Forces close of handlers, and also remove them if remove_handlers=True (default)"""
+        """Forces close of handlers, and also remove them if remove_handlers=True (default). If queue_logging was
+        used, the QueueListener thread is stopped after processing the queued records"""
+        from ong_utils.logging_utils import stop_queue_listener
+        stop_queue_listener(self.logger, restore_handlers=True)
         handlers = self.logger.handlers[:]
         for handler in handlers:
             handler.close()
@@ -243,8 +656,28 @@ class OngConfig:
                 self.logger.removeHandler(handler)
 
 
-def _default_logger_config(app_name: str, log_config_path: str | Path= "~/.log/"):
-    """Creates a default log config, that saves to log_config path (defaults to ~/.log) """
+def _default_system_config_path() -> str:
+    """Default path of system-wide config files: %PROGRAMDATA%/ongpi in windows, /etc/ongpi otherwise"""
+    if os.name == "nt":
+        return os.path.join(os.environ.get("PROGRAMDATA", "C:\\ProgramData"), "ongpi")
+    return "/etc/ongpi"
+
+
+def _default_logger_config(app_name: str, log_config_path: str | Path= "~/.log/", json_format: bool = False,
+                           compress: bool = False, when: str = None, interval: int = 1,
+                           max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+    """
+    Creates a default log config, that saves to log_config path (defaults to ~/.log)
+    :param app_name: name of the logger and of the log file
+    :param log_config_path: folder of the log file
+    :param json_format: if True, the log file is written as json lines (see ong_utils.logging_utils.JsonFormatter)
+    :param compress: if True, rotated log files are gzipped in a background thread
+    :param when: if given, log file is rotated by time instead of by size (see
+        logging.handlers.TimedRotatingFileHandler, e.g. "midnight", "H" or "M")
+    :param interval: interval for rotation by time, in units given by when
+    :param max_bytes: size of the log file that triggers rotation, for rotation by size
+    :param backup_count: number of rotated files to keep
+    """
     log_cfg = {
         'version': 1,
         'disable_existing_loggers': False,
@@ -268,8 +701,8 @@ def _default_logger_config(app_name: str, log_config_path: str | Path= "~/.log/"
                 'class': 'logging.handlers.RotatingFileHandler',
                 # Filename will be formatted later replacing app_name placeholder. Takes into account config_path also
                 'filename': str(Path(log_config_path) /  f'{app_name}.log'),
-                'maxBytes': 10 * 1024 * 1024,
-                'backupCount': 5,
+                'maxBytes': max_bytes,
+                'backupCount': backup_count,
                 'formatter': 'detailed_formatter'
             },
         },
@@ -281,5 +714,15 @@ def _default_logger_config(app_name: str, log_config_path: str | Path= "~/.log/"
             },
         }
     }
+    logfile = log_cfg['handlers']['logfile']
+    if json_format:
+        log_cfg['formatters']['json_formatter'] = {'()': 'ong_utils.logging_utils.JsonFormatter',
+                                                   'fields': {'file': 'filename', 'line': 'lineno'}}
+        logfile['formatter'] = 'json_formatter'
+    if when is not None:
+        del logfile['maxBytes']
+        logfile.update({'class': 'logging.handlers.TimedRotatingFileHandler', 'when': when, 'interval': interval})
+    if compress:
+        logfile['class'] = logfile['class'].replace('logging.handlers.', 'ong_utils.logging_utils.Compressed')
 
     return log_cfg
@@ -0,0 +1,220 @@
+"""
+Typed schemas for OngConfig. A schema is compiled once into a converter per item, then every time the config is
+loaded all items are validated and converted at once into an object with attribute access, so call sites do not
+need to convert values again.
+A schema can be either a dataclass or a dict of item -> type or item -> (type, default value). Supported types:
+str, int, float, bool (also from strings such as "yes" or "false"), pathlib.Path (user expanded),
+datetime.timedelta (from seconds or strings such as "1h30m", "10s" or "500ms"), Optional, lists and dicts of
+those, and any other type that can be built calling type(value)
+Sample use:
+    @dataclasses.dataclass
+    class Settings:
+        url: str
+        timeout: timedelta = timedelta(seconds=30)
+        retries: int = 3
+    cfg = OngConfig("my_project", schema=Settings)
+    cfg.settings.timeout        # a timedelta
+"""
+from __future__ import annotations
+
+import copy
+import dataclasses
+import re
+import types
+import typing
+from datetime import timedelta
+from pathlib import Path
+
+_missing = dataclasses.MISSING
+_true_values = {"true", "yes", "y", "on", "1"}
+_false_values = {"false", "no", "n", "off", "0"}
+_duration_units = dict(d=86400, h=3600, m=60, s=1, ms=1e-3, us=1e-6)
+_duration_part = re.compile(r"(\d+(?:\.\d*)?)\s*(ms|us|d|h|m|s)")
+_duration = re.compile(r"(?:\s*\d+(?:\.\d*)?\s*(?:ms|us|d|h|m|s))+\s*")
+_union_types = (typing.Union, getattr(types, "UnionType", typing.Union))
+
+
+def parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in _true_values | _false_values:
+        return value.strip().lower() in _true_values
+    raise ValueError(f"{value!r} is not a boolean")
+
+
+def parse_duration(value) -> timedelta:
+    """Converts numbers (seconds) and strings such as "1h30m", "10s", "1.5d" or "500ms" to timedelta"""
+    if isinstance(value, timedelta):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return timedelta(seconds=value)
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            return timedelta(seconds=float(text))
+        except ValueError:
+            pass
+        if _duration.fullmatch(text):
+            return timedelta(seconds=sum(float(number) * _duration_units[unit]
+                                         for number, unit in _duration_part.findall(text)))
+    raise ValueError(f"{value!r} is not a duration")
+
+
+def parse_path(value) -> Path:
+    if isinstance(value, (str, Path)):
+        return Path(value).expanduser()
+    raise ValueError(f"{value!r} is not a path")
+
+
+def parse_int(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{value!r} is not an int")
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{value!r} is not an int")
+    return int(value)
+
+
+def parse_float(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{value!r} is not a float")
+    return float(value)
+
+
+def parse_str(value) -> str:
+    """Converts scalars (such as numbers read from yaml files) to str, but not lists, dicts or None"""
+    if value is None or isinstance(value, (list, tuple, set, frozenset, dict)):
+        raise ValueError(f"{value!r} is not a string")
+    return str(value)
+
+
+_parsers = {bool: parse_bool, int: parse_int, float: parse_float, str: parse_str, timedelta: parse_duration,
+            Path: parse_path}
+
+
+def make_converter(type_):
+    """Returns a function that validates and converts values to type_, raising ValueError if not possible"""
+    origin = typing.get_origin(type_)
+    args = typing.get_args(type_)
+    if type_ is typing.Any:
+        return lambda value: value
+    if origin in _union_types:
+        converters = [make_converter(arg) for arg in args if arg is not type(None)]
+        optional = len(converters) < len(args)
+
+        def convert_union(value):
+            if value is None and optional:
+                return None
+            for converter in converters:
+                try:
+                    return converter(value)
+                except (ValueError, TypeError):
+                    continue
+            raise ValueError(f"{value!r} is not a {type_}")
+        return convert_union
+    if origin in (list, tuple, set, frozenset):
+        item_converter = make_converter(args[0]) if args else (lambda value: value)
+
+        def convert_sequence(value):
+            if not isinstance(value, (list, tuple, set, frozenset)):
+                raise ValueError(f"{value!r} is not a {origin.__name__}")
+            return origin(item_converter(item) for item in value)
+        return convert_sequence
+    if origin is dict:
+        key_converter, value_converter = (make_converter(arg) for arg in args) if args else (None, None)
+
+        def convert_dict(value):
+            if not isinstance(value, dict):
+                raise ValueError(f"{value!r} is not a dict")
+            if key_converter is None:
+                return dict(value)
+            return {key_converter(k): value_converter(v) for k, v in value.items()}
+        return convert_dict
+    parser = _parsers.get(type_)
+    if parser is not None:
+        return parser
+
+    def convert(value):
+        return value if isinstance(value, type_) else type_(value)
+    return convert
+
+
+def is_structured(type_) -> bool:
+    """True if values of type_ are lists, sets, tuples or dicts (so they must be parsed from text, e.g. from
+    environment variables), or unions including any of them"""
+    origin = typing.get_origin(type_)
+    if origin in _union_types:
+        return any(is_structured(arg) for arg in typing.get_args(type_))
+    return (origin or type_) in (list, tuple, set, frozenset, dict)
+
+
+class ConfigSchema:
+    """A schema compiled into a converter per item, that builds typed objects from dicts of config values"""
+
+    def __init__(self, schema, name: str = "Settings"):
+        """
+        :param schema: a dataclass, or a dict of item -> type or item -> (type, default value)
+        :param name: name of the dataclass created for dict schemas
+        """
+        if dataclasses.is_dataclass(schema):
+            self.cls = schema
+            hints = typing.get_type_hints(schema)
+            fields = [(field.name, hints[field.name], field.default, field.default_factory)
+                      for field in dataclasses.fields(schema) if field.init]
+        else:
+            self.cls = None
+            fields = list()
+            for item, spec in schema.items():
+                type_, default = spec if isinstance(spec, tuple) else (spec, _missing)
+                fields.append((item, type_, default, _missing))
+        # Defaults are converted as any other value, whatever the style of the schema
+        self.fields = list()
+        types = dict()
+        for item, type_, default, default_factory in fields:
+            converter = make_converter(type_)
+            self.fields.append((item, converter, self.default_factory(converter, default, default_factory)))
+            types[item] = type_
+        if self.cls is None:
+            # Items without default value must be defined first
+            self.cls = dataclasses.make_dataclass(re.sub(r"\W", "_", name), [
+                (item, types[item], dataclasses.field(default_factory=default_factory))
+                for item, _, default_factory in sorted(self.fields, key=lambda field: field[2] is not _missing)],
+                                                  frozen=True)
+        # Items that cannot be built from plain strings
+        self.structured_items = {item for item, type_, *_ in fields if is_structured(type_)}
+
+    @staticmethod
+    def default_factory(converter, default=_missing, default_factory=_missing):
+        """Returns a function that builds the converted default value of an item (None defaults are not converted),
+        or _missing if the item has no default"""
+        if default is not _missing:
+            if default is not None:
+                # Defaults are converted once, and copied for each instance as they might be mutable
+                default = converter(default)
+            return lambda: copy.deepcopy(default)
+        if default_factory is not _missing:
+            def convert_default():
+                value = default_factory()
+                return value if value is None else converter(value)
+            return convert_default
+        return _missing
+
+    def build(self, values: dict, section: str = ""):
+        """Validates and converts values, returning an instance of self.cls. Items not in the schema are ignored.
+        Raises ValueError listing all items that are missing or cannot be converted"""
+        kwargs = dict()
+        errors = list()
+        for item, converter, default_factory in self.fields:
+            if item in values:
+                try:
+                    kwargs[item] = converter(values[item])
+                except (ValueError, TypeError) as e:
+                    errors.append(f"{item}: {e}")
+            elif default_factory is _missing:
+                errors.append(f"{item}: missing")
+            else:
+                kwargs[item] = default_factory()
+        if errors:
+            raise ValueError(f"Invalid config in section {section}: " + "; ".join(errors))
+        return self.cls(**kwargs)
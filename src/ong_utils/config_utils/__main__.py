@@ -0,0 +1,7 @@
+import sys
+
+from ong_utils.config_utils.config_utils import main
+
+# Guarded, as processes started with spawn (windows, macOS) import the main module again
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,31 @@
 """
 General utils to set up a default configuration file or edit it
 """
+from __future__ import annotations
 
 import ast
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
 
 import warnings
 warnings.filterwarnings("error", category=SyntaxWarning)
 
+_cache_version = 1
+
+
+class ConfigCall(NamedTuple):
+    """A call to a config function found in a file: file (relative to the scanned folder), line, function name and
+    arguments (a tuple with the config item and, optionally, the default value)"""
+    file: str
+    line: int
+    function_name: str
+    args: tuple
+
 
 def extract_parameters(call_node) -> list:
     """Returns a list. config function has 1 parameter (the config item) and the second parameter, optional
@@ -15,58 +33,354 @@ def extract_parameters(call_node) -> list:
     parameters = []
     if isinstance(call_node, ast.Call):
         # Only store parameters if the first parameter is a string
-        if isinstance(call_node.args[0], ast.Constant):
+        if call_node.args and isinstance(call_node.args[0], ast.Constant):
             args = tuple([arg.value for arg in call_node.args if isinstance(arg, ast.Constant)])
             parameters.append(args)
     return parameters
 
 
+def find_calls(source: str | bytes, function_names) -> list:
+    """Parses source once and returns a list of (function_name, args, line) of calls to any of function_names.
+    Raises SyntaxError if source cannot be parsed"""
+    function_names = frozenset(function_names)
+    calls = list()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in function_names:
+            for args in extract_parameters(node):
+                calls.append((node.func.id, args, node.lineno))
+    return calls
+
+
+def file_hash(contents: bytes) -> str:
+    return hashlib.sha1(contents).hexdigest()
+
+
+def _literal(args: tuple) -> str:
+    """Returns a string that ast.literal_eval converts back to args, a tuple of constants"""
+    return "(" + "".join(("..." if arg is Ellipsis else repr(arg)) + ", " for arg in args) + ")"
+
+
+def _scan_file(file_path: Path, function_names: tuple, cached_hash: str = None) -> tuple:
+    """Reads and parses a file. Returns its hash and its calls, or None as calls if the file cannot be parsed.
+    If the hash equals cached_hash the file is not parsed and calls is returned as False (unchanged)"""
+    contents = file_path.read_bytes()
+    contents_hash = file_hash(contents)
+    if contents_hash == cached_hash:
+        return contents_hash, False
+    try:
+        return contents_hash, find_calls(contents, function_names)
+    except (SyntaxError, ValueError):
+        return contents_hash, None
+
+
+def _scan_file_star(args: tuple) -> tuple:
+    return _scan_file(*args)
+
+
 class FindConfigCalls:
+    """
+    Finds calls to config functions (by default config(...) and test_config(...)) in all .py files of a folder,
+    returning the config items (and default values) used. Each file is parsed once (optionally in parallel, using a
+    process pool, if there are many files) and the results are cached per file, so later runs only parse again the
+    files that changed (by modification time and size, or by contents hash)
+    """
 
     function_names = ("config", "test_config")
+    # Below this number of files to parse, they are parsed in the current process
+    min_files_process_pool = 50
+
+    def iter_files(self):
+        for root, dirs, files in os.walk(self.folder_path):
+            root_path = Path(root)
+            # Skip virtual environments, by skipping "site-packages" folders with "lib" in the path
+            relative_parts_lower = [p.lower() for p in root_path.relative_to(self.folder_path).parts]
+            if "lib" in relative_parts_lower:
+                dirs[:] = [d for d in dirs if d.lower() != "site-packages"]
+            dirs.sort()
+            for filename in sorted(files):
+                if not filename.endswith(".py"):
+                    continue
+                # Skip activate_this.py that appear in virtual environments,
+                # look for that that ends with bin/activate_this.py
+                if filename == "activate_this.py" and root_path.name == "bin":
+                    continue
+                file_path = root_path / filename
+                if self.verbose:
+                    print(file_path)
+                yield file_path
+
+    def __init__(self, folder_path: str | Path, function_names: tuple = None, processes: int = 1,
+                 cache_file: str | Path = None, use_cache: bool = True, verbose: bool = False):
+        """
+        Scans folder_path for config calls
+        :param folder_path: folder to scan (recursively)
+        :param function_names: names of the config functions. Defaults to self.function_names
+        :param processes: number of processes used to parse files. Defaults to 1 (files are parsed in the current
+            process), use None for the number of cpus. With more than one process, in platforms that start processes
+            with spawn (windows, macOS) the main module is imported again by each process, so the calling script
+            must create FindConfigCalls inside an "if __name__ == '__main__':" block
+        :param cache_file: json file where results are cached per file. Defaults to a file in ~/.cache/ongpi named
+            after folder_path
+        :param use_cache: if False, cache is neither read nor written
+        :param verbose: if True, prints each file found and files that cannot be parsed
+        """
+        self.__config_parameters = dict()
+        self.folder_path = Path(folder_path).absolute()
+        if function_names is not None:
+            self.function_names = tuple(function_names)
+        self.processes = max(processes, 1) if processes is not None else os.cpu_count() or 1
+        self.verbose = verbose
+        self.use_cache = use_cache
+        self.cache_file = Path(cache_file or self.default_cache_file(self.folder_path)).expanduser()
+        self.parsed_files = list()      # Files parsed in the last scan (the rest were taken from cache)
+        self.__files = dict()
+        self.scan()
 
     def find_config_calls(self, node, function_name: str):
-        if isinstance(node, ast.Call):
-            if isinstance(node.func, ast.Name):
-                # print(node.func.id)
-                if node.func.id == function_name:
-                    if function_name not in self.__config_parameters:
-                        self.__config_parameters[function_name] = set()
-                    params = extract_parameters(node)
-                    if params:
-                        self.__config_parameters[function_name].update(params)
-        for child_node in ast.iter_child_nodes(node):
-            self.find_config_calls(child_node, function_name)
+        """Adds to config_parameters the parameters of the calls to function_name found in node (an ast node).
+        Kept for compatibility, as files are already scanned on init"""
+        config_parameters = self.__config_parameters.setdefault(function_name, set())
+        for call in ast.walk(node):
+            if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == function_name:
+                config_parameters.update(extract_parameters(call))
 
-    def iter_files(self):
-        for file_path in self.folder_path.rglob("*.py"):
-            # Skip files in a virtual environment, by looking for files with "site-packages" and "lib" in the path
-            file_path_parts_lower = list(p.lower() for p in file_path.relative_to(folder_path).parent.parts)
-            if all(p in file_path_parts_lower for p in ("site-packages", "lib")):
-                continue
-            # Skip activate_this.py that appear in virtual environments,
-            # look for that that ends with bin/activate_this.py
-            if file_path.stem == "activate_this" and file_path.parent.name == "bin":
-                continue
-            print(file_path)
-            yield file_path
-
-    def __init__(self, folder_path: str | Path):
+    @staticmethod
+    def default_cache_file(folder_path: str | Path) -> Path:
+        folder_hash = hashlib.sha1(str(Path(folder_path).absolute()).encode("utf-8")).hexdigest()[:16]
+        return Path("~/.cache/ongpi").expanduser() / f"config_calls_{folder_hash}.json"
+
+    def load_cache(self) -> dict:
+        """Returns the cached results of each file (relative path -> dict with mtime_ns, size, hash and calls), or
+        an empty dict if there is no valid cache"""
+        if not self.use_cache or not self.cache_file.is_file():
+            return dict()
+        try:
+            with self.cache_file.open() as f_cache:
+                cache = json.load(f_cache)
+        except (OSError, ValueError):
+            return dict()
+        if cache.get("version") != _cache_version or cache.get("function_names") != list(self.function_names):
+            return dict()
+        files = dict()
+        for relative_path, entry in cache.get("files", dict()).items():
+            if entry["calls"] is not None:
+                # Arguments are stored as repr, as they might be any constant (e.g. bytes). Some reprs cannot be
+                # read back (e.g. float("inf")), so those files are taken as not cached and parsed again
+                try:
+                    entry["calls"] = [(name, ast.literal_eval(args), line) for name, args, line in entry["calls"]]
+                except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                    continue
+            files[relative_path] = entry
+        return files
+
+    def save_cache(self):
+        if not self.use_cache:
+            return
+        files = dict()
+        for relative_path, entry in self.__files.items():
+            entry = dict(entry)
+            if entry["calls"] is not None:
+                entry["calls"] = [(name, _literal(args), line) for name, args, line in entry["calls"]]
+            files[relative_path] = entry
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_name(self.cache_file.name + ".tmp")
+        with tmp_file.open("w") as f_cache:
+            json.dump(dict(version=_cache_version, function_names=list(self.function_names), files=files), f_cache)
+        os.replace(tmp_file, self.cache_file)
+
+    def scan(self):
+        """Scans the folder again, parsing just the files that changed since the last scan"""
+        cache = self.__files or self.load_cache()
+        files = dict()
+        to_parse = list()
+        for file_path in self.iter_files():
+            relative_path = file_path.relative_to(self.folder_path).as_posix()
+            stat = file_path.stat()
+            cached = cache.get(relative_path)
+            if cached and cached["mtime_ns"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                files[relative_path] = cached
+            else:
+                files[relative_path] = dict(mtime_ns=stat.st_mtime_ns, size=stat.st_size, hash=None, calls=None)
+                to_parse.append((relative_path, file_path, cached))
+        tasks = [(file_path, self.function_names, cached["hash"] if cached else None)
+                 for _, file_path, cached in to_parse]
+        if len(tasks) >= self.min_files_process_pool and self.processes > 1:
+            chunksize = max(1, len(tasks) // (4 * self.processes))
+            with ProcessPoolExecutor(self.processes) as executor:
+                results = list(executor.map(_scan_file_star, tasks, chunksize=chunksize))
+        else:
+            results = [_scan_file(*task) for task in tasks]
+        self.parsed_files = list()
+        for (relative_path, file_path, cached), (contents_hash, calls) in zip(to_parse, results):
+            if calls is False:      # Same contents, just touched
+                calls = cached["calls"]
+            else:
+                self.parsed_files.append(relative_path)
+                if calls is None and self.verbose:
+                    print(f"SyntaxError: Unable to parse {file_path}")
+            files[relative_path].update(hash=contents_hash, calls=calls)
+        self.__files = files
         self.__config_parameters = dict()
-        self.folder_path = Path(folder_path)
-        for function_name in self.function_names:
-            for file_path in self.iter_files():
-                with file_path.open() as file:
-                    try:
-                        tree = ast.parse(file.read())
-                        self.find_config_calls(tree, function_name)
-                    except SyntaxError:
-                        print(f"SyntaxError: Unable to parse {file_path}")
+        for entry in files.values():
+            for function_name, args, _ in entry["calls"] or ():
+                self.__config_parameters.setdefault(function_name, set()).add(args)
+        if to_parse or len(files) != len(cache):
+            self.save_cache()
 
     @property
     def config_parameters(self) -> dict:
         return self.__config_parameters
 
+    @property
+    def calls(self) -> list:
+        """A list of ConfigCall with every call found, sorted by file and line"""
+        return [ConfigCall(relative_path, line, function_name, args)
+                for relative_path, entry in sorted(self.__files.items())
+                for function_name, args, line in sorted(entry["calls"] or (), key=lambda call: call[2])]
+
+    @property
+    def unparseable_files(self) -> list:
+        """Files that could not be parsed (e.g. syntax errors)"""
+        return [relative_path for relative_path, entry in self.__files.items() if entry["calls"] is None]
+
+
+def build_index(finder: FindConfigCalls) -> dict:
+    """
+    Returns an index of the config items used in the files scanned by finder: a dict of
+    function name -> item -> list of dicts with file, line and default (only if the call has a default value)
+    """
+    index = dict()
+    for call in finder.calls:
+        usage = dict(file=call.file, line=call.line)
+        if len(call.args) > 1:
+            usage["default"] = call.args[1]
+        index.setdefault(call.function_name, dict()).setdefault(call.args[0], list()).append(usage)
+    return index
+
+
+def find_config_file(project_name: str, config_path: str | Path = None) -> Path | None:
+    """Returns the config file that OngConfig would read for project_name, or None if it does not exist"""
+    from ong_utils.config import OngConfig
+    config_path = Path(config_path or os.environ.get("ONG_CONFIG_PATH", "~/.config/ongpi")).expanduser()
+    for ext in OngConfig.extensions_cfg:
+        if (config_path / f"{project_name}{ext}").is_file():
+            return config_path / f"{project_name}{ext}"
+    return None
+
+
+def load_config_file(config_file: str | Path) -> dict:
+    from ong_utils.config import OngConfig
+    loader, _ = OngConfig.extensions_cfg[Path(config_file).suffix]
+    with open(config_file) as f_cfg:
+        return loader(f_cfg) or dict()
+
+
+def section_names(project_name: str) -> dict:
+    """Section of the config file read by each config function"""
+    return dict(config=project_name, test_config=f"{project_name}_test")
+
+
+def diff_config(index: dict, config: dict, project_name: str) -> dict:
+    """
+    Compares the items used in code (index, as returned by build_index) with the items of a config file
+    :param index: index of items used in code
+    :param config: contents of the config file
+    :param project_name: name of the project (section of the config file)
+    :return: a dict of section -> dict with "missing" (items used without default value but not in config),
+        "missing_with_default" (items used with a default value and not in config) and "unused" (items in
+        config not used in code), each one a sorted list
+    """
+    result = dict()
+    for function_name, section in section_names(project_name).items():
+        used = index.get(function_name, dict())
+        defined = set(config.get(section) or dict())
+        # Items are sorted as str, as they might be any constant (e.g. bytes)
+        missing = sorted((item for item, usages in used.items()
+                          if item not in defined and not any("default" in usage for usage in usages)), key=str)
+        missing_with_default = sorted((item for item in used if item not in defined and item not in missing),
+                                      key=str)
+        unused = sorted((item for item in defined if item not in used), key=str)
+        result[section] = dict(missing=missing, missing_with_default=missing_with_default, unused=unused)
+    return result
+
+
+def default_config(index: dict, project_name: str) -> dict:
+    """Returns the contents of a default config file with all items used in code, with their default value
+    (the first one found) or None if they have no default"""
+    config = dict()
+    for function_name, section in section_names(project_name).items():
+        items = index.get(function_name)
+        if items:
+            config[section] = {item: next((usage["default"] for usage in usages if "default" in usage), None)
+                               for item, usages in sorted(items.items(), key=lambda item: str(item[0]))}
+    return config
+
+
+def main(argv: list = None) -> int:
+    import argparse
+    from ong_utils.config import yaml_dump
+    parser = argparse.ArgumentParser(prog="python -m ong_utils.config_utils",
+                                     description="Finds the config items used in a project and compares them with "
+                                                 "its config file. Only files changed since the last run are "
+                                                 "parsed again")
+    parser.add_argument("folder", nargs="?", default=".", help="folder of the project (defaults to current)")
+    parser.add_argument("--project", default=None,
+                        help="project name (section of the config file), defaults to the folder name")
+    parser.add_argument("--config-file", default=None,
+                        help="config file to compare with, defaults to the one OngConfig reads for the project")
+    parser.add_argument("--cache-file", default=None, help="file where the index is persisted between runs")
+    parser.add_argument("--index", default=None, metavar="FILE",
+                        help="writes the index of items used (file, line and default) as json to FILE (- for stdout)")
+    parser.add_argument("--default-config", default=None, metavar="FILE",
+                        help="writes a default yaml config file with all items used in code to FILE (- for stdout)")
+    parser.add_argument("--check", action="store_true",
+                        help="exit with error code if items used without default value are missing in config file")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="processes used to parse files, defaults to the number of cpus")
+    args = parser.parse_args(argv)
+
+    folder = Path(args.folder).absolute()
+    project_name = args.project or folder.name
+    finder = FindConfigCalls(folder, cache_file=args.cache_file, processes=args.processes or os.cpu_count())
+    index = build_index(finder)
+    print(f"Scanned {folder}: {len(finder.parsed_files)} files parsed, "
+          f"{sum(len(items) for items in index.values())} config items found", file=sys.stderr)
+    for relative_path in finder.unparseable_files:
+        print(f"Unable to parse {relative_path}", file=sys.stderr)
+    if args.index:
+        contents = json.dumps({function_name: {item if isinstance(item, str) else repr(item): usages
+                                               for item, usages in items.items()}
+                               for function_name, items in index.items()}, indent=2, default=repr)
+        if args.index == "-":
+            print(contents)
+        else:
+            Path(args.index).write_text(contents)
+    if args.default_config:
+        contents = yaml_dump(default_config(index, project_name), sort_keys=False)
+        if args.default_config == "-":
+            print(contents)
+        else:
+            Path(args.default_config).write_text(contents)
+
+    # Report goes to stderr if stdout is used for the index or the default config
+    report_file = sys.stderr if "-" in (args.index, args.default_config) else sys.stdout
+    config_file = args.config_file or find_config_file(project_name)
+    if config_file is None:
+        print(f"No config file found for project {project_name}", file=report_file)
+        return 1 if args.check else 0
+    diff = diff_config(index, load_config_file(config_file), project_name)
+    print(f"Config file {config_file}:", file=report_file)
+    for function_name, section in section_names(project_name).items():
+        usages = index.get(function_name, dict())
+        for kind, items in diff[section].items():
+            for item in items:
+                where = ", ".join(f"{usage['file']}:{usage['line']}" for usage in usages.get(item, ()))
+                print(f"{kind.replace('_', ' ')}: {section}.{item}" + (f" ({where})" if where else ""),
+                      file=report_file)
+    if args.check and any(section_diff["missing"] for section_diff in diff.values()):
+        return 1
+    return 0
+
 
 if __name__ == '__main__':
     # Example usage:
@@ -74,4 +388,4 @@ if __name__ == '__main__':
     # folder_path = '/Users/oneirag/PycharmProjects/commodity_data'
     # folder_path = Path.cwd().parent.parent.parent
     print(folder_path)
-    print(FindConfigCalls(folder_path).config_parameters)
\ No newline at end of file
+    print(FindConfigCalls(folder_path).config_parameters)
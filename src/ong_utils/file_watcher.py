@@ -0,0 +1,153 @@
+"""
+Watches a file for changes in a background thread, calling a function each time it changes.
+In linux it uses inotify (through ctypes, so no extra dependencies are needed) to be notified as soon as the file
+changes, otherwise it polls the file stats (modification time, size and inode) every interval seconds.
+The parent directory is watched instead of the file, so changes made by editors that replace the file (writing a
+new file and renaming it) are also detected.
+Sample use:
+    from ong_utils.file_watcher import FileWatcher
+    watcher = FileWatcher("~/.config/ongpi/my_project.yaml", lambda path: print(f"{path} changed"))
+    watcher.start()
+    ...
+    watcher.stop()
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_inotify_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_inotify_event = struct.Struct("iIII")  # wd, mask, cookie, len (followed by a name of len bytes)
+
+
+def file_stats(path: str | Path) -> tuple | None:
+    """Returns a tuple that changes whenever the file changes (modification time, size and inode), or None
+    if the file does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class _Inotify:
+    """Minimal inotify wrapper using libc through ctypes. Raises OSError if inotify is not available"""
+
+    def __init__(self, directory: str | Path):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available in linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        for func in "inotify_init1", "inotify_add_watch":
+            if not hasattr(libc, func):
+                raise OSError(f"{func} not found in libc")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), _inotify_mask) < 0:
+            errno = ctypes.get_errno()
+            self.close()
+            raise OSError(errno, os.strerror(errno))
+
+    def wait(self, timeout: float) -> set:
+        """Waits up to timeout seconds for events, returns the set of file names (as str) that changed"""
+        names = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return names
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset + _inotify_event.size <= len(data):
+            _, _, _, length = _inotify_event.unpack_from(data, offset)
+            offset += _inotify_event.size
+            names.add(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FileWatcher(threading.Thread):
+    """A daemon thread that calls on_change(path) each time the file in path changes (is modified, created,
+    replaced or deleted). Exceptions raised by on_change are logged and do not stop the watcher"""
+
+    def __init__(self, path: str | Path, on_change, interval: float = 1.0, use_inotify: bool = True):
+        """
+        :param path: the file to watch
+        :param on_change: function called (from the watcher thread) with path as argument when the file changes
+        :param interval: seconds between checks of the file stats when polling. When using inotify, stats are
+            also checked every interval seconds, just in case an event was missed
+        :param use_inotify: if True (default) uses inotify if available, otherwise always polls
+        """
+        super().__init__(name=f"FileWatcher({path})", daemon=True)
+        self.path = Path(path).expanduser().absolute()
+        self.on_change = on_change
+        self.interval = interval
+        self.__stop_event = threading.Event()
+        self.__stats = file_stats(self.path)
+        self.__inotify = None
+        if use_inotify:
+            try:
+                self.__inotify = _Inotify(self.path.parent)
+            except OSError as e:
+                logger.debug(f"inotify not available, polling {self.path} instead: {e}")
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self.__inotify is not None
+
+    def run(self):
+        try:
+            while not self.__stop_event.is_set():
+                if self.__inotify is not None:
+                    self.__inotify.wait(self.interval)
+                else:
+                    self.__stop_event.wait(self.interval)
+                if not self.__stop_event.is_set():
+                    self.check()
+        finally:
+            if self.__inotify is not None:
+                self.__inotify.close()
+
+    def check(self) -> bool:
+        """Calls on_change if the file changed since the last check. Returns True if it changed"""
+        stats = file_stats(self.path)
+        if stats == self.__stats:
+            return False
+        self.__stats = stats
+        try:
+            self.on_change(self.path)
+        except Exception as e:
+            logger.exception(f"Error processing changes of {self.path}: {e}")
+        return True
+
+    def stop(self, timeout: float = None):
+        """Stops the watcher and waits (up to timeout seconds) for the thread to finish"""
+        self.__stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
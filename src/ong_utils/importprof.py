@@ -0,0 +1,136 @@
+"""
+Measures import time of ong_utils submodules and of the heavy third party libraries they depend on,
+grouped by the extra that installs them (base, ui, xlsx, jwt, selenium, credentials, office, shortcuts,
+storage).
+Each module is imported in a fresh interpreter using "python -X importtime", so results do not depend on
+what was imported before.
+Usage:
+    python -m ong_utils.importprof                      # Prints a table sorted by cumulative time
+    python -m ong_utils.importprof --sort self          # Sorts by self time (also: name, extra)
+    python -m ong_utils.importprof --extra xlsx jwt     # Profiles only some extras
+    python -m ong_utils.importprof --json report.json   # Also writes results as json ("-" for stdout)
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+# Modules to profile, grouped by the extra that installs their dependencies
+profiled_modules = {
+    "base": ("ong_utils", "ong_utils.config", "ong_utils.internal_storage", "ong_utils.timers",
+             "ong_utils.urllib3_utils", "ong_utils.utils", "ong_utils.parse_html", "ong_utils.web",
+             "ong_utils.async_utils", "ong_utils.file_watcher", "ong_utils.config_schema",
+             "ong_utils.logging_utils", "ong_utils.config_utils.config_utils",
+             "yaml", "ujson", "keyring", "keyring.backends.SecretService", "keyring.backends.Windows",
+             "keyring.backends.macOS", "urllib3", "certifi", "OpenSSL", "dateutil.tz", "nest_asyncio"),
+    "ui": ("ong_utils.ui", "ong_utils.ui_logging_utils", "tkinter"),
+    "xlsx": ("ong_utils.excel", "ong_utils.sensitivity_labels", "pandas", "openpyxl"),
+    "jwt": ("ong_utils.jwt_tokens", "jwt"),
+    "selenium": ("ong_utils.selenium_chrome", "selenium", "seleniumwire", "undetected_chromedriver"),
+    "credentials": ("ong_utils.credentials", "pam", "win32security"),
+    "office": ("ong_utils.office.office_base", "win32com"),
+    "shortcuts": ("ong_utils.desktop_shortcut", "pyshortcuts"),
+    "storage": ("ong_utils.internal_storage_backends", "cryptography.fernet"),
+}
+
+sort_keys = ("cumulative", "self", "name", "extra")
+
+_importtime_line = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(.*)$")
+
+
+def parse_importtime(output: str) -> dict:
+    """Parses the stderr of "python -X importtime" into a dict of module name -> (self, cumulative) in
+    microseconds"""
+    times = dict()
+    for line in output.splitlines():
+        if match := _importtime_line.match(line):
+            self_us, cumulative_us, name = match.groups()
+            times[name.strip()] = int(self_us), int(cumulative_us)
+    return times
+
+
+def profile_module(module: str, extra: str = None, python: str = sys.executable) -> dict:
+    """
+    Imports module in a fresh interpreter and returns its import times
+    :param module: the name of the module to import
+    :param extra: the extra the module belongs to (just informative)
+    :param python: the python interpreter to use (defaults to the current one)
+    :return: a dict with keys name, extra, self and cumulative (in seconds, None if import failed) and
+        error (None if module could be imported)
+    """
+    proc = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True)
+    self_us, cumulative_us = parse_importtime(proc.stderr).get(module, (None, None))
+    error = None
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["Unknown error"])[-1]
+        self_us = cumulative_us = None
+    return dict(name=module, extra=extra,
+                self=None if self_us is None else self_us / 1e6,
+                cumulative=None if cumulative_us is None else cumulative_us / 1e6,
+                error=error)
+
+
+def profile(extras: list = None, python: str = sys.executable) -> list:
+    """Profiles all modules of the given extras (defaults to all of them). Returns a list of dicts as
+    returned by profile_module"""
+    results = list()
+    for extra, modules in profiled_modules.items():
+        if extras and extra not in extras:
+            continue
+        for module in modules:
+            results.append(profile_module(module, extra=extra, python=python))
+    return results
+
+
+def sort_results(results: list, sort_by: str = "cumulative") -> list:
+    """Sorts results by any of sort_keys. Times are sorted descending, with failed imports last"""
+    if sort_by not in sort_keys:
+        raise ValueError(f"Invalid sort key {sort_by}. Valid values are {sort_keys}")
+    if sort_by in ("name", "extra"):
+        return sorted(results, key=lambda r: (r[sort_by], r["name"]))
+    return sorted(results, key=lambda r: (r[sort_by] is None, -(r[sort_by] or 0)))
+
+
+def format_table(results: list, decimal_places: int = 3) -> str:
+    """Formats results as a text table"""
+    header = ("extra", "module", "self (s)", "cumulative (s)", "error")
+    rows = [tuple(str(v) for v in header)]
+    for r in results:
+        rows.append((r["extra"] or "", r["name"],
+                     "" if r["self"] is None else f"{r['self']:.{decimal_places}f}",
+                     "" if r["cumulative"] is None else f"{r['cumulative']:.{decimal_places}f}",
+                     r["error"] or ""))
+    widths = [max(len(row[idx]) for row in rows) for idx in range(len(header))]
+    lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m ong_utils.importprof",
+                                     description="Measures import time of ong_utils and its dependencies")
+    parser.add_argument("--extra", nargs="*", choices=list(profiled_modules), default=None,
+                        help="extras to profile (defaults to all)")
+    parser.add_argument("--sort", choices=sort_keys, default="cumulative", help="column to sort table by")
+    parser.add_argument("--json", default=None, metavar="FILE",
+                        help="writes results as json to FILE (use - for stdout, no table will be printed)")
+    parser.add_argument("--python", default=sys.executable, help="python interpreter to profile")
+    args = parser.parse_args(argv)
+
+    results = sort_results(profile(args.extra, python=args.python), args.sort)
+    report = dict(python=args.python, results=results)
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+        return
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w") as f_json:
+            json.dump(report, f_json, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,27 @@
 """
-Class to permanently store data using keyring
+Class to permanently store data using keyring (or any other backend with the same contract, see
+ong_utils.internal_storage_backends)
 """
+import asyncio
 import base64
+import copy
+import datetime
 import json
+import lzma
+import re
+import secrets
+import threading
+import time
 import zlib
-from textwrap import wrap
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
 import keyring
 import keyring.errors
 
+_missing = object()  # To tell a cached None from a value not found in cache
+
 
 def compress_string(input_string: str) -> str:
     """Compresses a string into another string utf-8 encoded"""
@@ -39,14 +52,149 @@ def decompress_string(compressed_string: str) -> str:
     return decompressed_string
 
 
+class InternalStorageCache:
+    """LRU cache of deserialized values, bounded in size and optionally in time to live (in seconds)"""
+
+    def __init__(self, max_size: int = 128, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__values = OrderedDict()       # key -> (expiry time, value)
+        self.__lock = threading.Lock()
+
+    def get(self, key: str):
+        """Returns a copy of the cached value for key, or _missing if not found or expired"""
+        with self.__lock:
+            expiry, value = self.__values.get(key, (None, _missing))
+            if value is not _missing and expiry is not None and expiry < time.monotonic():
+                del self.__values[key]
+                value = _missing
+            if value is _missing:
+                self.misses += 1
+                return _missing
+            self.hits += 1
+            self.__values.move_to_end(key)
+        # A copy is returned, so changes in the returned value do not change the cache
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value):
+        """Caches a copy of value, discarding the least recently used values if max_size is exceeded"""
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        value = copy.deepcopy(value)
+        with self.__lock:
+            self.__values[key] = expiry, value
+            self.__values.move_to_end(key)
+            while len(self.__values) > self.max_size:
+                self.__values.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self.__lock:
+            self.__values.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__values.clear()
+            self.hits = self.misses = 0
+
+    def info(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, size=len(self.__values), max_size=self.max_size,
+                    ttl=self.ttl)
+
+
+# Maximum size of secrets (in characters) of keyring backends, by backend module. None means no known limit
+backend_max_secret_sizes = {
+    "keyring.backends.Windows": 1280,           # 2560 bytes of Windows Credential Manager, stored as utf-16
+    "keyring.backends.SecretService": None,
+    "keyring.backends.libsecret": None,
+    "keyring.backends.kwallet": None,
+    "keyrings.alt.file": None,
+}
+
+
+def backend_chunk_size(backend=None, default: int = 1000, unbounded: int = 1024 * 1024) -> int:
+    """
+    Returns the maximum chunk size that can be stored in a keyring backend
+    :param backend: the keyring backend (defaults to keyring.get_keyring()). Backends can declare their limit
+        in a max_secret_size attribute (None for no limit)
+    :param default: chunk size for backends whose limits are not known
+    :param unbounded: chunk size for backends without limit
+    :return: the chunk size
+    """
+    if backend is None or backend is keyring:
+        backend = keyring.get_keyring()
+    if (max_secret_size := getattr(backend, "max_secret_size", _missing)) is not _missing:
+        return max_secret_size or unbounded
+    # Chainer backends store in the first backend that works, so they are limited by the most restrictive one
+    backends = getattr(backend, "backends", None) or [backend]
+    sizes = list()
+    for backend in backends:
+        module = type(backend).__module__
+        if module in backend_max_secret_sizes:
+            sizes.append(backend_max_secret_sizes[module] or unbounded)
+        else:
+            sizes.append(default)
+    return min(sizes)
+
+
 class InternalStorageBase:
-    def __init__(self, app_name: str):
+    # Caches shared among all instances with the same app_name (and backend)
+    __caches = dict()
+    # Executor shared among all instances to run blocking backend calls of async methods
+    async_max_workers = 8
+    __executor = None
+    __executor_lock = threading.Lock()
+
+    def __init__(self, app_name: str, cache_size: int = 0, cache_ttl: float = None, backend=None):
+        """
+        Creates an object to store values in keyring for the given app_name
+        :param app_name: name of the app (the service name for keyring)
+        :param cache_size: if greater than 0 (defaults to 0, no cache), read values are cached in memory, up to
+            cache_size values. The cache is shared among all instances with the same app_name and invalidated
+            when values are stored or removed
+        :param cache_ttl: optional maximum time (in seconds) that a value can be served from cache
+        :param backend: an object with the keyring contract (set_password, get_password and delete_password
+            methods, raising keyring.errors.PasswordDeleteError when deleting a missing value) where values are
+            stored. Defaults to keyring. See ong_utils.internal_storage_backends for other backends
+        """
         self.__app_name = app_name
+        self.__backend = backend or keyring
+        self.__use_cache = cache_size > 0
+        if self.__use_cache and self.__cache_key not in self.__caches:
+            self.__caches[self.__cache_key] = InternalStorageCache(max_size=cache_size, ttl=cache_ttl)
 
     @property
     def app_name(self) -> str:
         return self.__app_name
 
+    @property
+    def backend(self):
+        return self.__backend
+
+    @property
+    def __cache_key(self) -> tuple:
+        return self.app_name, self.backend
+
+    @property
+    def cache(self) -> InternalStorageCache | None:
+        """The cache for this app_name, or None if this instance does not use cache"""
+        return self.__caches.get(self.__cache_key) if self.__use_cache else None
+
+    def cache_info(self) -> dict | None:
+        """Returns a dict with hits, misses, size, max_size and ttl of the cache (None if cache is not used)"""
+        return self.cache.info() if self.cache else None
+
+    def invalidate_cache(self, key: str):
+        """Removes key from cache. It is done even if this instance does not use cache, as others might"""
+        cache = self.__caches.get(self.__cache_key)
+        if cache is not None:
+            cache.invalidate(key)
+
+    def batch(self):
+        """Context manager to group several writes in a single transaction, for backends that support it"""
+        batch = getattr(self.backend, "batch", None)
+        return batch() if batch is not None else nullcontext()
+
     def serialize(self, value) -> str:
         """Serializes and compresses an object into a string."""
         return compress_string(json.dumps(value))
@@ -57,19 +205,39 @@ class InternalStorageBase:
             return None
         return json.loads(decompress_string(value))
 
-    def store_value_raw(self, key: str, value):
-        keyring.set_password(self.app_name, key, value)
-        assert value == InternalStorageBase(self.app_name).get_value_raw(key)
+    def store_value_raw(self, key: str, value, verify: bool = True):
+        """Stores value in keyring. If verify=True (default) reads it back to check it was properly stored"""
+        self.invalidate_cache(key)
+        self.backend.set_password(self.app_name, key, value)
+        if verify:
+            assert value == InternalStorageBase.get_value_raw(self, key)
 
     def get_value_raw(self, key: str):
-        return keyring.get_password(self.app_name, key)
+        return self.backend.get_password(self.app_name, key)
 
     def remove_stored_value(self, key: str):
+        self.invalidate_cache(key)
         try:
-            keyring.delete_password(self.app_name, key)
+            self.backend.delete_password(self.app_name, key)
         except keyring.errors.PasswordDeleteError:
             pass
 
+    @classmethod
+    def executor(cls) -> ThreadPoolExecutor:
+        """Returns the executor (with at most async_max_workers threads) where async methods run backend calls"""
+        with cls.__executor_lock:
+            if InternalStorageBase.__executor is None:
+                InternalStorageBase.__executor = ThreadPoolExecutor(max_workers=cls.async_max_workers,
+                                                                    thread_name_prefix="InternalStorage")
+            return InternalStorageBase.__executor
+
+    async def run_in_executor(self, func, *args):
+        """Runs a blocking function in the executor, without blocking the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor(), func, *args)
+
+    async def aget_value_raw(self, key: str):
+        return await self.run_in_executor(self.get_value_raw, key)
+
 
 class InternalStorageV0(InternalStorageBase):
 
@@ -94,18 +262,74 @@ class InternalStorageV0(InternalStorageBase):
         except:
             return None
 
-    def store_value(self, key: str, value):
-        """Stores something in keyring"""
+    def store_value(self, key: str, value, verify: bool = True):
+        """Stores something in keyring. If verify=True (default) every write is read back to check it"""
         store_value = self.serialize(value)
-        self.store_value_raw(key, store_value)
+        self.store_value_raw(key, store_value, verify=verify)
 
     def get_value(self, key: str):
+        cache = self.cache
+        if cache is not None:
+            if (cached := cache.get(key)) is not _missing:
+                return cached
         stored_value = self.get_value_raw(key)
         if stored_value is None:
             return
         original = self.deserialize(value=stored_value)
+        if cache is not None:
+            cache.set(key, original)
+        return original
+
+    def get_many(self, keys, concurrent: bool = False) -> dict:
+        """Returns a dict of key -> stored value (None if not found) for all the given keys. If concurrent=True,
+        keys are read concurrently using aget_many"""
+        if concurrent:
+            from ong_utils.async_utils import asyncio_run
+            return asyncio_run(self.aget_many(keys))
+        return {key: self.get_value(key) for key in keys}
+
+    def store_many(self, mapping: dict, verify: bool = False):
+        """Stores all values of a dict of key -> value. Unlike store_value, by default writes are not read back
+        (use verify=True for that)"""
+        with self.batch():
+            for key, value in mapping.items():
+                self.store_value(key, value, verify=verify)
+
+    def remove_many(self, keys):
+        """Removes the values stored under all the given keys"""
+        with self.batch():
+            for key in keys:
+                self.remove_stored_value(key)
+
+    async def aget_value(self, key: str):
+        """Async version of get_value. Backend calls run in a thread pool (see executor), so the event loop is
+        not blocked. Sync code can use ong_utils.async_utils.asyncio_run to call it"""
+        cache = self.cache
+        if cache is not None:
+            if (cached := cache.get(key)) is not _missing:
+                return cached
+        stored_value = await self.aget_value_raw(key)
+        if stored_value is None:
+            return
+        original = self.deserialize(value=stored_value)
+        if cache is not None:
+            cache.set(key, original)
         return original
 
+    async def astore_value(self, key: str, value, verify: bool = True):
+        """Async version of store_value"""
+        await self.run_in_executor(self.store_value, key, value, verify)
+
+    async def aremove_stored_value(self, key: str):
+        """Async version of remove_stored_value"""
+        await self.run_in_executor(self.remove_stored_value, key)
+
+    async def aget_many(self, keys) -> dict:
+        """Async version of get_many, that reads all keys concurrently"""
+        keys = list(keys)
+        values = await asyncio.gather(*(self.aget_value(key) for key in keys))
+        return dict(zip(keys, values))
+
 
 class InternalStorageV1(InternalStorageV0):
     chunk_size = 1000
@@ -116,38 +340,62 @@ class InternalStorageV1(InternalStorageV0):
         return 1
 
     def chunk(self, store_value: str) -> list:
-        """Splits a string into parts of a maximum size"""
-        return wrap(store_value, self.chunk_size)
+        """Splits a string into parts of a maximum size (slicing it, as stored values have no whitespaces to
+        wrap at)"""
+        return [store_value[idx:idx + self.chunk_size] for idx in range(0, len(store_value), self.chunk_size)]
 
-    def store_value_raw(self, key: str, value):
+    def store_value_raw(self, key: str, value, verify: bool = True):
         chunks = self.chunk(value)
-        header = self.make_header(chunks=len(chunks))
-        super().store_value_raw(key, self.serialize(header))
-        for chunk_key, chunk_value in zip(self.iter_chunk_keys(key), chunks):
-            super().store_value_raw(chunk_key, chunk_value)
+        header = self.value_header(value, chunks)
+        super().store_value_raw(key, self.serialize(header), verify=verify)
+        for chunk_key, chunk_value in zip(self.iter_chunk_keys(key, header), chunks):
+            super().store_value_raw(chunk_key, chunk_value, verify=verify)
+
+    def value_header(self, value: str, chunks: list) -> dict:
+        """Returns the header to store for value once split into chunks"""
+        return self.make_header(chunks=len(chunks))
 
     def chunk_name(self, key: str, idx_chunk: int) -> str:
         return f"{key}_{idx_chunk}"
 
-    def iter_chunk_keys(self, key: str) -> str:
-        """Return a list of chunk keys associated to the header found"""
-        header = self.deserialize(super().get_value_raw(key))
+    def read_header(self, key: str) -> tuple:
+        """Reads the value stored under key. Returns a tuple with the raw value and the header (None if the raw
+        value is not a valid header), so the header does not need to be read again"""
+        raw_value = super().get_value_raw(key)
+        header = self.deserialize(raw_value)
+        return raw_value, header if self.header_valid(header) else None
+
+    def iter_chunk_keys(self, key: str, header: dict = None) -> str:
+        """Return a list of chunk keys associated to the header found. If header is not given, it is read"""
+        if header is None:
+            _, header = self.read_header(key)
         if self.header_valid(header):
             for idx_chunk in range(header['chunks']):
                 yield self.chunk_name(key, idx_chunk)
 
     def get_value_raw(self, key: str):
-        header = self.deserialize(super().get_value_raw(key))
-        if not self.header_valid(header):
-            return super().get_value_raw(key)
+        raw_value, header = self.read_header(key)
+        if header is None:
+            return raw_value
         raw_values = list()
-        for chunk_key in self.iter_chunk_keys(key):
+        for chunk_key in self.iter_chunk_keys(key, header):
             raw_value = super().get_value_raw(chunk_key)
             if raw_value is None:
                 return None
             raw_values.append(raw_value)
         return "".join(raw_values)
 
+    async def aget_value_raw(self, key: str):
+        """Async version of get_value_raw, that reads all chunks concurrently once the header has been read"""
+        raw_value, header = await self.run_in_executor(self.read_header, key)
+        if header is None:
+            return raw_value
+        raw_values = await asyncio.gather(*(self.run_in_executor(InternalStorageBase.get_value_raw, self, chunk_key)
+                                            for chunk_key in self.iter_chunk_keys(key, header)))
+        if any(raw_value is None for raw_value in raw_values):
+            return None
+        return "".join(raw_values)
+
     def remove_stored_value(self, key: str):
         """Removes values stored under key (header + all chunks)"""
         for chunk_key in self.iter_chunk_keys(key):
@@ -164,6 +412,276 @@ class InternalStorageV1(InternalStorageV0):
         return False
 
 
+_type_tag = "__ong_type__"
+
+
+class _TaggedJSONEncoder(json.JSONEncoder):
+    """Encodes bytes, dates, datetimes and sets (not json-serializable) as dicts tagged with their type"""
+
+    def default(self, o):
+        if isinstance(o, (bytes, bytearray)):
+            return {_type_tag: "bytes", "value": base64.b64encode(o).decode('ascii')}
+        if isinstance(o, datetime.datetime):
+            return {_type_tag: "datetime", "value": o.isoformat()}
+        if isinstance(o, datetime.date):
+            return {_type_tag: "date", "value": o.isoformat()}
+        if isinstance(o, (set, frozenset)):
+            return {_type_tag: "set", "value": list(o)}
+        return super().default(o)
+
+
+_tagged_decoders = {
+    "bytes": lambda v: base64.b64decode(v),
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "set": set,
+    "dict": dict,
+}
+
+
+def _escape_tagged(value):
+    """Returns a copy of value where dicts with the key _type_tag are tagged as "dict" (with their items as a list
+    of pairs), so they are not decoded as other types"""
+    if isinstance(value, dict):
+        escaped = {key: _escape_tagged(item) for key, item in value.items()}
+        if _type_tag in escaped:
+            return {_type_tag: "dict", "value": [list(item) for item in escaped.items()]}
+        return escaped
+    if isinstance(value, (list, tuple)):
+        return [_escape_tagged(item) for item in value]
+    return value
+
+
+def _tagged_object_hook(obj: dict):
+    """Decodes dicts created by _TaggedJSONEncoder back to their original type"""
+    if _type_tag in obj:
+        return _tagged_decoders[obj[_type_tag]](obj["value"])
+    return obj
+
+
+class InternalStorageV2(InternalStorageV1):
+    """
+    Chooses the most compact codec for every value: short values are stored as plain json, and long ones are
+    compressed with zlib or lzma (the biggest and most redundant ones). The codec is recorded in the header and as a prefix of the
+    stored value (so it can be decoded without the header).
+    Also stores bytes, dates, datetimes and sets, that are not json-serializable.
+    Writes are crash-safe: chunks are stored under keys stamped with a new random generation and the header is
+    written last, so it never points to missing or stale chunks (neither if several writers store the same key at
+    the same time, as each one writes its own chunks). Chunks of the previous generation are removed afterwards,
+    and the ones left behind by crashes can be removed with vacuum.
+    Values stored with InternalStorageV1 (and InternalStorageV0) can be read
+    """
+    raw_max_size = 100              # Values whose json is shorter are not compressed
+    # Values whose json is longer than lzma_min_size and that zlib compresses below lzma_max_ratio of their size
+    # are also compressed with lzma, keeping the smallest. lzma only beats zlib for very redundant data, and
+    # it is several times slower (see tests/benchmark_internal_storage.py), so the fastest preset is used
+    lzma_min_size = 64 * 1024
+    lzma_max_ratio = 0.25
+    lzma_preset = 0
+    codecs = {"r": "raw", "z": "zlib", "x": "lzma"}
+    codec_sep = ":"                 # Separates codec prefix from value. Not in base64 alphabet, unlike V0 values
+    _chunk_name_pattern = re.compile(r"(.+)#\d+\.\d+")    # Group is the key the chunk belongs to
+    generation_bits = 32            # Generations are random, so concurrent writes of a key do not share chunks
+
+    max_chunk_size = 1024 * 1024    # Chunk size for backends without a known limit in the size of secrets
+
+    def __init__(self, app_name: str, cache_size: int = 0, cache_ttl: float = None, backend=None,
+                 chunk_size: int = None):
+        """
+        Creates an object to store values in keyring for the given app_name
+        :param app_name: name of the app (the service name for keyring)
+        :param cache_size: if greater than 0 (defaults to 0, no cache), read values are cached in memory
+        :param cache_ttl: optional maximum time (in seconds) that a value can be served from cache
+        :param backend: where values are stored (defaults to keyring)
+        :param chunk_size: maximum size of every stored chunk. Defaults to the maximum secret size
+            of the backend (see backend_chunk_size)
+        """
+        super().__init__(app_name, cache_size=cache_size, cache_ttl=cache_ttl, backend=backend)
+        self.__chunk_size = chunk_size
+
+    @property
+    def chunk_size(self) -> int:
+        if self.__chunk_size is None:
+            # Detected in first use, as getting the keyring backend can be slow
+            self.__chunk_size = backend_chunk_size(self.backend, default=InternalStorageV1.chunk_size,
+                                                   unbounded=self.max_chunk_size)
+        return self.__chunk_size
+
+    @property
+    def version(self):
+        return 2
+
+    def make_header(self, chunks: int = 0, codec: str = None, chunk_size: int = None,
+                    generation: int = None) -> dict:
+        return dict(version=self.version, class_name=self.__class__.__name__, chunks=chunks, codec=codec,
+                    chunk_size=chunk_size, generation=generation)
+
+    def encode(self, value) -> tuple:
+        """Returns a tuple of codec prefix and the encoded value (without prefix)"""
+        json_value = json.dumps(value, cls=_TaggedJSONEncoder, separators=(",", ":"))
+        if _type_tag in json_value:
+            # Value might have dicts with the key used to tag types, that must be escaped
+            json_value = json.dumps(_escape_tagged(value), cls=_TaggedJSONEncoder, separators=(",", ":"))
+        if len(json_value) < self.raw_max_size:
+            return "r", json_value
+        json_bytes = json_value.encode('utf-8')
+        prefix, compressed = "z", zlib.compress(json_bytes)
+        if len(json_bytes) >= self.lzma_min_size and len(compressed) < len(json_bytes) * self.lzma_max_ratio:
+            lzma_compressed = lzma.compress(json_bytes, preset=self.lzma_preset)
+            if len(lzma_compressed) < len(compressed):
+                prefix, compressed = "x", lzma_compressed
+        compressed = base64.b64encode(compressed).decode('ascii')
+        if len(compressed) >= len(json_value):
+            # Compression did not help (e.g. random data)
+            return "r", json_value
+        return prefix, compressed
+
+    def decode(self, prefix: str, value: str):
+        """Decodes a value encoded by encode with the given codec prefix"""
+        if prefix == "z":
+            value = zlib.decompress(base64.b64decode(value)).decode('utf-8')
+        elif prefix == "x":
+            value = lzma.decompress(base64.b64decode(value)).decode('utf-8')
+        if _type_tag in value:
+            return json.loads(value, object_hook=_tagged_object_hook)
+        return json.loads(value)
+
+    def serialize(self, value) -> str:
+        """Serializes value into a string with a codec prefix (e.g. 'z:....')"""
+        return self.codec_sep.join(self.encode(value))
+
+    def deserialize(self, value: str):
+        """Deserializes a string serialized with serialize. Values without codec prefix are deserialized as
+        InternalStorageV0 values"""
+        if value is None:
+            return None
+        if value[1:2] == self.codec_sep and value[:1] in self.codecs:
+            try:
+                return self.decode(value[:1], value[2:])
+            except Exception:
+                return None
+        return super().deserialize(value)
+
+    def value_header(self, value: str, chunks: list, generation: int = None) -> dict:
+        return self.make_header(chunks=len(chunks), codec=self.codecs.get(value[:1]), chunk_size=self.chunk_size,
+                                generation=generation)
+
+    def chunk_name(self, key: str, idx_chunk: int, generation: int = None) -> str:
+        """Name of a chunk. Chunks without generation are the ones of InternalStorageV1 values"""
+        if generation is None:
+            return super().chunk_name(key, idx_chunk)
+        return f"{key}#{generation}.{idx_chunk}"
+
+    def iter_chunk_keys(self, key: str, header: dict = None) -> str:
+        """Return a list of chunk keys associated to the header found. If header is not given, it is read"""
+        if header is None:
+            _, header = self.read_header(key)
+        if self.header_valid(header):
+            for idx_chunk in range(header['chunks']):
+                yield self.chunk_name(key, idx_chunk, header.get('generation'))
+
+    def store_value_raw(self, key: str, value, verify: bool = True):
+        """Stores chunks of a new generation first, then the header and finally removes the chunks of the
+        previous value"""
+        _, old_header = self.read_header(key)
+        chunks = self.chunk(value)
+        header = self.value_header(value, chunks, generation=self.new_generation(old_header))
+        for chunk_key, chunk_value in zip(self.iter_chunk_keys(key, header), chunks):
+            InternalStorageBase.store_value_raw(self, chunk_key, chunk_value, verify=verify)
+        InternalStorageBase.store_value_raw(self, key, self.serialize(header), verify=verify)
+        if old_header is not None:
+            self.remove_chunks(key, old_header)
+
+    def new_generation(self, old_header: dict = None) -> int:
+        """Returns a random generation for a new value, different from the one of old_header"""
+        old_generation = (old_header or dict()).get('generation')
+        while (generation := secrets.randbits(self.generation_bits)) == old_generation:
+            pass
+        return generation
+
+    def remove_stored_value(self, key: str):
+        """Removes values stored under key. The header is removed first, so a crash cannot leave a header
+        pointing to missing chunks"""
+        _, header = self.read_header(key)
+        InternalStorageBase.remove_stored_value(self, key)
+        if header is not None:
+            self.remove_chunks(key, header)
+
+    def remove_chunks(self, key: str, header: dict):
+        """Removes chunks of the given header in reverse order, so if interrupted the remaining chunks always
+        start from chunk 0 and can be found by vacuum"""
+        for chunk_key in reversed(list(self.iter_chunk_keys(key, header))):
+            InternalStorageBase.remove_stored_value(self, chunk_key)
+
+    def vacuum(self, keys=None) -> int:
+        """
+        Removes orphan chunks left behind by interrupted writes or removals
+        :param keys: keys to clean. If the backend can list its keys (has an iter_keys method), defaults to all
+            keys. As generations are random, orphan chunks of other generations can only be found in backends that
+            list their keys: in the rest (e.g. keyring) keys must be given, and just the chunks after the last one
+            of their header are removed
+        :return: number of removed chunks
+        """
+        if getattr(self.backend, "iter_keys", None) is not None:
+            return self._vacuum_listed(keys)
+        if keys is None:
+            raise ValueError("Backend cannot list its keys, so keys to vacuum must be given")
+        removed = 0
+        for key in keys:
+            _, header = self.read_header(key)
+            if header is not None:
+                # Generation is None for InternalStorageV1 values
+                removed += self._remove_orphan_chunks(key, header.get('generation'), first_chunk=header['chunks'])
+        return removed
+
+    def _vacuum_listed(self, keys=None) -> int:
+        """Removes chunks not referenced by any header, for backends that can list their keys. User keys can look
+        like chunk names (e.g. "release#1.2"), so a key is only removed if it has no valid header itself and it
+        is named as a chunk of one of the given keys or, if no keys are given, of an existing InternalStorageV2
+        value (so chunks of values whose header was removed are only found if their keys are given)"""
+        keys = None if keys is None else set(keys)
+        stored_keys = set(self.backend.iter_keys(self.app_name))
+        headers = dict()
+        for key in stored_keys:
+            _, header = self.read_header(key)
+            if header is not None:
+                headers[key] = header
+        referenced = set()
+        for key, header in headers.items():
+            referenced.update(self.iter_chunk_keys(key, header))
+        orphans = list()
+        for key in stored_keys - referenced - headers.keys():
+            match = self._chunk_name_pattern.fullmatch(key)
+            if match is None:
+                continue
+            if keys is None:
+                if headers.get(match.group(1), dict()).get('generation') is not None:
+                    orphans.append(key)
+            elif match.group(1) in keys:
+                orphans.append(key)
+        with self.batch():
+            for chunk_key in orphans:
+                InternalStorageBase.remove_stored_value(self, chunk_key)
+        return len(orphans)
+
+    def _remove_orphan_chunks(self, key: str, generation: int | None, first_chunk: int = 0) -> int:
+        """Removes the chunks of a generation from first_chunk until a missing one is found"""
+        idx_chunk = first_chunk
+        while InternalStorageBase.get_value_raw(self, chunk_key := self.chunk_name(key, idx_chunk, generation)) \
+                is not None:
+            InternalStorageBase.remove_stored_value(self, chunk_key)
+            idx_chunk += 1
+        return idx_chunk - first_chunk
+
+    def header_valid(self, header) -> bool:
+        """True if a header is valid for this class or for InternalStorageV1 (so its values can be read)"""
+        if super().header_valid(header):
+            return True
+        return (isinstance(header, dict) and header.keys() == {"version", "class_name", "chunks"} and
+                header['version'] == 1 and header['class_name'] == InternalStorageV1.__name__)
+
+
+# Values stored with InternalStorageV2 cannot be read by previous releases, so it must be chosen explicitly
 InternalStorage = InternalStorageV1
 
 if __name__ == '__main__':
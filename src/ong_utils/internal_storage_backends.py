@@ -0,0 +1,172 @@
+"""
+Backends for InternalStorage that can be used instead of keyring (e.g. in headless servers where keyring is slow or
+not available, or in tests). They follow the keyring contract: set_password, get_password and delete_password
+(that raises keyring.errors.PasswordDeleteError if value did not exist).
+Additionally, they can list stored keys (iter_keys) and group writes in a single transaction (batch)
+Sample use:
+    from ong_utils import InternalStorage
+    from ong_utils.internal_storage_backends import SQLiteBackend
+    storage = InternalStorage("my app", backend=SQLiteBackend("~/.config/ongpi/storage.db"))
+"""
+from __future__ import annotations
+
+import base64
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import keyring.errors
+
+from ong_utils.import_utils import raise_extra_exception
+
+
+class MemoryBackend:
+    """Stores values in a dict. Values are lost when the process ends, so it is intended for tests"""
+    max_secret_size = None  # No limit
+
+    def __init__(self):
+        self.values = dict()
+        self.__lock = threading.Lock()
+
+    def set_password(self, service: str, username: str, password: str):
+        with self.__lock:
+            self.values[service, username] = password
+
+    def get_password(self, service: str, username: str) -> str | None:
+        return self.values.get((service, username))
+
+    def delete_password(self, service: str, username: str):
+        with self.__lock:
+            if self.values.pop((service, username), None) is None:
+                raise keyring.errors.PasswordDeleteError(f"{username} not found in {service}")
+
+    def iter_keys(self, service: str):
+        """Iterates over all keys stored for service"""
+        with self.__lock:
+            keys = [username for stored_service, username in self.values if stored_service == service]
+        yield from keys
+
+    @contextmanager
+    def batch(self):
+        yield self
+
+
+class SQLiteBackend:
+    """
+    Stores values encrypted in a SQLite database, in WAL mode. Writes inside a batch() context manager are
+    committed in a single transaction, the rest are committed one by one.
+    Values are encrypted with Fernet (needs cryptography package) using a key derived from password or, if not
+    given, a random key stored in a file next to the database (f"{path}.key"), readable only by the owner
+    """
+    max_secret_size = None  # No limit
+    kdf_iterations = 480000
+
+    def __init__(self, path: str | Path, password: str = None, encrypt: bool = True):
+        """
+        Opens (or creates) the database
+        :param path: path of the database file
+        :param password: password used to encrypt values. If not given a random key is created and stored in
+            f"{path}.key"
+        :param encrypt: if False (not recommended) values are stored in plain text
+        """
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.__lock = threading.RLock()
+        self.__batch_depth = 0
+        self.__connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level="DEFERRED")
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        with self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS secrets (service TEXT NOT NULL, "
+                                      "username TEXT NOT NULL, password TEXT NOT NULL, "
+                                      "PRIMARY KEY (service, username))")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+        self.__fernet = self.__make_fernet(password) if encrypt else None
+
+    def __make_fernet(self, password: str = None):
+        try:
+            from cryptography.fernet import Fernet
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+        except ModuleNotFoundError:
+            raise_extra_exception("storage")
+        if password is None:
+            key_path = Path(f"{self.path}.key")
+            if not key_path.is_file():
+                # Create the file readable just by the owner before writing the key
+                fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, "wb") as f_key:
+                    f_key.write(Fernet.generate_key())
+            return Fernet(key_path.read_bytes())
+        salt = self.__get_metadata("salt")
+        if salt is None:
+            salt = base64.b64encode(os.urandom(16)).decode('ascii')
+            with self.__connection:
+                self.__connection.execute("INSERT INTO metadata VALUES ('salt', ?)", (salt,))
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=base64.b64decode(salt),
+                         iterations=self.kdf_iterations)
+        return Fernet(base64.urlsafe_b64encode(kdf.derive(password.encode('utf-8'))))
+
+    def __get_metadata(self, name: str) -> str | None:
+        row = self.__connection.execute("SELECT value FROM metadata WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def __execute(self, sql: str, parameters: tuple) -> sqlite3.Cursor:
+        """Executes a write, committing it unless inside a batch"""
+        with self.__lock:
+            cursor = self.__connection.execute(sql, parameters)
+            if self.__batch_depth == 0:
+                self.__connection.commit()
+            return cursor
+
+    def set_password(self, service: str, username: str, password: str):
+        if self.__fernet is not None:
+            password = self.__fernet.encrypt(password.encode('utf-8')).decode('ascii')
+        self.__execute("INSERT OR REPLACE INTO secrets VALUES (?, ?, ?)", (service, username, password))
+
+    def get_password(self, service: str, username: str) -> str | None:
+        with self.__lock:
+            row = self.__connection.execute("SELECT password FROM secrets WHERE service = ? AND username = ?",
+                                            (service, username)).fetchone()
+        if row is None:
+            return None
+        if self.__fernet is not None:
+            return self.__fernet.decrypt(row[0].encode('ascii')).decode('utf-8')
+        return row[0]
+
+    def delete_password(self, service: str, username: str):
+        cursor = self.__execute("DELETE FROM secrets WHERE service = ? AND username = ?", (service, username))
+        if cursor.rowcount == 0:
+            raise keyring.errors.PasswordDeleteError(f"{username} not found in {service}")
+
+    def iter_keys(self, service: str):
+        """Iterates over all keys stored for service"""
+        with self.__lock:
+            rows = self.__connection.execute("SELECT username FROM secrets WHERE service = ?",
+                                             (service,)).fetchall()
+        for row in rows:
+            yield row[0]
+
+    @contextmanager
+    def batch(self):
+        """Groups all writes inside the context manager in a single transaction, rolled back if an exception
+        is raised. Other threads wait until the batch finishes"""
+        with self.__lock:
+            self.__batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self.__batch_depth == 1:
+                    self.__connection.rollback()
+                raise
+            else:
+                if self.__batch_depth == 1:
+                    self.__connection.commit()
+            finally:
+                self.__batch_depth -= 1
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,198 @@
+"""
+Logging utilities used by OngConfig:
+    - start_queue_listener/stop_queue_listener: move the handlers of a logger to a QueueListener thread, leaving
+    a QueueHandler in the logger, so log calls do not wait for file I/O (or rotation checks)
+    - JsonFormatter: formats records as json lines
+    - CompressedRotatingFileHandler and CompressedTimedRotatingFileHandler: rotating file handlers (by size and
+    by time) that gzip rotated files in a background thread
+Sample log config (logging.config.dictConfig format) using them:
+    'formatters': {'json': {'()': 'ong_utils.logging_utils.JsonFormatter'}},
+    'handlers': {'logfile': {'class': 'ong_utils.logging_utils.CompressedRotatingFileHandler',
+                             'filename': 'app.log', 'maxBytes': 10485760, 'backupCount': 5, 'formatter': 'json'}}
+"""
+from __future__ import annotations
+
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ujson
+
+_listeners = dict()     # Running listeners, by logger name
+_listeners_lock = threading.Lock()
+
+
+def start_queue_listener(logger: logging.Logger) -> logging.handlers.QueueListener:
+    """
+    Replaces the handlers of logger with a QueueHandler and starts a QueueListener thread that sends records
+    to the original handlers (respecting their levels). If the logger already had a listener, it is stopped first
+    :param logger: the logger
+    :return: the QueueListener
+    """
+    stop_queue_listener(logger)
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, logging.handlers.QueueHandler)]
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    with _listeners_lock:
+        _listeners[logger.name] = listener, queue_handler
+    listener.start()
+    return listener
+
+
+def stop_queue_listener(logger: logging.Logger, restore_handlers: bool = False) -> list:
+    """
+    Stops the QueueListener of the logger (if any), after it processes all queued records, and removes the
+    QueueHandler from the logger
+    :param logger: the logger
+    :param restore_handlers: if True, handlers of the listener are added again to the logger
+    :return: the list of handlers of the listener (empty if there was no listener)
+    """
+    with _listeners_lock:
+        listener, queue_handler = _listeners.pop(logger.name, (None, None))
+    if listener is None:
+        return list()
+    listener.stop()
+    logger.removeHandler(queue_handler)
+    queue_handler.close()
+    if restore_handlers:
+        for handler in listener.handlers:
+            logger.addHandler(handler)
+    return list(listener.handlers)
+
+
+def get_queue_listener(logger: logging.Logger) -> logging.handlers.QueueListener | None:
+    """Returns the running QueueListener of logger, or None"""
+    return _listeners.get(logger.name, (None, None))[0]
+
+
+@atexit.register
+def _stop_queue_listeners():
+    """Flushes queued records of all listeners at exit"""
+    for name in list(_listeners):
+        stop_queue_listener(logging.getLogger(name), restore_handlers=True)
+
+
+# Attributes of every LogRecord, the rest are extra attributes (passed with the extra argument of log calls)
+_record_attributes = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as a json object per line, with keys time (local time in ISO format, with milliseconds),
+    level, name, message, exc_info and stack_info (only if present) and any extra attribute of the record.
+    Faster than format strings, as it does not parse any format and the time string is computed once per second
+    """
+
+    def __init__(self, fields: dict = None, extra: bool = True):
+        """
+        :param fields: optional dict of json key -> LogRecord attribute to add to each line, e.g.
+            {"file": "filename", "line": "lineno", "thread": "threadName"}
+        :param extra: if True (default), extra attributes of records are added
+        """
+        super().__init__()
+        self.fields = dict(fields or dict())
+        self.extra = extra
+        self.__second = None
+        self.__second_text = ""
+
+    def format_time(self, created: float) -> str:
+        second = int(created)
+        if second != self.__second:
+            self.__second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(second))
+            self.__second = second
+        return f"{self.__second_text}.{int((created - second) * 1000):03d}"
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = dict(time=self.format_time(record.created), level=record.levelname, name=record.name,
+                    message=record.getMessage())
+        for key, attribute in self.fields.items():
+            data[key] = getattr(record, attribute, None)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        if self.extra:
+            for key, value in vars(record).items():
+                if key not in _record_attributes and key not in data:
+                    data[key] = value
+        return ujson.dumps(data, ensure_ascii=False, default=str)
+
+
+_compressor = None      # ThreadPoolExecutor that compresses rotated files, created when first needed
+_compressor_lock = threading.Lock()
+
+
+def _compress(source: str, dest: str):
+    """Gzips source into dest (through a temporary file, so dest is never partially written) and removes source"""
+    tmp_dest = dest + ".tmp"
+    with open(source, "rb") as f_in, gzip.open(tmp_dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.replace(tmp_dest, dest)
+    os.remove(source)
+
+
+class _CompressingRotatorMixin:
+    """Makes rotating file handlers gzip rotated files in a background thread. Rotated files get a .gz suffix"""
+    _compression = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # BaseRotatingHandler uses namer and rotator attributes, that __init__ sets to None
+        self.namer = self._gzip_name
+        self.rotator = self._rotate
+
+    @staticmethod
+    def _gzip_name(default_name: str) -> str:
+        return default_name + ".gz"
+
+    def _rotate(self, source: str, dest: str):
+        global _compressor
+        # Rename is fast, so the handler can go on writing a new file while the old one is compressed
+        uncompressed = dest[:-len(".gz")]
+        os.replace(source, uncompressed)
+        with _compressor_lock:
+            if _compressor is None:
+                _compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log_compressor")
+        self._compression = _compressor.submit(_compress, uncompressed, dest)
+
+    def wait_compression(self):
+        """Waits until the last rotated file is compressed"""
+        if self._compression is not None:
+            try:
+                self._compression.result()
+            except OSError as e:
+                # Not logged, as it could be logged to this same handler
+                print(f"Could not compress rotated log file: {e}", file=sys.stderr)
+            self._compression = None
+
+    def doRollover(self):
+        # Previous rotated file must be compressed before renaming backups
+        self.wait_compression()
+        super().doRollover()
+
+    def close(self):
+        self.wait_compression()
+        super().close()
+
+
+class CompressedRotatingFileHandler(_CompressingRotatorMixin, logging.handlers.RotatingFileHandler):
+    """A RotatingFileHandler (rotates by size) that gzips rotated files in a background thread"""
+
+
+class CompressedTimedRotatingFileHandler(_CompressingRotatorMixin, logging.handlers.TimedRotatingFileHandler):
+    """A TimedRotatingFileHandler (rotates by time) that gzips rotated files in a background thread"""
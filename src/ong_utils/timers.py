@@ -1,9 +1,19 @@
 """
 Timer object for measuring elapsed time elapsed in some processes
 """
+from __future__ import annotations
+
+import atexit
+import functools
+import inspect
+import itertools
 import logging
+import os
+import threading
+import weakref
+from contextvars import ContextVar
 from datetime import timedelta
-from time import time
+from time import perf_counter_ns
 
 
 def format_hours_min_seconds(total_seconds: float, decimal_places=3) -> str:
@@ -15,27 +25,233 @@ def format_hours_min_seconds(total_seconds: float, decimal_places=3) -> str:
     return retval
 
 
+# Durations histogram (HDR style): each power of 2 is split in 2 ** _histogram_bits buckets, so percentiles have a
+# relative error below 1 / 2 ** (_histogram_bits + 1) (about 3%) with a fixed size list of counters. Durations with
+# up to _histogram_bits + 1 bits are stored exactly, in the first buckets
+_histogram_bits = 4
+_histogram_exact_bits = _histogram_bits + 1
+_histogram_mask = (1 << _histogram_bits) - 1
+_histogram_size = 65 << _histogram_bits
+
+
+def _histogram_bucket(value_ns: int) -> int:
+    """Returns the histogram bucket of a duration"""
+    bits = value_ns.bit_length()
+    if bits > _histogram_exact_bits:
+        return bits << _histogram_bits | (value_ns >> (bits - _histogram_exact_bits)) & _histogram_mask
+    return value_ns
+
+
+def _histogram_value(bucket: int) -> float:
+    """Returns the middle value of a histogram bucket (the inverse of _histogram_bucket)"""
+    if bucket < 1 << _histogram_exact_bits:
+        return bucket
+    shift = (bucket >> _histogram_bits) - _histogram_exact_bits
+    low = (1 << _histogram_bits | bucket & _histogram_mask) << shift
+    return low + ((1 << shift) - 1) / 2
+
+
+class _TimerNode:
+    """A node of the call tree of timers: accumulated time of a msg when started inside the timer of its parent.
+    Nodes are owned by the timers that use them (parents hold their children weakly), so they are freed with them"""
+    __slots__ = ("name", "parent", "children", "total_ns", "count", "lock", "__weakref__")
+
+    def __init__(self, name, parent: _TimerNode = None):
+        self.name = name
+        self.parent = parent
+        self.children = weakref.WeakValueDictionary()
+        self.total_ns = 0
+        self.count = 0
+        self.lock = threading.Lock()    # Used by concurrent timers and for adding children
+
+    def child(self, name) -> _TimerNode:
+        with self.lock:
+            node = self.children.get(name)
+            if node is None:
+                node = self.children[name] = _TimerNode(name, self)
+        return node
+
+    @property
+    def attached(self) -> bool:
+        """False if the node was removed from the call tree by reset_tree"""
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node is _tree_root
+
+    def close(self):
+        """Makes parent the current node again (if this node or any of its descendants is the current one)"""
+        current = _current_node.get()
+        # Timers not properly nested: children started after this one and not stopped yet are closed too
+        while current is not None and current is not _tree_root:
+            if current is self:
+                # Parent of a node detached by reset_tree is the new tree
+                _current_node.set(self.parent or _tree_root)
+                return
+            current = current.parent
+
+    def as_dict(self, parent_ns: int) -> dict:
+        children = list(self.children.values())
+        exclusive_ns = self.total_ns - sum(child.total_ns for child in children)
+        return dict(name=self.name, inclusive=self.total_ns / 1e9, exclusive=max(exclusive_ns, 0) / 1e9,
+                    percent=100 * self.total_ns / parent_ns if parent_ns else 0.0, count=self.count,
+                    children=[child.as_dict(self.total_ns) for child in children])
+
+
+# Call tree shared by all timers created with tree=True. The current node is a ContextVar, so each thread and each
+# asyncio task (that inherits the node where it was created) builds its own branch
+_tree_root = _TimerNode(None)
+_current_node = ContextVar("ong_timer_node", default=_tree_root)
+
+# Intervals of concurrent timers started (and not stopped yet) in each thread or task: a dict of the key of each
+# timer -> a stack of tuples (node, [start_ns], previous tuple), so the same msg can be nested (e.g. recursive
+# functions). Dicts and tuples are never modified but copied, so tasks can push and pop without changing the ones
+# of their parent, and the keys of timers stopped everywhere are removed
+_started = ContextVar("ong_timer_started", default=dict())
+_started_keys = itertools.count()
+
+
 class _OngTic:
-    def __init__(self, msg, logger=None, log_level: str = logging.DEBUG, decimal_places=3):
+    """Accumulated time of a timer identified by msg. Times are measured with time.perf_counter_ns (monotonic,
+    highest resolution available). Besides the total time, it records statistics of every tic-toc interval (count,
+    min, max, sum of squares and a histogram for percentiles).
+    If concurrent, the start time and node of each thread or asyncio task are kept in a ContextVar (under the key
+    of the timer) and intervals are added under a lock, so the same msg can be timed concurrently.
+    Nodes of the call tree used by the timer are kept in nodes (by parent node), node is the one running"""
+    __slots__ = ("start_ns", "total_ns", "msg", "is_loop", "logger", "log_level", "printed", "decimal_places",
+                 "prefix_msg", "min_ns", "max_ns", "sum_squares", "histogram", "nodes", "node", "lock", "key")
+
+    def __init__(self, msg, logger=None, log_level: str = logging.DEBUG, decimal_places=3, concurrent: bool = False):
         """Starts timer with a msg that identifies the timer"""
-        self.start_t = time()
-        self.total_t = 0
+        self.start_ns = perf_counter_ns()
+        self.total_ns = 0
         self.msg = msg
         self.is_loop = False
         self.logger = logger
         self.log_level = log_level
         self.printed = False
         self.decimal_places = decimal_places
-        self.__msg = "Elapsed time for"
+        self.prefix_msg = "Elapsed time for"
+        self.min_ns = float("inf")
+        self.max_ns = 0
+        self.sum_squares = 0
+        self.histogram = [0] * _histogram_size
+        self.nodes = dict()
+        self.node = None
+        self.lock = threading.Lock() if concurrent else None
+        # Key of the intervals of this timer in _started (not id(self), that can be reused by other timers)
+        self.key = next(_started_keys) if concurrent else None
+
+    def get_node(self, parent: _TimerNode) -> _TimerNode:
+        """Returns the node of this timer inside parent. Usually a timer is started always inside the same parent,
+        so the node is reused (unless the tree was reset, and it is no longer a child of its parent)"""
+        node = self.nodes.get(parent)
+        if node is None or node.parent is not parent:
+            # Nodes removed by reset_tree are released
+            self.nodes = {key: value for key, value in self.nodes.items() if value.attached}
+            node = self.nodes[parent] = parent.child(self.msg)
+        return node
+
+    def record(self, elapsed_ns: int):
+        """Adds a tic-toc interval. Count is not stored, it is the sum of the histogram"""
+        node = self.node
+        if node is not None:
+            self.node = None
+            node.total_ns += elapsed_ns
+            node.count += 1
+            node.close()
+        self.record_stats(elapsed_ns)
+
+    def record_concurrent(self, elapsed_ns: int, node: _TimerNode | None):
+        """Adds a tic-toc interval of a concurrent timer, that was started in node (None if not in a tree)"""
+        if node is not None:
+            with node.lock:
+                node.total_ns += elapsed_ns
+                node.count += 1
+            node.close()
+        with self.lock:
+            self.record_stats(elapsed_ns)
+
+    def record_stats(self, elapsed_ns: int):
+        """Adds a tic-toc interval to total time and stats"""
+        self.total_ns += elapsed_ns
+        self.sum_squares += elapsed_ns * elapsed_ns
+        if elapsed_ns < self.min_ns:
+            self.min_ns = elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        # Inlined _histogram_bucket, as it is called for every interval
+        bits = elapsed_ns.bit_length()
+        if bits > _histogram_exact_bits:
+            self.histogram[bits << _histogram_bits | (elapsed_ns >> (bits - _histogram_exact_bits)) &
+                           _histogram_mask] += 1
+        else:
+            self.histogram[elapsed_ns] += 1
+
+    @property
+    def count(self) -> int:
+        """Number of tic-toc intervals"""
+        return sum(self.histogram)
+
+    def percentile(self, percent: float, count: int = None) -> float | None:
+        """Estimates a percentile (0 to 100) of the intervals, in seconds. None if there are no intervals"""
+        count = self.count if count is None else count
+        if not count:
+            return None
+        rank = percent / 100 * count
+        accumulated = 0
+        for bucket, bucket_count in enumerate(self.histogram):
+            accumulated += bucket_count
+            if bucket_count and accumulated >= rank:
+                break
+        # Estimation is the middle of the bucket, but always within the actual min and max
+        return min(max(_histogram_value(bucket), self.min_ns), self.max_ns) / 1e9
+
+    def stats(self) -> dict:
+        """Returns a dict with count, total, min, max, mean, stddev, p50, p95 and p99 of the intervals, in seconds"""
+        if self.lock is not None:
+            with self.lock:
+                return self.__stats()
+        return self.__stats()
+
+    def __stats(self) -> dict:
+        count = self.count
+        if not count:
+            return dict(count=0, total=self.total_t, min=None, max=None, mean=None, stddev=None, p50=None,
+                        p95=None, p99=None)
+        # Integers are exact, so the variance does not suffer from cancellation
+        variance = max(self.sum_squares * count - self.total_ns * self.total_ns, 0) / (count * count)
+        return dict(count=count, total=self.total_t, min=self.min_ns / 1e9, max=self.max_ns / 1e9,
+                    mean=self.total_ns / count / 1e9, stddev=variance ** 0.5 / 1e9, p50=self.percentile(50, count),
+                    p95=self.percentile(95, count), p99=self.percentile(99, count))
+
+    def format_stats(self) -> str:
+        """Formats stats as a string (empty if there are less than 2 intervals)"""
+        stats = self.stats()
+        if stats["count"] < 2:
+            return ""
+        values = ", ".join(f"{key}={stats[key]:.{self.decimal_places}f}s"
+                           for key in ("mean", "stddev", "min", "p50", "p95", "p99", "max"))
+        return f" (count={stats['count']}, {values})"
+
+    @property
+    def start_t(self) -> float:
+        """Start time, in seconds (only useful for differences with other perf_counter times)"""
+        return self.start_ns / 1e9
+
+    @property
+    def total_t(self) -> float:
+        """Accumulated time, in seconds"""
+        return self.total_ns / 1e9
 
     def tic(self):
         """Starts to count time"""
-        self.start_t = time()
+        self.start_ns = perf_counter_ns()
         self.printed = False
 
     def toc(self, loop=False):
         """Accumulates time from tic and  if loop=False (default) prints a message"""
-        self.total_t += time() - self.start_t
+        self.record(perf_counter_ns() - self.start_ns)
         if not loop:
             self.print()
         else:
@@ -44,10 +260,12 @@ class _OngTic:
     def print(self, extra_msg: str = ""):
         """Prints a message showing total elapsed time in seconds"""
         self.printed = True
-        print_msg = f"{self.__msg} {self.msg}{extra_msg}: {self.total_t:.{self.decimal_places}f}s"
-        if self.total_t > 60:
+        total_t = self.total_t
+        print_msg = f"{self.prefix_msg} {self.msg}{extra_msg}: {total_t:.{self.decimal_places}f}s"
+        if total_t > 60:
             # It more than 60 seconds, format time
-            print_msg += "({})".format(format_hours_min_seconds(self.total_t, decimal_places=self.decimal_places))
+            print_msg += "({})".format(format_hours_min_seconds(total_t, decimal_places=self.decimal_places))
+        print_msg += self.format_stats()
         # If there is a logger, print just to the logger and don't use print
         if self.logger:
             self.logger.log(self.log_level, print_msg)
@@ -61,23 +279,35 @@ class _OngTic:
             self.print(" (in total)")
         else:
             if not self.printed:
-                self.__msg = "Closing elapsed time for"
-                self.toc()
+                self.prefix_msg = "Closing elapsed time for"
+                if self.lock is None:
+                    self.toc()
+                else:
+                    # Start times of concurrent timers are kept per thread or task, so intervals not stopped
+                    # cannot be added
+                    self.print()
+
+
+def _disabled(msg):
+    """Replaces tic, toc and toc_loop of disabled timers, so they cost just a function call"""
 
 
-def is_self_enabled(func, *args, **kwargs):
-    """A decorator that executes decorated member function only if self.enabled is True"""
+_registry = None    # Timer shared by functions decorated with OngTimer.timed, created when first needed
 
-    def wrapper(*args, **kwargs):
-        self = args[0]
-        if self.enabled:
-            func(*args, **kwargs)
 
-    return wrapper
+@atexit.register
+def _print_registry():
+    """Prints the totals of functions decorated with OngTimer.timed (with loop=True) at exit"""
+    if _registry is not None:
+        for msg in list(_registry.msgs):
+            ticobj = _registry._get_ticobj(msg)
+            if ticobj.is_loop:
+                ticobj.print(" (in total)")
 
 
 class OngTimer:
-    def __init__(self, enabled=True, msg: str = None, logger=None, log_level=logging.DEBUG, decimal_places=3):
+    def __init__(self, enabled=True, msg: str = None, logger=None, log_level=logging.DEBUG, decimal_places=3,
+                 concurrent: bool = False, tree: bool = False):
         """
         Creates a timer, but it does not start it.
         The class can be used as a context manager, e.g.:
@@ -97,38 +327,149 @@ class OngTimer:
         :param logger: optional logger to write messages (default value of None disables it)
         :param log_level: optional log level for logger (defaults to DEBUG)
         :param decimal_places: optional number of decimals of second to print (defaults to 3)
+        :param concurrent: if True, the same msg can be timed at the same time from several threads or asyncio
+            tasks: start times are kept per thread/task and totals are added under a lock of each msg. A toc must
+            be called in the same thread or task as its tic (or in a task created after the tic). Defaults to False,
+            as it is slower
+        :param tree: if True, the timers of this instance are added to the call tree (see OngTimer.tree). Nodes
+            are kept while the instance exists. Defaults to False, as it is slower
         """
-        self.enabled = enabled
         self.msg = msg
-        if not self.enabled:
-            return
+        self.concurrent = concurrent
+        self.tree_enabled = tree
+        self.__entered = list()
         self.__tics = dict()
+        self.__tics_lock = threading.Lock()
         self.logger = logger
         self.log_level = log_level
         self.decimal_places = decimal_places
+        self.enabled = enabled
+
+    @property
+    def enabled(self) -> bool:
+        return self.__enabled
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        """When disabled, tic, toc and toc_loop are replaced in the instance by a function that does nothing, so
+        there is no check of enabled in each call"""
+        self.__enabled = value
+        for method in ("tic", "toc", "toc_loop"):
+            if value:
+                self.__dict__.pop(method, None)
+            else:
+                self.__dict__[method] = _disabled
 
-    @is_self_enabled
     def tic(self, msg):
         """Starts timer for process identified by msg"""
-        if msg not in self.__tics:
-            self.__tics[msg] = _OngTic(msg, logger=self.logger, log_level=self.log_level, decimal_places=self.decimal_places)
+        if self.concurrent:
+            self._tic_concurrent(msg)
+            return
         ticobj = self.__tics.get(msg)
-        ticobj.tic()
+        if ticobj is None:
+            ticobj = self.__tics[msg] = _OngTic(msg, logger=self.logger, log_level=self.log_level,
+                                                decimal_places=self.decimal_places)
+        ticobj.printed = False
+        if self.tree_enabled:
+            # The node of this timer (a child of the current one) becomes the current node of the call tree. If it
+            # is the current node already (started again without being stopped), it is not nested into itself
+            parent = _current_node.get()
+            if parent is not ticobj.node:
+                node = ticobj.nodes.get(parent)
+                if node is None or node.parent is not parent:
+                    node = ticobj.get_node(parent)
+                ticobj.node = node
+                _current_node.set(node)
+        # Time is taken as late as possible, so the code above is not measured
+        ticobj.start_ns = perf_counter_ns()
+
+    def _tic_concurrent(self, msg):
+        ticobj = self.__tics.get(msg)
+        if ticobj is None:
+            with self.__tics_lock:
+                ticobj = self.__tics.get(msg)
+                if ticobj is None:
+                    ticobj = self.__tics[msg] = _OngTic(msg, logger=self.logger, log_level=self.log_level,
+                                                        decimal_places=self.decimal_places, concurrent=True)
+        ticobj.printed = False
+        node = None
+        if self.tree_enabled:
+            parent = _current_node.get()
+            with ticobj.lock:
+                node = ticobj.get_node(parent)
+            _current_node.set(node)
+        start = [0]
+        started = _started.get()
+        _started.set({**started, ticobj.key: (node, start, started.get(ticobj.key))})
+        start[0] = perf_counter_ns()
+
+    def _toc_concurrent(self, msg, now: int) -> _OngTic:
+        """Adds the interval since the tic of msg in this thread or task, returns the timer"""
+        ticobj = self._get_ticobj(msg)
+        started = _started.get()
+        stack = started.get(ticobj.key)
+        if stack is None:
+            raise ValueError(f"The tick '{msg}' has not been initialized in this thread or task")
+        node, start, previous = stack
+        started = dict(started)
+        if previous is None:
+            del started[ticobj.key]
+        else:
+            started[ticobj.key] = previous
+        _started.set(started)
+        ticobj.record_concurrent(now - start[0], node)
+        return ticobj
 
     def _get_ticobj(self, msg):
-        if msg not in self.__tics:
+        ticobj = self.__tics.get(msg)
+        if ticobj is None:
             raise ValueError(f"The tick '{msg}' has not been initialized")
-        return self.__tics[msg]
+        return ticobj
 
-    @is_self_enabled
     def toc(self, msg):
         """Stops accumulating time for process identified by msg and prints message. No more printing will be done"""
-        self._get_ticobj(msg).toc()
+        # Time is taken as soon as possible, so the code below is not measured
+        now = perf_counter_ns()
+        if self.concurrent:
+            self._toc_concurrent(msg, now).print()
+            return
+        ticobj = self._get_ticobj(msg)
+        ticobj.record(now - ticobj.start_ns)
+        ticobj.print()
 
-    @is_self_enabled
     def toc_loop(self, msg):
         """Stops accumulating time for process identified by msg and DOES NOT prints message"""
-        self._get_ticobj(msg).toc(loop=True)
+        now = perf_counter_ns()
+        if self.concurrent:
+            self._toc_concurrent(msg, now).is_loop = True
+            return
+        ticobj = self.__tics.get(msg)
+        if ticobj is None:
+            raise ValueError(f"The tick '{msg}' has not been initialized")
+        # Same as ticobj.record(now - ticobj.start_ns), inlined as it is the usual call inside loops
+        elapsed_ns = now - ticobj.start_ns
+        node = ticobj.node
+        if node is not None:
+            ticobj.node = None
+            node.total_ns += elapsed_ns
+            node.count += 1
+            if _current_node.get() is node:
+                _current_node.set(node.parent or _tree_root)
+            else:
+                node.close()
+        ticobj.total_ns += elapsed_ns
+        ticobj.sum_squares += elapsed_ns * elapsed_ns
+        if elapsed_ns < ticobj.min_ns:
+            ticobj.min_ns = elapsed_ns
+        if elapsed_ns > ticobj.max_ns:
+            ticobj.max_ns = elapsed_ns
+        bits = elapsed_ns.bit_length()
+        if bits > _histogram_exact_bits:
+            ticobj.histogram[bits << _histogram_bits | (elapsed_ns >> (bits - _histogram_exact_bits)) &
+                             _histogram_mask] += 1
+        else:
+            ticobj.histogram[elapsed_ns] += 1
+        ticobj.is_loop = True
 
     def print_loop(self, msg):
         """Prints total elapsed time of all steps of a loop"""
@@ -138,16 +479,130 @@ class OngTimer:
         """Returns total elapsed time of a timer"""
         return self._get_ticobj(msg).total_t
 
+    def stats(self, msg) -> dict:
+        """Returns statistics of all tic-toc intervals of a timer, as a dict with keys count, total, min, max,
+        mean, stddev and estimations of percentiles p50, p95 and p99 (with a relative error below 3.2%). All times
+        in seconds (None if there were no intervals)"""
+        return self._get_ticobj(msg).stats()
+
+    @staticmethod
+    def tree() -> list:
+        """
+        Returns the call tree of all timers created with tree=True (of any OngTimer instance, while it exists): a
+        timer started while other is running (e.g. nested context managers) is a child of it. Each node is a dict
+        with keys name (the msg), inclusive (total time in seconds, including children), exclusive (time not spent
+        in children), percent (of the inclusive time of the parent, or of all root nodes), count (number of tic-toc
+        intervals) and children (a list of nodes). Intervals not stopped yet are not included
+        """
+        nodes = list(_tree_root.children.values())
+        total_ns = sum(node.total_ns for node in nodes)
+        return [node.as_dict(total_ns) for node in nodes]
+
+    @staticmethod
+    def tree_report(decimal_places: int = 3) -> str:
+        """Returns the call tree of all timers formatted as text, one line per node indented by depth"""
+        lines = list()
+
+        def add_lines(nodes: list, depth: int):
+            for node in nodes:
+                lines.append(f"{'    ' * depth}{node['name']}: {node['inclusive']:.{decimal_places}f}s "
+                             f"(exclusive {node['exclusive']:.{decimal_places}f}s, {node['percent']:.1f}%, "
+                             f"count={node['count']})")
+                add_lines(node['children'], depth + 1)
+        add_lines(OngTimer.tree(), 0)
+        return "\n".join(lines)
+
+    def print_tree(self):
+        """Prints (or logs, if the timer has a logger) the call tree of all timers"""
+        print_msg = "Timers tree:\n" + self.tree_report(self.decimal_places)
+        if self.logger:
+            self.logger.log(self.log_level, print_msg)
+        else:
+            print(print_msg)
+
+    @staticmethod
+    def reset_tree():
+        """Removes all nodes of the call tree of timers. Timers running in the current thread or task are no
+        longer considered parents of new timers"""
+        for node in list(_tree_root.children.values()):
+            node.parent = None
+        _tree_root.children.clear()
+        _current_node.set(_tree_root)
+
+    @staticmethod
+    def registry() -> OngTimer:
+        """Returns the timer shared by functions decorated with OngTimer.timed, a concurrent timer (so functions
+        can be called from several threads or tasks). It is disabled if the environment variable ONG_TIMERS_DISABLED
+        is set to 1, true or yes when it is first used"""
+        global _registry
+        if _registry is None:
+            _registry = OngTimer(enabled=os.environ.get("ONG_TIMERS_DISABLED", "").lower() not in ("1", "true", "yes"),
+                                 concurrent=True)
+        return _registry
+
+    @staticmethod
+    def timed(name=None, loop: bool = True, timer: OngTimer = None):
+        """
+        Decorator that times every call of a function (or coroutine function, timing until it returns), e.g.:
+
+        @OngTimer.timed
+        def process(): ...
+
+        @OngTimer.timed("download", loop=False)
+        async def download(url): ...
+
+        If the timer is disabled when the function is decorated, the function is returned untouched, so it has no
+        overhead at all (enabling the timer later does not time it)
+        :param name: msg of the timer. Defaults to the qualified name of the function
+        :param loop: if True (default) calls are accumulated (as toc_loop) and the total is printed at exit or with
+            print_loop(name). If False, elapsed time is printed after each call
+        :param timer: the timer to use. Defaults to the shared timer of OngTimer.registry()
+        """
+        if callable(name):
+            # Used without arguments, as @OngTimer.timed
+            return OngTimer.timed()(name)
+
+        def decorator(func):
+            active_timer = timer or OngTimer.registry()
+            if not active_timer.enabled:
+                return func
+            msg = name or func.__qualname__
+            # Methods are looked up in each call, so the timer can be disabled later
+            toc_method = "toc_loop" if loop else "toc"
+
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    active_timer.tic(msg)
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        getattr(active_timer, toc_method)(msg)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                active_timer.tic(msg)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    getattr(active_timer, toc_method)(msg)
+            return wrapper
+
+        return decorator
+
     def __enter__(self):
         """Allows using timer as a context manager. Needs that param msg has been previously defined in constructor"""
         if self.msg is None:
             raise ValueError("A msg arg must be passed in OngTimer constructor")
+        # msg can be changed by nested context managers of the same instance, so it is kept until __exit__
+        self.__entered.append(self.msg)
         self.tic(self.msg)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Allows using timer as a context manager"""
-        self.toc(self.msg)
+        self.toc(self.__entered.pop())
 
     def context_manager(self, msg):
         """Allows an existing instance to be used as a context manager"""
@@ -242,7 +697,7 @@ if __name__ == '__main__':
     #####################################################
     # Use .msgs property to iterate over all named timers
     #####################################################
-    loop_timer = OngTimer()
+    loop_timer = OngTimer(tree=True)     # tree=True adds its timers to the call tree
     for _ in range(10):
         loop_timer.tic("hello1")
         loop_timer.tic("hello2")
@@ -251,3 +706,8 @@ if __name__ == '__main__':
         loop_timer.toc_loop("hello2")
     for msg in loop_timer.msgs:
         loop_timer.print_loop(msg)
+
+    ######################################################################
+    # Print the tree of all timers, nested timers are shown as children
+    ######################################################################
+    loop_timer.print_tree()
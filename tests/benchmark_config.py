@@ -0,0 +1,63 @@
+"""
+Benchmarks for OngConfig. Not run by unittest/pytest (file name does not start with test_),
+run it with "python -m tests.benchmark_config". Use --help for options.
+Compares the time to load and dump a config file with thousands of keys using the pure python yaml loader and
+dumper and the libyaml based ones that OngConfig uses when available
+"""
+import argparse
+import io
+import time
+
+import yaml
+
+from ong_utils.config import YamlLoader, YamlDumper
+
+
+def sample_config(n_keys: int = 5000, project_name: str = "benchmark") -> dict:
+    """Returns a config with n_keys keys in the project section, of different types (some of them nested)"""
+    section = dict()
+    for idx in range(n_keys):
+        values = (f"a string value number {idx}", idx, idx * 1.5, [idx, f"item {idx}", True],
+                  dict(url=f"https://example.com/{idx}", timeout=idx % 60, enabled=False))
+        section[f"key_{idx}"] = values[idx % len(values)]
+    return {project_name: section, "log": dict()}
+
+
+def time_call(func, *args, repeat: int = 3) -> float:
+    """Returns the best time (in seconds) of repeat calls to func"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_yaml(n_keys: int = 5000, repeat: int = 3) -> list:
+    """Returns a list of dicts with the load and dump times of pure python and libyaml loaders and dumpers"""
+    cfg = sample_config(n_keys)
+    contents = yaml.dump(cfg)
+    results = list()
+    for name, loader, dumper in (("pure python", yaml.SafeLoader, yaml.Dumper),
+                                 ("OngConfig", YamlLoader, YamlDumper)):
+        assert yaml.load(contents, Loader=loader) == cfg
+        assert yaml.dump(cfg, Dumper=dumper) == contents
+        load = time_call(lambda: yaml.load(io.StringIO(contents), Loader=loader), repeat=repeat)
+        dump = time_call(lambda: yaml.dump(cfg, io.StringIO(), Dumper=dumper), repeat=repeat)
+        results.append(dict(yaml=name, loader=loader.__name__, dumper=dumper.__name__, keys=n_keys,
+                            load_ms=round(load * 1000, 1), dump_ms=round(dump * 1000, 1)))
+    return results
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmark_config",
+                                     description="Benchmarks yaml loading and dumping of OngConfig")
+    parser.add_argument("--keys", type=int, default=5000, help="number of keys of the config file")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of each operation")
+    args = parser.parse_args(argv)
+    for result in benchmark_yaml(args.keys, repeat=args.repeat):
+        print(", ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmarks for InternalStorage. Not run by unittest/pytest (file name does not start with test_),
+run it with "python -m tests.benchmark_internal_storage". Use --help for options.
+It prints two tables:
+    - bytes stored and chunks written by InternalStorageV1 and V2 for some sample payloads
+    - time and backend calls of serialize/deserialize, chunk and store/get round trips for payloads from 100B
+    to 10MB, using an in-memory backend (so times do not depend on the keyring backend)
+"""
+import argparse
+import base64
+import json
+import random
+import string
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from ong_utils.internal_storage import InternalStorageV1, InternalStorageV2
+from ong_utils.internal_storage_backends import MemoryBackend
+from tests import jwt_token
+
+default_sizes = (100, 1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+
+def get_random_string(length) -> str:
+    return ''.join(random.choice(string.ascii_letters) for _ in range(length))
+
+
+def sample_payloads() -> dict:
+    """Returns a dict of payload name -> payload, all of them json-serializable so V1 can store them"""
+    random.seed(0)
+    now = datetime(2024, 1, 1)
+    cookie_jar = [dict(name=f"cookie_{idx}", value=get_random_string(64), domain="example.com", path="/",
+                       expires=(now + timedelta(days=idx)).timestamp()) for idx in range(50)]
+    return {
+        "short string": "a short string",
+        "jwt token": jwt_token,
+        "jwt set": [jwt_token] * 20,
+        "cookie jar": cookie_jar,
+        "random 10KB": get_random_string(10 * 1024),
+        "table 1MB": [dict(date=(now + timedelta(hours=idx)).isoformat(), value=idx * 1.5, name=f"row {idx}")
+                      for idx in range(1024 * 1024 // len(json.dumps(dict(date=now.isoformat(), value=1.5,
+                                                                              name="row 1"))))],
+    }
+
+
+def compare_formats(payloads: dict = None) -> list:
+    """Returns a list of dicts with the bytes stored and chunks written by InternalStorageV1 and V2 per payload"""
+    results = list()
+    storages = {storage.__name__: storage("benchmark") for storage in (InternalStorageV1, InternalStorageV2)}
+    for name, payload in (payloads or sample_payloads()).items():
+        result = dict(payload=name)
+        for storage_name, storage in storages.items():
+            serialized = storage.serialize(payload)
+            chunks = storage.chunk(serialized)
+            result[f"{storage_name} bytes"] = len(serialized)
+            result[f"{storage_name} chunks"] = len(chunks)
+            assert storage.deserialize(serialized) == payload
+        results.append(result)
+    return results
+
+
+class CountingMemoryBackend(MemoryBackend):
+    """A MemoryBackend that counts calls to each of its methods"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+
+    def set_password(self, service: str, username: str, password: str):
+        self.calls["set"] += 1
+        super().set_password(service, username, password)
+
+    def get_password(self, service: str, username: str):
+        self.calls["get"] += 1
+        return super().get_password(service, username)
+
+    def delete_password(self, service: str, username: str):
+        self.calls["delete"] += 1
+        super().delete_password(service, username)
+
+
+def sized_payload(size: int) -> list:
+    """Returns a list of cookie-like records (half random, half repetitive) whose json is about size bytes"""
+    random.seed(size)
+    record_size = len(json.dumps(dict(name="cookie_0000000", value="", domain="example.com", path="/")))
+    value_size = 64
+    n_records = max(1, size // (record_size + value_size))
+    return [dict(name=f"cookie_{idx:07d}", value=base64.b64encode(random.randbytes(value_size * 3 // 4)).decode(),
+                 domain="example.com", path="/") for idx in range(n_records)]
+
+
+def time_call(func, *args, repeat: int = 5, setup=None) -> float:
+    """Returns the best time (in seconds) of repeat calls to func. If given, setup() is called (and not timed)
+    before each call"""
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_operations(sizes=default_sizes, repeat: int = 5, chunk_size: int = 1000) -> list:
+    """
+    Times serialize, deserialize, chunk, store_value and get_value of InternalStorageV1 and V2 for payloads of
+    the given sizes, using an in-memory backend
+    :param sizes: approximate sizes (in bytes of json) of payloads
+    :param repeat: number of repetitions of each operation (best time is reported). Payloads over 1MB are
+        repeated just once
+    :param chunk_size: chunk size for InternalStorageV2 (InternalStorageV1 always uses 1000)
+    :return: a list of dicts with storage, size, operation, ms and backend calls
+    """
+    results = list()
+    key = "benchmark_key"
+    for size in sizes:
+        payload = sized_payload(size)
+        n_repeat = repeat if size <= 1024 * 1024 else 1
+        for storage_class in InternalStorageV1, InternalStorageV2:
+            backend = CountingMemoryBackend()
+            kwargs = dict(chunk_size=chunk_size) if storage_class is InternalStorageV2 else dict()
+            storage = storage_class("benchmark", backend=backend, **kwargs)
+            serialized = storage.serialize(payload)
+            operations = dict(serialize=(storage.serialize, payload),
+                              deserialize=(storage.deserialize, serialized),
+                              chunk=(storage.chunk, serialized),
+                              store_value=(storage.store_value, key, payload),
+                              store_value_unverified=(lambda k, v: storage.store_value(k, v, verify=False), key,
+                                                      payload),
+                              get_value=(storage.get_value, key),
+                              remove_stored_value=(storage.remove_stored_value, key))
+            # The value is stored again before each removal, without timing or counting it
+            setups = dict(remove_stored_value=lambda: storage.store_value(key, payload, verify=False))
+            for operation, (func, *args) in operations.items():
+                setup = setups.get(operation)
+                elapsed = time_call(func, *args, repeat=n_repeat, setup=setup)
+                if setup is not None:
+                    setup()
+                backend.calls.clear()
+                func(*args)
+                calls = backend.calls
+                results.append(dict(storage=storage_class.__name__, size=size, operation=operation,
+                                    ms=round(elapsed * 1000, 3),
+                                    calls=" ".join(f"{k}={v}" for k, v in sorted(calls.items())) or "-",
+                                    stored=len(serialized)))
+    return results
+
+
+def print_table(results: list):
+    """Prints a list of dicts as a table"""
+    headers = list(results[0].keys())
+    widths = [max(len(str(h)), *(len(str(r[h])) for r in results)) for h in headers]
+    print("  ".join(str(h).rjust(w) for h, w in zip(headers, widths)))
+    for result in results:
+        print("  ".join(str(result[h]).rjust(w) for h, w in zip(headers, widths)))
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmark_internal_storage",
+                                     description="Benchmarks InternalStorage formats and operations")
+    parser.add_argument("--sizes", nargs="*", type=int, default=default_sizes,
+                        help="approximate sizes (in bytes) of payloads")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of each operation")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="chunk size for InternalStorageV2")
+    args = parser.parse_args(argv)
+    print_table(compare_formats())
+    print()
+    print_table(benchmark_operations(args.sizes, repeat=args.repeat, chunk_size=args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of OngTimer overhead. Not run by unittest/pytest (file name does not start with test_),
+run it with "python -m tests.benchmark_timers". Use --help for options.
+Measures the cost of a tic + toc_loop pair (the instrumentation of one iteration of a loop) for enabled timers (with
+and without the call tree) and disabled timers, discounting the cost of the loop itself, and exits with error if it
+is over the documented bound
+"""
+import argparse
+import sys
+import time
+
+from ong_utils.timers import OngTimer
+
+# Documented bounds (in ns) for a tic + toc_loop pair. Enabled timers include recording stats of each interval, and
+# timers with tree=True also setting a ContextVar in tic and in toc_loop
+max_enabled_overhead_ns = 800
+max_tree_overhead_ns = 1500
+max_disabled_overhead_ns = 200
+
+
+def loop_ns(iterations: int) -> float:
+    """Time in ns of an empty loop with two method calls per iteration, to discount it from measures"""
+    class Empty:
+        def tic(self, msg):
+            pass
+
+        def toc_loop(self, msg):
+            pass
+    empty = Empty()
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        empty.tic("msg")
+        empty.toc_loop("msg")
+    return time.perf_counter_ns() - start
+
+
+def timer_ns(timer: OngTimer, iterations: int) -> float:
+    """Time in ns of iterations tic + toc_loop pairs"""
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        timer.tic("msg")
+        timer.toc_loop("msg")
+    return time.perf_counter_ns() - start
+
+
+def overhead_ns(enabled: bool = True, iterations: int = 20000, repeat: int = 20, tree: bool = False) -> float:
+    """Returns the best overhead per tic + toc_loop pair (in ns), relative to a loop of calls to empty methods"""
+    timer = OngTimer(enabled=enabled, tree=tree)
+    if enabled:
+        timer.tic("msg")
+    best = float("inf")
+    for _ in range(repeat):
+        best = min(best, (timer_ns(timer, iterations) - loop_ns(iterations)) / iterations)
+    if enabled:
+        timer.print_loop("msg")
+    return max(best, 0)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmark_timers",
+                                     description="Benchmarks the overhead of OngTimer tic/toc_loop")
+    parser.add_argument("--iterations", type=int, default=20000, help="tic/toc_loop pairs per repetition")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions (best one is reported)")
+    args = parser.parse_args(argv)
+    result = 0
+    for enabled, tree, bound in ((True, False, max_enabled_overhead_ns), (True, True, max_tree_overhead_ns),
+                                 (False, False, max_disabled_overhead_ns)):
+        overhead = overhead_ns(enabled, args.iterations, args.repeat, tree)
+        ok = overhead <= bound
+        print(f"enabled={enabled}, tree={tree}: {overhead:.0f}ns per tic + toc_loop (bound {bound}ns) "
+              f"{'OK' if ok else 'FAILED'}")
+        result |= not ok
+    return result
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,19 @@
 import os
+import queue
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
 from pathlib import Path
-from unittest.mock import patch
+from typing import List
+from unittest.mock import patch, Mock
 
 import keyring
 import yaml
 
 from ong_utils import OngConfig
+from ong_utils.config import _atomic_write
 
 
 def read_file(filename: str) -> str:
@@ -173,6 +179,49 @@ class TestConfig(unittest.TestCase):
         new_cfg = OngConfig(self.app_name, cfg_filename=self.cfg_filename)
         self.assertEqual(new_cfg.config(new_key), brand_new_value)
 
+    def test_yaml_loader_dumper(self):
+        """Tests that libyaml loader and dumper are used if available and produce the same as pure python ones"""
+        from ong_utils.config import YamlLoader, YamlDumper, yaml_load, yaml_dump
+        if yaml.__with_libyaml__:
+            self.assertIs(YamlLoader, yaml.CSafeLoader)
+            self.assertIs(YamlDumper, yaml.CDumper)
+        else:
+            self.assertIs(YamlLoader, yaml.SafeLoader)
+            self.assertIs(YamlDumper, yaml.Dumper)
+        with open(self.cfg_filename) as f:
+            self.assertEqual(yaml.safe_load(f), yaml_load(open(self.cfg_filename)))
+        data = {self.app_name: dict(self.sample_config_dict, a_list=[1, "two", 3.0], nested=dict(a=None, b=True))}
+        self.assertEqual(yaml.dump(data), yaml_dump(data))
+        with self.assertRaises(yaml.YAMLError):
+            yaml_load("!!python/object:os.system {}")
+
+    def test_parsed_files_cache(self):
+        """Tests that config files are parsed again only when they change"""
+        yaml_loader, yaml_writer = OngConfig.extensions_cfg['.yaml']
+        with patch.dict(OngConfig.extensions_cfg, {'.yaml': (Mock(wraps=yaml_loader), yaml_writer)}):
+            loader = OngConfig.extensions_cfg['.yaml'][0]
+            OngConfig(self.app_name, cfg_filename=self.cfg_filename)
+            loader.reset_mock()
+            for _ in range(3):
+                new_cfg = OngConfig(self.app_name, cfg_filename=self.cfg_filename)
+            new_cfg.load()[self.app_name]['changed'] = "changes in loaded config are not cached"
+            self.assertNotIn('changed', new_cfg.load()[self.app_name])
+            self.assertEqual(0, loader.call_count, "Config file was parsed again")
+            # Changes in file are detected
+            new_key = "parsed_files_cache_key"
+            with open(self.cfg_filename) as f:
+                contents = yaml.safe_load(f)
+            contents[self.app_name][new_key] = "value"
+            with open(self.cfg_filename, "w") as f:
+                yaml.dump(contents, f)
+            self.assertEqual("value", OngConfig(self.app_name, cfg_filename=self.cfg_filename).config(new_key))
+            self.assertEqual(1, loader.call_count)
+            # save does not parse the file again, but the next instance does, as save changed it
+            new_cfg.update_app_config(new_key, "new value")
+            self.assertEqual(1, loader.call_count)
+            self.assertEqual("new value", OngConfig(self.app_name, cfg_filename=self.cfg_filename).config(new_key))
+            self.assertEqual(2, loader.call_count)
+
     @classmethod
     def tearDownClass(cls) -> None:
         # Close handler loggers to allow deleting logging file
@@ -183,5 +232,262 @@ class TestConfig(unittest.TestCase):
         cls.temp_dir.cleanup()
 
 
+class TestConfigReload(unittest.TestCase):
+    """Tests reloading and watching config files"""
+    app_name = "test_reload"
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cfg_filename = os.path.join(self.temp_dir.name, f"{self.app_name}.yaml")
+        self.write_config({"a_key": "a_value", "other_key": 1}, log=dict())
+        self.cfg = OngConfig(self.app_name, cfg_filename=self.cfg_filename, default_app_cfg=dict(default_key=0),
+                             log_config_path=Path(self.temp_dir.name) / "Logs")
+
+    def tearDown(self) -> None:
+        self.cfg.unwatch()
+        self.cfg.close_handlers()
+        self.temp_dir.cleanup()
+
+    def write_config(self, app_cfg: dict, log: dict):
+        # Replace the file, as many editors do
+        tmp_filename = self.cfg_filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            yaml.dump({self.app_name: app_cfg, "log": log}, f)
+        os.replace(tmp_filename, self.cfg_filename)
+
+    def test_reload(self):
+        self.assertEqual(set(), self.cfg.reload())
+        callback = Mock()
+        self.cfg.add_reload_callback(callback)
+        with patch("logging.config.dictConfig") as dict_config:
+            self.write_config({"a_key": "a_new_value", "new_key": True}, log=dict())
+            self.assertEqual({"a_key", "other_key", "new_key"}, self.cfg.reload())
+            dict_config.assert_not_called()
+            callback.assert_called_once_with({"a_key", "other_key", "new_key"})
+            # Default values are kept, and changes are seen by new instances
+            self.assertEqual(0, self.cfg.config("default_key"))
+            self.assertIsNone(self.cfg.config("other_key", None))
+            new_cfg = OngConfig(self.app_name, cfg_filename=self.cfg_filename)
+            self.assertEqual("a_new_value", new_cfg.config("a_key"))
+            # Logging is configured again only if log section changed
+            self.write_config({"a_key": "a_new_value", "new_key": True}, log=dict(disable_existing_loggers=False))
+            self.assertEqual(set(), self.cfg.reload())
+            dict_config.assert_called_once()
+            callback.assert_called_once()
+
+    def test_watch(self):
+        for use_inotify in True, False:
+            with self.subTest(use_inotify=use_inotify):
+                changes = queue.Queue()
+                watcher = self.cfg.watch(changes.put, interval=0.05, use_inotify=use_inotify)
+                self.assertIs(watcher, self.cfg.watch())
+                self.assertEqual(use_inotify and sys.platform.startswith("linux"), watcher.uses_inotify)
+                value = f"watched with inotify={use_inotify}"
+                self.write_config({"a_key": value}, log=dict())
+                self.assertEqual({"a_key", "other_key"}, changes.get(timeout=5))
+                self.assertEqual(value, self.cfg.config("a_key"))
+                self.cfg.unwatch()
+                self.assertFalse(watcher.is_alive())
+                self.write_config({"a_key": "a_value", "other_key": 1}, log=dict())
+                self.cfg.reload()
+
+
+class TestConfigWrites(unittest.TestCase):
+    """Tests that config files are written atomically and without losing concurrent updates"""
+    app_name = "test_writes"
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.log_path = Path(self.temp_dir.name) / "Logs"
+        self.cfg_filename = os.path.join(self.temp_dir.name, f"{self.app_name}.yaml")
+        with open(self.cfg_filename, "w") as f:
+            yaml.dump({self.app_name: {"a_key": "a_value"}, "other_project": {"key": "value"}, "log": {}}, f)
+        os.chmod(self.cfg_filename, 0o640)
+        self.cfg = OngConfig(self.app_name, cfg_filename=self.cfg_filename, log_config_path=self.log_path)
+
+    def tearDown(self) -> None:
+        self.cfg.close_handlers()
+        self.temp_dir.cleanup()
+
+    def read_config(self) -> dict:
+        with open(self.cfg_filename) as f:
+            return yaml.safe_load(f)
+
+    def test_atomic_write(self):
+        self.cfg.update_app_config("a_key", "new_value")
+        self.assertEqual({self.app_name: {"a_key": "new_value"}, "other_project": {"key": "value"}, "log": {}},
+                         self.read_config())
+        self.assertEqual(0o640, os.stat(self.cfg_filename).st_mode & 0o777)
+        # A failing write leaves the file untouched and no temporary files
+        yaml_loader, _ = OngConfig.extensions_cfg['.yaml']
+        with patch.dict(OngConfig.extensions_cfg, {'.yaml': (yaml_loader, Mock(side_effect=OSError("disk full")))}):
+            with self.assertRaises(OSError):
+                self.cfg.update_app_config("a_key", "lost value")
+        self.assertEqual("new_value", self.read_config()[self.app_name]["a_key"])
+        self.assertEqual({f"{self.app_name}.yaml", f"{self.app_name}.yaml.lock", "Logs"},
+                         set(os.listdir(self.temp_dir.name)))
+
+    def test_new_file_permissions(self):
+        """New files get the same permissions open() gives them (umask applied by the kernel)"""
+        reference = os.path.join(self.temp_dir.name, "reference.yaml")
+        with open(reference, "w"):
+            pass
+        new_file = os.path.join(self.temp_dir.name, "new.yaml")
+        _atomic_write(new_file, yaml.dump, {"key": "value"})
+        self.assertEqual({"key": "value"}, yaml.safe_load(Path(new_file).read_text()))
+        self.assertEqual(os.stat(reference).st_mode & 0o777, os.stat(new_file).st_mode & 0o777)
+
+    def test_transaction(self):
+        yaml_loader, yaml_writer = OngConfig.extensions_cfg['.yaml']
+        with patch.dict(OngConfig.extensions_cfg, {'.yaml': (yaml_loader, Mock(wraps=yaml_writer))}):
+            writer = OngConfig.extensions_cfg['.yaml'][1]
+            with self.cfg.transaction():
+                for idx in range(10):
+                    self.cfg.add_app_config(f"key_{idx}", idx)
+                with self.cfg.transaction():
+                    self.cfg.update_app_config("a_key", "changed in transaction")
+                self.assertEqual(0, writer.call_count)
+            self.assertEqual(1, writer.call_count)
+            self.assertEqual("changed in transaction", self.read_config()[self.app_name]["a_key"])
+            self.assertEqual(9, self.read_config()[self.app_name]["key_9"])
+            # Changes are undone if an exception is raised
+            with self.assertRaises(KeyError):
+                with self.cfg.transaction():
+                    self.cfg.update_app_config("a_key", "undone")
+                    raise KeyError("a_key")
+            self.assertEqual(1, writer.call_count)
+            self.assertEqual("changed in transaction", self.cfg.config("a_key"))
+
+    def test_concurrent_writes(self):
+        """Several processes and threads add keys to the same config file, none of them must be lost"""
+        script = (f"from ong_utils import OngConfig\n"
+                  f"cfg = OngConfig({self.app_name!r}, cfg_filename={self.cfg_filename!r}, "
+                  f"log_config_path={str(self.log_path)!r})\n"
+                  f"for idx in range(10):\n"
+                  f"    cfg.add_app_config(f'process_{{sys.argv[1]}}_{{idx}}', idx)\n")
+        processes = [subprocess.Popen([sys.executable, "-c", "import sys\n" + script, str(n)]) for n in range(4)]
+        threads = [threading.Thread(target=self.cfg.add_app_config, args=(f"thread_{n}", n)) for n in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for process in processes:
+            self.assertEqual(0, process.wait(timeout=60))
+        app_cfg = self.read_config()[self.app_name]
+        self.assertEqual(1 + 4 * 10 + 10, len(app_cfg))
+
+
+class TestConfigLayers(unittest.TestCase):
+    """Tests config resolved from defaults, system file, user file and environment variables"""
+    app_name = "test-layers"
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.system_path = Path(self.temp_dir.name) / "system"
+        self.system_path.mkdir()
+        self.cfg_filename = os.path.join(self.temp_dir.name, f"{self.app_name}.yaml")
+        with open(self.system_path / f"{self.app_name}.yaml", "w") as f:
+            yaml.dump({self.app_name: {"system_key": "system", "user_key": "system", "env_key": "system"}}, f)
+        with open(self.cfg_filename, "w") as f:
+            yaml.dump({self.app_name: {"user_key": "user", "env_key": "user"}, "log": {}}, f)
+        environ = {"ONG_TEST_LAYERS_ENV_KEY": "42", "ONG_TEST_LAYERS_NEW_KEY": "[1, two]",
+                   "ONG_TEST_LAYERS_TEXT": "not: valid: yaml"}
+        with patch.dict(os.environ, environ):
+            self.cfg = OngConfig(self.app_name, cfg_filename=self.cfg_filename, system_config_path=self.system_path,
+                                 default_app_cfg=dict(default_key="default", system_key="default"),
+                                 log_config_path=Path(self.temp_dir.name) / "Logs")
+
+    def tearDown(self) -> None:
+        self.cfg.close_handlers()
+        self.temp_dir.cleanup()
+
+    def test_layers(self):
+        # Environment values are not parsed (there is no schema)
+        expected = dict(default_key="default", system_key="system", user_key="user", env_key="42",
+                        new_key="[1, two]", text="not: valid: yaml")
+        self.assertEqual(expected, self.cfg.resolved_config())
+        # Environment is read once, when config is loaded
+        with patch.dict(os.environ, {"ONG_TEST_LAYERS_USER_KEY": "env"}):
+            for item, value in expected.items():
+                self.assertEqual(value, self.cfg.config(item))
+        sources = self.cfg.config_sources()
+        self.assertEqual("default", sources["default_key"])
+        self.assertEqual(f"system file {self.system_path / f'{self.app_name}.yaml'}", sources["system_key"])
+        self.assertEqual(f"file {self.cfg_filename}", sources["user_key"])
+        self.assertEqual("env ONG_TEST_LAYERS_ENV_KEY", sources["env_key"])
+
+    def test_overrides_not_saved(self):
+        self.cfg.add_app_config("added_key", "added")
+        self.cfg.update_app_config("env_key", "updated")
+        self.assertEqual(f"file {self.cfg_filename}", self.cfg.config_sources()["added_key"])
+        self.assertEqual("42", self.cfg.config("env_key"))
+        # Items defined only in the system file or in environment variables can be updated too
+        self.cfg.update_app_config("system_key", "updated")
+        self.cfg.update_app_config("new_key", "updated")
+        self.assertEqual("updated", self.cfg.config("system_key"))
+        self.assertEqual("[1, two]", self.cfg.config("new_key"))
+        with self.assertRaises(ValueError):
+            self.cfg.update_app_config("non_existing_key", "updated")
+        with open(self.cfg_filename) as f:
+            saved = yaml.safe_load(f)[self.app_name]
+        self.assertEqual(dict(user_key="user", env_key="updated", added_key="added", system_key="updated",
+                              new_key="updated"), saved)
+
+    def test_environ(self):
+        """Reserved variables are not config items, values are strings unless the schema says otherwise"""
+        cfg_filename = os.path.join(self.temp_dir.name, "config.yaml")
+        with open(cfg_filename, "w") as f:
+            yaml.dump({"config": {"path": "file"}, "log": {}}, f)
+        environ = {"ONG_CONFIG_PATH": self.temp_dir.name, "ONG_CONFIG_CODE": "0123", "ONG_CONFIG_PORTS": "[80, 443]",
+                   "ONG_CONFIG_RETRIES": "3"}
+        with patch.dict(os.environ, environ):
+            cfg = OngConfig("config", cfg_filename=cfg_filename, system_config_path=self.system_path,
+                            log_config_path=Path(self.temp_dir.name) / "Logs",
+                            schema=dict(ports=List[int], retries=(int, 1), path=str))
+        try:
+            self.assertEqual("file", cfg.config("path"))
+            self.assertEqual("0123", cfg.config("code"))
+            self.assertEqual([80, 443], cfg.config("ports"))
+            self.assertEqual(3, cfg.settings.retries)
+        finally:
+            cfg.close_handlers()
+
+
+class TestConfigQueueLogging(unittest.TestCase):
+    """Tests logging through a QueueHandler/QueueListener"""
+    app_name = "test_queue_logging"
+
+    def test_queue_logging(self):
+        from logging.handlers import QueueHandler
+        from ong_utils.logging_utils import get_queue_listener
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cfg_filename = os.path.join(temp_dir, f"{self.app_name}.yaml")
+            with open(cfg_filename, "w") as f:
+                yaml.dump({self.app_name: {"a_key": "a_value"}, "log": {}}, f)
+            cfg = OngConfig(self.app_name, cfg_filename=cfg_filename, queue_logging=True,
+                            log_config_path=Path(temp_dir) / "Logs")
+            self.assertEqual([QueueHandler], [type(handler) for handler in cfg.logger.handlers])
+            listener = get_queue_listener(cfg.logger)
+            self.assertIsNotNone(listener)
+            self.assertEqual({"StreamHandler", "RotatingFileHandler"},
+                             {type(handler).__name__ for handler in listener.handlers})
+            # Other instances of the project keep queue logging, even if logging is configured again
+            OngConfig(self.app_name, cfg_filename=cfg_filename, log_config_path=Path(temp_dir) / "Logs")
+            with open(cfg_filename, "w") as f:
+                yaml.dump({self.app_name: {"a_key": "a_value"}, "log": {"disable_existing_loggers": False}}, f)
+            cfg.reload()
+            self.assertIsNot(listener, get_queue_listener(cfg.logger))
+            listener = get_queue_listener(cfg.logger)
+            self.assertIsNotNone(listener)
+            self.assertEqual([QueueHandler], [type(handler) for handler in cfg.logger.handlers])
+            for idx in range(100):
+                cfg.logger.debug(f"queued message {idx}")
+            log_filename = cfg._OngConfig__log_cfg['handlers']['logfile']['filename']
+            cfg.close_handlers()
+            self.assertIsNone(get_queue_listener(cfg.logger))
+            self.assertEqual([], cfg.logger.handlers)
+            self.assertIn("queued message 99", read_file(log_filename))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,113 @@
+import dataclasses
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import yaml
+
+from ong_utils import OngConfig
+from ong_utils.config_schema import ConfigSchema, parse_duration, make_converter
+
+
+@dataclasses.dataclass
+class Settings:
+    url: str
+    timeout: timedelta = timedelta(seconds=30)
+    retries: int = 3
+    data_path: Path = Path("~/data")
+    verbose: bool = False
+    hosts: List[str] = dataclasses.field(default_factory=list)
+    proxy: Optional[str] = None
+
+
+class TestConfigSchema(unittest.TestCase):
+
+    def test_converters(self):
+        for type_, value, expected in [
+            (int, "3", 3),
+            (float, 2, 2.0),
+            (bool, "yes", True),
+            (bool, "False", False),
+            (bool, 0, False),
+            (Path, "~/a", Path("~/a").expanduser()),
+            (timedelta, 90, timedelta(seconds=90)),
+            (timedelta, "1h30m", timedelta(hours=1, minutes=30)),
+            (timedelta, "1.5d", timedelta(days=1.5)),
+            (timedelta, "500ms", timedelta(milliseconds=500)),
+            (str, 8080, "8080"),
+            (float, "1.5", 1.5),
+            (Optional[int], None, None),
+            (Optional[int], "1", 1),
+            (List[int], ["1", 2], [1, 2]),
+            (Dict[str, timedelta], {"a": "10s"}, {"a": timedelta(seconds=10)}),
+        ]:
+            with self.subTest(type=type_, value=value):
+                self.assertEqual(expected, make_converter(type_)(value))
+        for type_, value in [(int, "a"), (int, 1.5), (int, True), (bool, "maybe"), (timedelta, "1x"),
+                             (List[int], "1"), (Path, 3), (str, [1, 2]), (str, {"a": 1}), (str, None),
+                             (float, True), (float, [1.0]), (int, [1]), (Optional[str], [1])]:
+            with self.subTest(type=type_, value=value):
+                with self.assertRaises(ValueError):
+                    make_converter(type_)(value)
+        self.assertEqual(timedelta(hours=2, seconds=3), parse_duration("2h 3s"))
+
+    def test_schemas(self):
+        for schema in Settings, dict(url=str, timeout=(timedelta, "30s"), retries=(int, 3),
+                                     data_path=(Path, "~/data"), verbose=(bool, False), hosts=(List[str], []),
+                                     proxy=(Optional[str], None)):
+            with self.subTest(schema=schema):
+                compiled = ConfigSchema(schema)
+                settings = compiled.build(dict(url="https://example.com", timeout="1m", verbose="on",
+                                               not_in_schema=1))
+                self.assertEqual("https://example.com", settings.url)
+                self.assertEqual(timedelta(minutes=1), settings.timeout)
+                self.assertEqual(3, settings.retries)
+                self.assertEqual(Path("~/data").expanduser(), settings.data_path)
+                self.assertEqual(Path("~/x").expanduser(), compiled.build(dict(url="", data_path="~/x")).data_path)
+                self.assertTrue(settings.verbose)
+                self.assertIsNot(settings.hosts, compiled.build(dict(url="")).hosts)
+                with self.assertRaises(ValueError) as e:
+                    compiled.build(dict(retries="many"), section="my_project")
+                self.assertIn("retries", str(e.exception))
+                self.assertIn("url: missing", str(e.exception))
+
+    def test_config(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cfg_filename = os.path.join(temp_dir, "test_schema.yaml")
+            with open(cfg_filename, "w") as f:
+                yaml.dump({"test_schema": dict(url="https://example.com", retries="5", timeout="2m")}, f)
+            cfg = OngConfig("test_schema", cfg_filename=cfg_filename, schema=Settings,
+                            log_config_path=Path(temp_dir) / "Logs")
+            try:
+                self.assertIsInstance(cfg.settings, Settings)
+                self.assertEqual(5, cfg.settings.retries)
+                self.assertEqual(timedelta(minutes=2), cfg.config("timeout"))
+                self.assertEqual(False, cfg.config("verbose"))
+                cfg.update_app_config("retries", "7")
+                self.assertEqual(7, cfg.settings.retries)
+                with self.assertRaises(ValueError):
+                    cfg.update_app_config("retries", "seven")
+                self.assertEqual(7, cfg.settings.retries)
+                self.assertEqual("7", cfg.load()["test_schema"]["retries"])
+                # An invalid file is not reloaded, the previous config is kept as a whole
+                with open(cfg_filename, "w") as f:
+                    yaml.dump({"test_schema": dict(url="https://new.example.com", retries="many")}, f)
+                with self.assertRaises(ValueError):
+                    cfg.reload()
+                self.assertEqual("https://example.com", cfg.config("url"))
+                self.assertEqual(7, cfg.config("retries"))
+                self.assertEqual(timedelta(minutes=2), cfg.settings.timeout)
+                self.assertEqual("https://example.com", cfg.resolved_config()["url"])
+                # Would raise if the invalid values had replaced the app config
+                cfg.update_app_config("verbose", "yes")
+                self.assertTrue(cfg.settings.verbose)
+                self.assertEqual(7, cfg.settings.retries)
+            finally:
+                cfg.close_handlers()
+
+
+if __name__ == '__main__':
+    unittest.main()
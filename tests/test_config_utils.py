@@ -0,0 +1,123 @@
+import ast
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+
+import yaml
+
+from ong_utils.config_utils.config_utils import (FindConfigCalls, ConfigCall, build_index, diff_config,
+                                                 default_config, main)
+
+
+class TestFindConfigCalls(unittest.TestCase):
+    files = {
+        "main.py": "from x import config\nprint(config('url'))\ntimeout = config('timeout', 30)\n",
+        "pkg/module.py": "def f():\n    return test_config('user'), config(b'bytes', ...)\nconfig()\n",
+        "pkg/broken.py": "def f(:\n    config('never_found')\n",
+        "venv/lib/python3.11/site-packages/other.py": "config('from_venv')\n",
+        "venv/bin/activate_this.py": "config('from_activate_this')\n",
+    }
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.folder = Path(self.temp_dir.name) / "project"
+        for filename, contents in self.files.items():
+            (self.folder / filename).parent.mkdir(parents=True, exist_ok=True)
+            (self.folder / filename).write_text(contents)
+        self.cache_file = Path(self.temp_dir.name) / "cache.json"
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def find(self, **kwargs) -> FindConfigCalls:
+        return FindConfigCalls(self.folder, cache_file=self.cache_file, **kwargs)
+
+    def test_find(self):
+        for kwargs in dict(use_cache=False), dict(use_cache=False, processes=2, min_files=1):
+            with self.subTest(**kwargs):
+                min_files = kwargs.pop("min_files", FindConfigCalls.min_files_process_pool)
+                FindConfigCalls.min_files_process_pool, previous = min_files, FindConfigCalls.min_files_process_pool
+                try:
+                    finder = self.find(**kwargs)
+                finally:
+                    FindConfigCalls.min_files_process_pool = previous
+                self.assertEqual({"config": {("url",), ("timeout", 30), (b"bytes", ...)}, "test_config": {("user",)}},
+                                 finder.config_parameters)
+                self.assertEqual(["pkg/broken.py"], finder.unparseable_files)
+                self.assertEqual(ConfigCall("main.py", 3, "config", ("timeout", 30)), finder.calls[1])
+                self.assertFalse(self.cache_file.exists())
+
+    def test_cache_not_literal(self):
+        """Files with arguments that cannot be read back from the cache are parsed again"""
+        (self.folder / "pkg/module.py").write_text("config('limit', float('inf'))\nconfig('ratio', 1e999)\n")
+        self.assertIn(("ratio", float("inf")), self.find().config_parameters["config"])
+        finder = self.find()
+        self.assertEqual(["pkg/module.py"], finder.parsed_files)
+        self.assertIn(("ratio", float("inf")), finder.config_parameters["config"])
+
+    def test_find_config_calls(self):
+        finder = self.find(use_cache=False)
+        self.assertEqual(1, finder.processes)
+        finder.find_config_calls(ast.parse("config('extra', 1)\nother('ignored')\n"), "config")
+        self.assertIn(("extra", 1), finder.config_parameters["config"])
+        self.assertNotIn("other", finder.config_parameters)
+
+    def test_cache(self):
+        finder = self.find()
+        self.assertEqual(3, len(finder.parsed_files))
+        self.assertTrue(self.cache_file.is_file())
+        # Nothing parsed again, neither in a new instance
+        finder = self.find()
+        self.assertEqual([], finder.parsed_files)
+        self.assertIn(("timeout", 30), finder.config_parameters["config"])
+        # Touched files are not parsed again, changed files are
+        main = self.folder / "main.py"
+        os.utime(main, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        (self.folder / "pkg/module.py").write_text("config('new_item', 'default')\n")
+        (self.folder / "pkg/new.py").write_text("config('another_item')\n")
+        finder.scan()
+        self.assertEqual(["pkg/module.py", "pkg/new.py"], sorted(finder.parsed_files))
+        self.assertEqual({("url",), ("timeout", 30), ("new_item", "default"), ("another_item",)},
+                         finder.config_parameters["config"])
+        self.assertNotIn("test_config", finder.config_parameters)
+        self.assertEqual([], self.find().parsed_files)
+        # Cache is not used with other function names
+        self.assertEqual(4, len(self.find(function_names=("config",)).parsed_files))
+
+    def test_index_and_diff(self):
+        finder = self.find(use_cache=False)
+        index = build_index(finder)
+        self.assertEqual([dict(file="main.py", line=3, default=30)], index["config"]["timeout"])
+        self.assertEqual([dict(file="main.py", line=2)], index["config"]["url"])
+        config = {"project": {"url": "https://example.com", "unused_item": 1}, "project_test": {"user": "me"}}
+        self.assertEqual({"project": dict(missing=[], missing_with_default=[b"bytes", "timeout"],
+                                          unused=["unused_item"]),
+                          "project_test": dict(missing=[], missing_with_default=[], unused=[])},
+                         diff_config(index, config, "project"))
+        self.assertEqual({"project": {b"bytes": ..., "timeout": 30, "url": None}, "project_test": {"user": None}},
+                         default_config(index, "project"))
+
+    def test_main(self):
+        config_file = Path(self.temp_dir.name) / "project.yaml"
+        config_file.write_text(yaml.dump({"project": {"timeout": 1}}))
+        index_file = Path(self.temp_dir.name) / "index.json"
+        argv = [str(self.folder), "--config-file", str(config_file), "--cache-file", str(self.cache_file),
+                "--index", str(index_file), "--check"]
+        with redirect_stdout(io.StringIO()) as stdout, redirect_stderr(io.StringIO()):
+            self.assertEqual(1, main(argv))
+        self.assertIn("missing: project.url (main.py:2)", stdout.getvalue())
+        self.assertIn("missing: project_test.user (pkg/module.py:2)", stdout.getvalue())
+        self.assertIn("url", json.loads(index_file.read_text())["config"])
+        config_file.write_text(yaml.dump({"project": {"url": "x"}, "project_test": {"user": "me"}}))
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()) as stderr:
+            self.assertEqual(0, main(argv))
+        self.assertIn("0 files parsed", stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import json
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from ong_utils.importprof import parse_importtime, profile_module, sort_results, format_table, main
+
+
+class TestImportProf(unittest.TestCase):
+
+    def test_parse_importtime(self):
+        """Tests parsing of the output of python -X importtime"""
+        output = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       634 |        634 |   ong_utils.import_utils\n"
+                  "import time:      1411 |       2044 | ong_utils\n")
+        self.assertEqual({"ong_utils.import_utils": (634, 634), "ong_utils": (1411, 2044)},
+                         parse_importtime(output))
+
+    def test_profile_module(self):
+        """Tests that existing modules get times and non-existing ones get an error"""
+        result = profile_module("ong_utils.timers", extra="base")
+        self.assertIsNone(result['error'])
+        self.assertGreaterEqual(result['cumulative'], result['self'])
+        result = profile_module("non_existing_module_for_sure")
+        self.assertIsNone(result['cumulative'])
+        self.assertIn("ModuleNotFoundError", result['error'])
+        # Failed imports are sorted last
+        results = [result, dict(name="a", extra="base", self=0.1, cumulative=0.2, error=None)]
+        self.assertEqual("a", sort_results(results, "cumulative")[0]['name'])
+        self.assertEqual(len(results) + 2, len(format_table(results).splitlines()))
+
+    def test_json_output(self):
+        """Tests that json output can be parsed"""
+        with redirect_stdout(StringIO()) as stdout:
+            main(["--extra", "jwt", "--json", "-"])
+        report = json.loads(stdout.getvalue())
+        self.assertTrue(all(r['extra'] == "jwt" for r in report['results']))
+
+
+if __name__ == '__main__':
+    unittest.main()
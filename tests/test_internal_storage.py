@@ -1,8 +1,18 @@
+import base64
+import os
 import unittest
 import random
 import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from unittest.mock import patch
 
-from ong_utils.internal_storage import InternalStorage, InternalStorageV0
+import keyring
+
+from ong_utils.internal_storage import InternalStorage, InternalStorageV0, InternalStorageV1, InternalStorageV2, \
+    InternalStorageCache, _missing, backend_chunk_size
+from ong_utils.internal_storage_backends import MemoryBackend
 from tests import jwt_token
 
 
@@ -29,13 +39,15 @@ class TestInternalStorage(unittest.TestCase):
         ],
     ]
     store_key = "key_to_delete"
+    # Small chunk size, so long values are split into several chunks whatever the keyring backend
+    chunk_size = 1000
 
     @property
     def app_name(self):
         return self.__class__.__name__
 
     def setUp(self):
-        self.internal_storage = InternalStorage(self.app_name)
+        self.internal_storage = InternalStorageV2(self.app_name, chunk_size=self.chunk_size)
         self.internal_storage.remove_stored_value(self.store_key)
         self.old_internal_storage = InternalStorageV0(self.app_name)
 
@@ -111,14 +123,226 @@ class TestInternalStorage(unittest.TestCase):
         self.internal_storage.store_value(self.store_key, value)
         self.assertEqual(value, self.internal_storage.get_value(self.store_key),
                          "Value was not properly stored")
+        chunk_names = list(self.internal_storage.iter_chunk_keys(self.store_key))
+        self.assertGreaterEqual(len(chunk_names), n_chunks)
         self.internal_storage.remove_stored_value(self.store_key)
         self.assertIsNone(self.internal_storage.get_value(self.store_key),
                           "Value was not properly deleted")
-        for idx_chunk in range(n_chunks):
-            chunk_name = self.internal_storage.chunk_name(self.store_key, idx_chunk)
-            self.assertIsNone(self.internal_storage.get_value(chunk_name),
+        for idx_chunk, chunk_name in enumerate(chunk_names):
+            self.assertIsNone(self.internal_storage.get_value_raw(chunk_name),
                               f"Chunk #{idx_chunk} was not deleted")
 
+    def test_many_values(self):
+        """Tests storing, reading and removing several values at once, with one backend read per header and
+        chunk and without reading back writes"""
+        keys = [f"{self.store_key}_{idx}" for idx in range(len(self.store_values))]
+        values = dict(zip(keys, self.store_values))
+        with patch("keyring.get_password", wraps=keyring.get_password) as get_password:
+            self.internal_storage.store_many(values)
+            # Just the previous header of each key is read
+            self.assertEqual(len(keys), get_password.call_count, "Writes were read back")
+            get_password.reset_mock()
+            self.assertEqual(values, self.internal_storage.get_many(keys))
+            n_chunks = sum(len(self.internal_storage.chunk(self.internal_storage.serialize(v)))
+                           for v in self.store_values)
+            self.assertEqual(len(keys) + n_chunks, get_password.call_count)
+        self.internal_storage.remove_many(keys)
+        self.assertEqual(dict.fromkeys(keys), self.internal_storage.get_many(keys))
+
+    def test_cache(self):
+        """Tests that cached values are read from keyring just once, and invalidated when stored or removed"""
+        cached_storage = InternalStorageV2(self.app_name, cache_size=2)
+        cached_storage.cache.clear()
+        value = dict(a="value")
+        cached_storage.store_value(self.store_key, value)
+        with patch("keyring.get_password", wraps=keyring.get_password) as get_password:
+            for _ in range(3):
+                self.assertEqual(value, cached_storage.get_value(self.store_key))
+            self.assertEqual(2, get_password.call_count, "Value was not cached")     # header + chunk
+        self.assertEqual(dict(hits=2, misses=1), {k: cached_storage.cache_info()[k] for k in ("hits", "misses")})
+        # Changing the returned value does not change the cached one
+        cached_storage.get_value(self.store_key)['a'] = "another value"
+        self.assertEqual(value, cached_storage.get_value(self.store_key))
+        # Values stored by instances without cache also invalidate the cache
+        self.internal_storage.store_value(self.store_key, "new value")
+        self.assertEqual("new value", cached_storage.get_value(self.store_key))
+        self.internal_storage.remove_stored_value(self.store_key)
+        self.assertIsNone(cached_storage.get_value(self.store_key))
+        self.assertIsNone(self.internal_storage.cache_info())
+
+    def test_cache_limits(self):
+        """Tests that cache discards least recently used and expired values"""
+        cache = InternalStorageCache(max_size=2, ttl=0.1)
+        for key in "abc":
+            cache.set(key, key)
+        self.assertIs(_missing, cache.get("a"))
+        self.assertEqual("b", cache.get("b"))
+        time.sleep(0.15)
+        self.assertIs(_missing, cache.get("b"))
+        self.assertIs(_missing, cache.get("c"))
+        self.assertEqual(0, cache.info()['size'])
+
+    def test_read_v1_values(self):
+        """Tests that InternalStorageV1 values (also chunked ones) can be read and removed in new storage"""
+        # Default storage keeps the format that previous releases can read
+        self.assertIs(InternalStorageV1, InternalStorage)
+        v1_storage = InternalStorageV1(self.app_name)
+        for value in self.iter_test_values():
+            v1_storage.store_value(self.store_key, value)
+            self.assertEqual(value, self.internal_storage.get_value(self.store_key))
+            self.internal_storage.remove_stored_value(self.store_key)
+            self.assertIsNone(v1_storage.get_value(self.store_key), "Value was not deleted")
+
+    def test_codecs(self):
+        """Tests that codec is chosen depending on value size, stored in header and that non-json values can
+        be stored"""
+        storage = InternalStorageV2(self.app_name)
+        for value, codec in [
+            ("short", "raw"),
+            (dict(a=b"bytes", b=datetime(2024, 1, 2, 3, 4, 5), c=date(2024, 1, 2), d={1, 2}), "zlib"),
+            ("this is a long string" * 100, "zlib"),
+            ("this is a very long string" * 10000, "lzma"),
+            # Compression does not help for random data
+            (base64.b85encode(os.urandom(1000)).decode(), "raw"),
+        ]:
+            with self.subTest(codec=codec, value=value):
+                storage.store_value(self.store_key, value)
+                _, header = storage.read_header(self.store_key)
+                self.assertEqual(codec, header['codec'])
+                self.assertEqual(value, storage.get_value(self.store_key))
+                storage.remove_stored_value(self.store_key)
+
+    def test_type_tag_in_values(self):
+        """Tests that dicts of values with the key used to tag types are not decoded as other types"""
+        storage = InternalStorageV2(self.app_name)
+        value = dict(a={"__ong_type__": "bytes", "value": "not bytes"}, b=[{"__ong_type__": "unknown", "c": b"bytes"}],
+                     d={"__ong_type__": "dict", "value": [["e", 1]]}, f=b"bytes")
+        for stored in value, [value] * 10:
+            with self.subTest(stored=stored):
+                self.assertEqual(stored, storage.deserialize(storage.serialize(stored)))
+
+    def test_chunk_size(self):
+        """Tests that chunks are sliced with the given size, stored in the header and that values can be read
+        whatever the chunk size of the reader"""
+        value = get_random_string(10 * self.chunk_size)
+        serialized = self.internal_storage.serialize(value)
+        chunks = self.internal_storage.chunk(serialized)
+        self.assertEqual(serialized, "".join(chunks))
+        self.assertTrue(all(len(chunk) == self.chunk_size for chunk in chunks[:-1]))
+        self.internal_storage.store_value(self.store_key, value)
+        _, header = self.internal_storage.read_header(self.store_key)
+        self.assertEqual(self.chunk_size, header['chunk_size'])
+        self.assertEqual(len(chunks), header['chunks'])
+        self.assertEqual(value, InternalStorageV2(self.app_name, chunk_size=7).get_value(self.store_key))
+
+    def test_backend_chunk_size(self):
+        """Tests detection of the chunk size of keyring backends"""
+        import keyring.backends.Windows
+        import keyring.backends.SecretService
+        import keyring.backends.chainer
+        windows, secret_service = keyring.backends.Windows.WinVaultKeyring(), keyring.backends.SecretService.Keyring()
+        self.assertEqual(1280, backend_chunk_size(windows))
+        self.assertEqual(2000, backend_chunk_size(secret_service, unbounded=2000))
+        self.assertEqual(10, backend_chunk_size(object(), default=10))
+        with patch.object(keyring.backends.chainer.ChainerBackend, "backends", [secret_service, windows]):
+            self.assertEqual(1280, backend_chunk_size(keyring.backends.chainer.ChainerBackend()))
+
+    def test_overwrite_removes_old_chunks(self):
+        """Tests that overwriting a value with a shorter one leaves no orphan chunks and that header is written
+        after the chunks"""
+        self.internal_storage.store_value(self.store_key, get_random_string(5 * self.chunk_size))
+        old_chunks = list(self.internal_storage.iter_chunk_keys(self.store_key))
+        with patch("keyring.set_password", wraps=keyring.set_password) as set_password:
+            self.internal_storage.store_value(self.store_key, "short value")
+            self.assertEqual(self.store_key, set_password.call_args_list[-1].args[1], "Header was not written last")
+        self.assertEqual("short value", self.internal_storage.get_value(self.store_key))
+        self.assertTrue(all(self.internal_storage.get_value_raw(c) is None for c in old_chunks))
+        self.assertEqual(0, self.internal_storage.vacuum([self.store_key]))
+
+    def test_vacuum(self):
+        """Tests that vacuum removes chunks left behind by interrupted writes and removals"""
+        storage = self.internal_storage
+        storage.store_value(self.store_key, get_random_string(3 * self.chunk_size))
+        _, header = storage.read_header(self.store_key)
+        # An extra chunk of the current generation
+        keyring.set_password(self.app_name, storage.chunk_name(self.store_key, header['chunks'], header['generation']),
+                             "orphan")
+        self.assertEqual(1, storage.vacuum([self.store_key]))
+        self.assertEqual(0, storage.vacuum([self.store_key]))
+        self.assertEqual(3 * self.chunk_size, len(storage.get_value(self.store_key)))
+        with self.assertRaises(ValueError):
+            storage.vacuum()
+        # Chunks of other generations are found in backends that can list their keys
+        backend = MemoryBackend()
+        storage = InternalStorageV2(self.app_name, backend=backend, chunk_size=self.chunk_size)
+        for _ in range(2):
+            storage.store_value(self.store_key, get_random_string(3 * self.chunk_size))
+        _, header = storage.read_header(self.store_key)
+        # Simulate an interrupted write (chunks of another generation without header)...
+        for idx in range(2):
+            backend.set_password(self.app_name, storage.chunk_name(self.store_key, idx, storage.new_generation(header)),
+                                 "orphan")
+        # ...and an interrupted removal of a value (just first chunk was left)
+        backend.set_password(self.app_name, storage.chunk_name("other_key", 0, 1), "orphan")
+        self.assertEqual(2, storage.vacuum([self.store_key]))
+        self.assertEqual(3 * self.chunk_size, len(storage.get_value(self.store_key)))
+        self.assertEqual(0, storage.vacuum())
+        self.assertEqual(1, storage.vacuum(["other_key"]))
+
+    def test_concurrent_writes(self):
+        """Tests that writers storing the same key at the same time do not mix their chunks"""
+        storage = InternalStorageV2(self.app_name, backend=SlowMemoryBackend(), chunk_size=100)
+        values = [get_random_string(1000) for _ in range(4)]
+        with patch.object(SlowMemoryBackend, "delay", 0), patch.object(SlowMemoryBackend, "write_delay", 0.001):
+            with ThreadPoolExecutor(len(values)) as executor:
+                for _ in range(5):
+                    list(executor.map(lambda value: storage.store_value(self.store_key, value, verify=False),
+                                      values))
+                    self.assertIn(storage.get_value(self.store_key), values)
+
+
+class SlowMemoryBackend(MemoryBackend):
+    """A MemoryBackend that takes delay seconds to read every value (and write_delay seconds to write it)"""
+    delay = 0.05
+
+    write_delay = 0
+
+    def get_password(self, service: str, username: str):
+        time.sleep(self.delay)
+        return super().get_password(service, username)
+
+    def set_password(self, service: str, username: str, password: str):
+        time.sleep(self.write_delay)
+        super().set_password(service, username, password)
+
+
+class TestInternalStorageAsync(unittest.IsolatedAsyncioTestCase):
+    store_key = "key_to_delete"
+    n_chunks = 8
+
+    def setUp(self):
+        self.internal_storage = InternalStorageV2(self.__class__.__name__, backend=SlowMemoryBackend(),
+                                                  chunk_size=100)
+        self.value = get_random_string(self.n_chunks * self.internal_storage.chunk_size - 10)
+
+    async def test_async_values(self):
+        """Tests storing, reading and removing values with async methods, reading chunks concurrently"""
+        await self.internal_storage.astore_value(self.store_key, self.value, verify=False)
+        self.assertEqual(self.n_chunks, len(list(self.internal_storage.iter_chunk_keys(self.store_key))))
+        start = time.perf_counter()
+        self.assertEqual(self.value, await self.internal_storage.aget_value(self.store_key))
+        elapsed = time.perf_counter() - start
+        # header + chunks read concurrently, instead of 1 + n_chunks reads one after another
+        self.assertLess(elapsed, (1 + self.n_chunks) * SlowMemoryBackend.delay / 2, "Chunks were not read concurrently")
+        await self.internal_storage.aremove_stored_value(self.store_key)
+        self.assertIsNone(await self.internal_storage.aget_value(self.store_key))
+
+    def test_get_many_concurrent(self):
+        """Tests that get_many can read keys concurrently from sync code"""
+        values = {f"{self.store_key}_{idx}": f"value {idx}" for idx in range(5)}
+        self.internal_storage.store_many(values)
+        self.assertEqual(values, self.internal_storage.get_many(values, concurrent=True))
+
 
 if __name__ == '__main__':
     unittest.main()
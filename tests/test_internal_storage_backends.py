@@ -0,0 +1,112 @@
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+import keyring.errors
+
+from ong_utils.internal_storage import InternalStorageV2
+from ong_utils.internal_storage_backends import MemoryBackend, SQLiteBackend
+from tests.test_internal_storage import get_random_string
+
+
+class TestInternalStorageBackends(unittest.TestCase):
+    app_name = "TestInternalStorageBackends"
+    store_key = "key_to_delete"
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.temp_dir.name) / "storage.db"
+        self.backends = dict(memory=MemoryBackend(), sqlite=SQLiteBackend(self.db_path),
+                             sqlite_password=SQLiteBackend(self.db_path.with_suffix(".pwd.db"), password="1234"))
+
+    def tearDown(self):
+        for backend in self.backends.values():
+            if isinstance(backend, SQLiteBackend):
+                backend.close()
+        self.temp_dir.cleanup()
+
+    def iter_backends(self):
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name):
+                yield backend
+
+    def test_backend_contract(self):
+        """Tests that backends store, get and delete values as keyring does"""
+        for backend in self.iter_backends():
+            self.assertIsNone(backend.get_password(self.app_name, self.store_key))
+            backend.set_password(self.app_name, self.store_key, "value")
+            backend.set_password(self.app_name, self.store_key, "new value")
+            self.assertEqual("new value", backend.get_password(self.app_name, self.store_key))
+            self.assertEqual([self.store_key], list(backend.iter_keys(self.app_name)))
+            backend.delete_password(self.app_name, self.store_key)
+            self.assertIsNone(backend.get_password(self.app_name, self.store_key))
+            with self.assertRaises(keyring.errors.PasswordDeleteError):
+                backend.delete_password(self.app_name, self.store_key)
+
+    def test_internal_storage(self):
+        """Tests that InternalStorageV2 can store long values in backends, and vacuum them without giving keys"""
+        value = [dict(name=get_random_string(10), value=get_random_string(1000)) for _ in range(10)]
+        for backend in self.iter_backends():
+            storage = InternalStorageV2(self.app_name, backend=backend, chunk_size=1000)
+            storage.store_value(self.store_key, value)
+            self.assertEqual(value, storage.get_value(self.store_key))
+            chunks = list(storage.iter_chunk_keys(self.store_key))
+            self.assertGreater(len(chunks), 1)
+            # An orphan chunk of an interrupted write
+            backend.set_password(self.app_name, storage.chunk_name(self.store_key, 0, 1000), "orphan")
+            self.assertEqual(1, storage.vacuum())
+            self.assertEqual(value, storage.get_value(self.store_key))
+            storage.remove_stored_value(self.store_key)
+            self.assertEqual([], list(backend.iter_keys(self.app_name)))
+
+    def test_vacuum_user_keys(self):
+        """Tests that vacuum does not remove user keys that look like chunk names"""
+        for backend in self.iter_backends():
+            storage = InternalStorageV2(self.app_name, backend=backend, chunk_size=1000)
+            long_value = [get_random_string(1000) for _ in range(3)]
+            values = {"release#1.2": dict(version="1.2"), "release": dict(version="1"),
+                      "orphan#3.0": dict(version="3"), "long#1.1": long_value}
+            for key, value in values.items():
+                storage.store_value(key, value)
+            self.assertEqual(0, storage.vacuum())
+            for key, value in values.items():
+                self.assertEqual(value, storage.get_value(key))
+            # A real orphan chunk of an existing value is still removed
+            backend.set_password(self.app_name, storage.chunk_name("release", 0, 1000), "orphan")
+            self.assertEqual(1, storage.vacuum())
+            for key, value in values.items():
+                self.assertEqual(value, storage.get_value(key))
+                storage.remove_stored_value(key)
+            self.assertEqual([], list(backend.iter_keys(self.app_name)))
+
+    def test_sqlite_encryption(self):
+        """Tests that values are stored encrypted and can be read again after reopening the database"""
+        for name in "sqlite", "sqlite_password":
+            backend = self.backends[name]
+            backend.set_password(self.app_name, self.store_key, "secret value")
+            backend.close()
+            with sqlite3.connect(backend.path) as connection:
+                stored, = connection.execute("SELECT password FROM secrets").fetchone()
+            self.assertNotIn("secret value", stored)
+            self.backends[name] = SQLiteBackend(backend.path, password="1234" if name == "sqlite_password" else None)
+            self.assertEqual("secret value", self.backends[name].get_password(self.app_name, self.store_key))
+
+    def test_sqlite_batch(self):
+        """Tests that writes in a batch are committed together, or rolled back if an exception is raised"""
+        backend = self.backends["sqlite"]
+        with self.assertRaises(ZeroDivisionError):
+            with backend.batch():
+                backend.set_password(self.app_name, "key1", "value")
+                1 / 0
+        self.assertIsNone(backend.get_password(self.app_name, "key1"))
+        storage = InternalStorageV2(self.app_name, backend=backend)
+        values = {f"key{idx}": f"value{idx}" for idx in range(10)}
+        storage.store_many(values)
+        self.assertEqual(values, storage.get_many(values))
+        storage.remove_many(values)
+        self.assertEqual([], list(backend.iter_keys(self.app_name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
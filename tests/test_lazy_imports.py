@@ -0,0 +1,63 @@
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+import ong_utils
+
+
+class TestLazyImports(unittest.TestCase):
+    # Maximum time allowed for a bare "import ong_utils" (in seconds)
+    import_time_budget = 0.2
+    # Modules that must not be imported just by importing ong_utils
+    heavy_modules = ("yaml", "ujson", "keyring", "urllib3", "certifi", "OpenSSL", "tkinter", "pandas",
+                     "openpyxl", "jwt", "seleniumwire", "ong_utils.config", "ong_utils.ui")
+
+    def run_python(self, code: str) -> str:
+        """Runs code in a fresh interpreter and returns its stdout"""
+        return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                              check=True).stdout.strip()
+
+    def test_import_time(self):
+        """Tests that importing ong_utils stays under import_time_budget seconds"""
+        elapsed = float(self.run_python("from time import perf_counter; t = perf_counter(); "
+                                        "import ong_utils; print(perf_counter() - t)"))
+        print(f"import ong_utils took {elapsed:.4f}s")
+        self.assertLess(elapsed, self.import_time_budget, "import ong_utils is too slow")
+
+    def test_no_heavy_modules(self):
+        """Tests that importing ong_utils does not import any heavy dependency"""
+        # Modules already loaded at interpreter startup (e.g. by .pth files) are not taken into account
+        loaded = self.run_python(f"import sys; before = set(sys.modules); import ong_utils; "
+                                 f"print(','.join(m for m in {self.heavy_modules!r} "
+                                 f"if m in sys.modules and m not in before))")
+        self.assertEqual("", loaded, f"Modules imported eagerly: {loaded}")
+
+    def test_public_names(self):
+        """Tests that all public names are still available"""
+        for name in [*ong_utils._static_names, *ong_utils._lazy_exports]:
+            with self.subTest(name=name):
+                if ong_utils._lazy_exports.get(name, (None,))[0] in ("ong_utils.ui", "ong_utils.ui_logging_utils"):
+                    # tkinter might not be installed in the system
+                    continue
+                self.assertIsNotNone(getattr(ong_utils, name))
+        self.assertRaises(AttributeError, getattr, ong_utils, "non_existing_name")
+
+
+    def test_star_import(self):
+        """Tests that a star import works even if optional system dependencies (e.g. tkinter) are missing"""
+        names = self.run_python("from ong_utils import *; print(','.join(sorted(dir())))").split(",")
+        self.assertIn("OngTimer", names)
+        self.assertIn("__version__", names)
+        # Names whose dependencies are missing are left out of __all__
+        with patch.dict(ong_utils._lazy_exports, missing_name=("ong_utils.non_existing_module", None)):
+            ong_utils.__dict__.pop("__all__", None)
+            try:
+                self.assertNotIn("missing_name", ong_utils.__all__)
+                self.assertIn("OngConfig", ong_utils.__all__)
+            finally:
+                ong_utils.__dict__.pop("__all__", None)
+
+
+if __name__ == '__main__':
+    unittest.main()
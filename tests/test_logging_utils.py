@@ -0,0 +1,92 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import yaml
+
+from ong_utils import OngConfig
+from ong_utils.logging_utils import JsonFormatter, CompressedRotatingFileHandler, CompressedTimedRotatingFileHandler
+
+
+class TestLoggingUtils(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.logger = logging.getLogger("test_logging_utils")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def tearDown(self) -> None:
+        for handler in self.logger.handlers[:]:
+            handler.close()
+            self.logger.removeHandler(handler)
+        self.temp_dir.cleanup()
+
+    def test_json_formatter(self):
+        formatter = JsonFormatter(fields=dict(line="lineno"))
+        record = self.logger.makeRecord(self.logger.name, logging.INFO, __file__, 10, "Hello %s", ("world",), None,
+                                        extra=dict(user="me", payload={"a": [1, 2]}, path=Path("/tmp")))
+        line = formatter.format(record)
+        self.assertNotIn("\n", line)
+        data = json.loads(line)
+        self.assertEqual(dict(level="INFO", name=self.logger.name, message="Hello world", line=10, user="me",
+                              payload={"a": [1, 2]}, path=str(Path("/tmp"))),
+                         {k: v for k, v in data.items() if k != "time"})
+        self.assertRegex(data["time"], r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}$")
+        try:
+            raise ValueError("an error")
+        except ValueError as e:
+            record = self.logger.makeRecord(self.logger.name, logging.ERROR, __file__, 1, "Failed", (),
+                                            (type(e), e, e.__traceback__))
+        self.assertIn("ValueError: an error", json.loads(formatter.format(record))["exc_info"])
+
+    def test_compressed_rotation(self):
+        filename = os.path.join(self.temp_dir.name, "test.log")
+        for handler in (CompressedRotatingFileHandler(filename, maxBytes=1000, backupCount=3),
+                        CompressedTimedRotatingFileHandler(filename, when="S", backupCount=3)):
+            with self.subTest(handler=type(handler).__name__):
+                self.logger.addHandler(handler)
+                for idx in range(4):
+                    self.logger.info(f"{idx}: " + "x" * 500)
+                    if isinstance(handler, CompressedTimedRotatingFileHandler):
+                        # Rotated file name depends on rollover time, that must be different for each rollover
+                        handler.rolloverAt = 1700000000 + idx * 10
+                    handler.doRollover()
+                handler.close()
+                self.logger.removeHandler(handler)
+                rotated = sorted(name for name in os.listdir(self.temp_dir.name) if name != "test.log")
+                self.assertEqual(3, len(rotated), rotated)
+                self.assertTrue(all(name.endswith(".gz") for name in rotated), rotated)
+                contents = set()
+                for name in rotated:
+                    with gzip.open(os.path.join(self.temp_dir.name, name), "rt") as f:
+                        contents.add(f.read()[0])
+                self.assertEqual({"1", "2", "3"}, contents)
+                for name in rotated:
+                    os.remove(os.path.join(self.temp_dir.name, name))
+
+    def test_default_logger_options(self):
+        app_name = "test_logger_options"
+        cfg_filename = os.path.join(self.temp_dir.name, f"{app_name}.yaml")
+        with open(cfg_filename, "w") as f:
+            yaml.dump({app_name: {"a_key": "a_value"}, "log": {}}, f)
+        cfg = OngConfig(app_name, cfg_filename=cfg_filename, log_config_path=Path(self.temp_dir.name) / "Logs",
+                        log_options=dict(json_format=True, compress=True, when="midnight"))
+        try:
+            handler = next(h for h in cfg.logger.handlers if isinstance(h, CompressedTimedRotatingFileHandler))
+            self.assertIsInstance(handler.formatter, JsonFormatter)
+            cfg.logger.debug("json message", extra=dict(request_id=1))
+            with open(handler.baseFilename) as f:
+                data = json.loads(f.readline())
+            self.assertEqual("json message", data["message"])
+            self.assertEqual(1, data["request_id"])
+        finally:
+            cfg.close_handlers()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,355 @@
+import asyncio
+import inspect
+import io
+import os
+import random
+import statistics
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from ong_utils import OngTimer, timers
+from ong_utils.timers import _histogram_bucket, _histogram_value, _histogram_size
+from tests.benchmark_timers import overhead_ns, max_enabled_overhead_ns, max_tree_overhead_ns, \
+    max_disabled_overhead_ns
+
+
+class TestTimers(unittest.TestCase):
+
+    def test_tic_toc(self):
+        timer = OngTimer(decimal_places=6)
+        with redirect_stdout(io.StringIO()) as stdout:
+            for _ in range(3):
+                timer.tic("loop")
+                time.sleep(0.01)
+                timer.toc_loop("loop")
+            self.assertEqual("", stdout.getvalue())
+            self.assertGreaterEqual(timer.elapsed("loop"), 0.03)
+            self.assertLess(timer.elapsed("loop"), 1)
+            timer.print_loop("loop")
+            with timer.context_manager("context"):
+                pass
+            with self.assertRaises(ValueError):
+                timer.toc("not started")
+        self.assertIn("Elapsed time for loop (in total): 0.0", stdout.getvalue())
+        self.assertIn("Elapsed time for context: ", stdout.getvalue())
+        self.assertEqual(["loop", "context"], list(timer.msgs))
+
+    def test_stats(self):
+        timer = OngTimer(decimal_places=6)
+        with self.assertRaises(ValueError):
+            timer.stats("not started")
+        timer.tic("loop")
+        self.assertEqual(0, timer.stats("loop")["count"])
+        self.assertIsNone(timer.stats("loop")["p50"])
+        ticobj = timer._get_ticobj("loop")
+        durations = list(range(1000, 101000, 1000))     # 1µs to 100µs, recorded directly to be deterministic
+        for duration in durations:
+            ticobj.record(duration)
+        stats = timer.stats("loop")
+        self.assertEqual(100, stats["count"])
+        self.assertAlmostEqual(sum(durations) / 1e9, stats["total"])
+        self.assertAlmostEqual(1e-6, stats["min"])
+        self.assertAlmostEqual(100e-6, stats["max"])
+        self.assertAlmostEqual(50.5e-6, stats["mean"])
+        self.assertAlmostEqual(statistics.pstdev(durations) / 1e9, stats["stddev"])
+        for percentile, expected in ("p50", 50e-6), ("p95", 95e-6), ("p99", 99e-6):
+            self.assertAlmostEqual(expected, stats[percentile], delta=expected * 0.032)
+        with redirect_stdout(io.StringIO()) as stdout:
+            timer.print_loop("loop")
+        self.assertIn("(count=100, mean=0.0000", stdout.getvalue())
+        self.assertIn("p99=0.000100s, max=0.000100s)", stdout.getvalue())
+
+    def test_histogram(self):
+        """Buckets keep a relative error below 1/32 in their middle value and use a fixed size list"""
+        for value in list(range(100)) + [random.randrange(1, 1 << 62) for _ in range(1000)] + [(1 << 64) - 1]:
+            bucket = _histogram_bucket(value)
+            self.assertLess(bucket, _histogram_size)
+            self.assertLessEqual(abs(_histogram_value(bucket) - value), value / 32)
+
+    def test_tree(self):
+        OngTimer.reset_tree()
+        timer = OngTimer(tree=True)
+        with redirect_stdout(io.StringIO()) as stdout:
+            with timer.context_manager("load"):
+                with timer.context_manager("parse"):
+                    time.sleep(0.02)
+                for _ in range(3):
+                    timer.tic("transform")
+                    time.sleep(0.01)
+                    timer.toc_loop("transform")
+            # Same msg outside load is a different node
+            with timer.context_manager("parse"):
+                pass
+            timer.print_tree()
+        load, parse = OngTimer.tree()
+        self.assertEqual(["load", "parse"], [load["name"], parse["name"]])
+        self.assertEqual(["parse", "transform"], [child["name"] for child in load["children"]])
+        child_parse, transform = load["children"]
+        self.assertEqual(3, transform["count"])
+        self.assertEqual(1, child_parse["count"])
+        self.assertGreaterEqual(transform["inclusive"], 0.03)
+        self.assertAlmostEqual(load["inclusive"] - child_parse["inclusive"] - transform["inclusive"],
+                               load["exclusive"])
+        self.assertAlmostEqual(100 * transform["inclusive"] / load["inclusive"], transform["percent"])
+        self.assertAlmostEqual(100, load["percent"] + parse["percent"])
+        self.assertEqual(transform["inclusive"], transform["exclusive"])
+        report = stdout.getvalue()
+        self.assertIn("\nload: ", report)
+        self.assertIn("\n    transform: ", report)
+        self.assertIn("count=3)", report)
+        OngTimer.reset_tree()
+        self.assertEqual([], OngTimer.tree())
+
+    def test_tree_reset(self):
+        """Timers started again after reset_tree are added to the new tree"""
+        OngTimer.reset_tree()
+        timer = OngTimer(tree=True)
+        timer.tic("loop")
+        timer.toc_loop("loop")
+        OngTimer.reset_tree()
+        timer.tic("loop")
+        timer.toc_loop("loop")
+        self.assertEqual([("loop", 1)], [(node["name"], node["count"]) for node in OngTimer.tree()])
+        OngTimer.reset_tree()
+
+    def test_tree_disabled(self):
+        """Timers are not added to the call tree by default"""
+        OngTimer.reset_tree()
+        timer = OngTimer()
+        with redirect_stdout(io.StringIO()):
+            with timer.context_manager("not in tree"):
+                pass
+        self.assertEqual([], OngTimer.tree())
+        self.assertIs(timers._tree_root, timers._current_node.get())
+
+    def test_tree_freed(self):
+        """Nodes are freed with their timers, so unique msgs do not pile up"""
+        OngTimer.reset_tree()
+        with redirect_stdout(io.StringIO()):
+            for i in range(1000):
+                with OngTimer(msg=f"request {i}", tree=True):
+                    pass
+        self.assertEqual([], OngTimer.tree())
+        self.assertEqual(0, len(timers._tree_root.children))
+
+    def test_tree_restart(self):
+        """A timer started again before being stopped is not nested into itself, and does not remain as the parent
+        of later timers"""
+        OngTimer.reset_tree()
+        timer = OngTimer(tree=True)
+        with redirect_stdout(io.StringIO()):
+            for _ in range(3):
+                timer.tic("restarted")
+            timer.toc("restarted")
+            with timer.context_manager("later"):
+                pass
+        self.assertEqual([("restarted", 1, []), ("later", 1, [])],
+                         [(node["name"], node["count"], node["children"]) for node in OngTimer.tree()])
+        OngTimer.reset_tree()
+
+    def test_tree_exception(self):
+        """Timers stopped by an exception in a with block (even nested in the same instance, and with timers
+        started inside not stopped) do not remain as parents of later timers"""
+        OngTimer.reset_tree()
+        timer = OngTimer(tree=True)
+        with redirect_stdout(io.StringIO()):
+            with self.assertRaises(ZeroDivisionError):
+                with timer.context_manager("outer"):
+                    with timer.context_manager("inner"):
+                        timer.tic("not stopped")
+                        1 / 0
+            with timer.context_manager("later"):
+                pass
+        self.assertIs(timers._tree_root, timers._current_node.get())
+        outer, later = OngTimer.tree()
+        self.assertEqual([("outer", 1), ("later", 1)],
+                         [(outer["name"], outer["count"]), (later["name"], later["count"])])
+        self.assertEqual(["inner"], [child["name"] for child in outer["children"]])
+        OngTimer.reset_tree()
+
+    def test_tree_concurrency(self):
+        """Threads and asyncio tasks have their own current node, tasks inherit it from where they are created"""
+        OngTimer.reset_tree()
+        timer = OngTimer(tree=True)
+
+        def in_thread():
+            timer.tic("thread")
+            timer.toc_loop("thread")
+
+        async def in_task(name):
+            timer.tic(name)
+            await asyncio.sleep(0.01)
+            timer.toc_loop(name)
+
+        async def run_tasks():
+            timer.tic("tasks")
+            await asyncio.gather(*(in_task(f"task{i}") for i in range(3)))
+            timer.toc_loop("tasks")
+
+        with redirect_stdout(io.StringIO()):
+            timer.tic("main")
+            thread = threading.Thread(target=in_thread)
+            thread.start()
+            thread.join()
+            asyncio.run(run_tasks())
+            timer.toc_loop("main")
+        main, thread_node = sorted(OngTimer.tree(), key=lambda node: node["name"])
+        self.assertEqual("thread", thread_node["name"])
+        tasks, = main["children"]
+        self.assertEqual(["task0", "task1", "task2"], [child["name"] for child in tasks["children"]])
+        OngTimer.reset_tree()
+
+    def test_timed(self):
+        timer = OngTimer()
+
+        @OngTimer.timed(timer=timer)
+        def double(value):
+            return 2 * value
+
+        @OngTimer.timed("fail", timer=timer)
+        def fail():
+            raise KeyError("fail")
+
+        @OngTimer.timed("coroutine", loop=False, timer=timer)
+        async def coroutine(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        with redirect_stdout(io.StringIO()) as stdout:
+            self.assertEqual([2, 4, 6], [double(value) for value in (1, 2, 3)])
+            with self.assertRaises(KeyError):
+                fail()
+            self.assertEqual("", stdout.getvalue())
+            self.assertEqual(5, asyncio.run(coroutine(5)))
+            self.assertIn("Elapsed time for coroutine: 0.01", stdout.getvalue())
+        self.assertEqual("double", double.__name__)
+        self.assertTrue(inspect.iscoroutinefunction(coroutine))
+        qualname = "TestTimers.test_timed.<locals>.double"
+        self.assertEqual([qualname, "fail", "coroutine"], list(timer.msgs))
+        self.assertEqual(3, timer.stats(qualname)["count"])
+        self.assertEqual(1, timer.stats("fail")["count"])
+        self.assertGreaterEqual(timer.elapsed("coroutine"), 0.01)
+        with redirect_stdout(io.StringIO()):
+            timer.print_loop(qualname)
+
+    def test_timed_disabled(self):
+        """Functions decorated with a disabled timer are not wrapped"""
+        def func():
+            pass
+        self.assertIs(func, OngTimer.timed(timer=OngTimer(enabled=False))(func))
+        with patch.object(timers, "_registry", None), patch.dict(os.environ, ONG_TIMERS_DISABLED="1"):
+            self.assertIs(func, OngTimer.timed(func))
+            self.assertFalse(OngTimer.registry().enabled)
+        with patch.object(timers, "_registry", None), patch.dict(os.environ, ONG_TIMERS_DISABLED=""):
+            self.assertIsNot(func, OngTimer.timed(func))
+            self.assertTrue(OngTimer.registry().enabled)
+
+    def test_concurrent(self):
+        """Hammers a concurrent timer with the same msg from a thread pool and from many asyncio tasks. Every interval
+        must be at least the sleep time (with a non concurrent timer start times are overwritten)"""
+        timer = OngTimer(concurrent=True)
+        threads, iterations, sleep_s = 8, 25, 0.002
+
+        def work():
+            for _ in range(iterations):
+                timer.tic("thread")
+                time.sleep(sleep_s)
+                timer.toc_loop("thread")
+
+        with ThreadPoolExecutor(threads) as executor:
+            for future in [executor.submit(work) for _ in range(threads)]:
+                future.result()
+        stats = timer.stats("thread")
+        self.assertEqual(threads * iterations, stats["count"])
+        self.assertGreaterEqual(stats["min"], sleep_s)
+        self.assertGreaterEqual(stats["total"], threads * iterations * sleep_s)
+        self.assertLess(stats["max"], 1)
+
+        tasks, task_sleep_s = 500, 0.02
+
+        async def task():
+            timer.tic("task")
+            await asyncio.sleep(task_sleep_s)
+            timer.toc_loop("task")
+
+        async def run_tasks():
+            await asyncio.gather(*(task() for _ in range(tasks)))
+
+        start = time.perf_counter()
+        asyncio.run(run_tasks())
+        wall_time = time.perf_counter() - start
+        stats = timer.stats("task")
+        self.assertEqual(tasks, stats["count"])
+        self.assertGreaterEqual(stats["min"], task_sleep_s)
+        self.assertLessEqual(stats["max"], wall_time)
+        self.assertGreaterEqual(stats["total"], tasks * task_sleep_s)
+        # Timers run in other threads or tasks cannot be stopped
+        with self.assertRaises(ValueError):
+            timer.toc_loop("task")
+        with redirect_stdout(io.StringIO()) as stdout:
+            timer.print_loop("task")
+        self.assertIn(f"(count={tasks}, ", stdout.getvalue())
+
+    def test_concurrent_recursive(self):
+        """The same msg can be nested in a thread or task, e.g. in recursive functions"""
+        OngTimer.reset_tree()
+        timer = OngTimer(concurrent=True, tree=True)
+
+        @OngTimer.timed("rec", timer=timer)
+        def rec(depth):
+            return rec(depth - 1) + 1 if depth else 0
+
+        self.assertEqual(1, rec(1))
+        self.assertEqual(2, timer.stats("rec")["count"])
+        outer, = OngTimer.tree()
+        inner, = outer["children"]
+        self.assertEqual([("rec", 1), ("rec", 1)], [(outer["name"], outer["count"]), (inner["name"], inner["count"])])
+        self.assertGreaterEqual(outer["inclusive"], inner["inclusive"])
+        with self.assertRaises(ValueError):
+            timer.toc_loop("rec")
+        # Stopped intervals are not kept in the context
+        self.assertNotIn(timer._get_ticobj("rec").key, timers._started.get())
+        OngTimer.reset_tree()
+
+    def test_concurrent_not_stopped(self):
+        """Deleting a concurrent timer prints its total, without adding intervals not stopped"""
+        timer = OngTimer(concurrent=True, decimal_places=6)
+        timer.tic("not stopped")
+        time.sleep(0.01)
+        with redirect_stdout(io.StringIO()) as stdout:
+            del timer
+        OngTimer.reset_tree()
+        self.assertIn("Closing elapsed time for not stopped: 0.000000s", stdout.getvalue())
+
+    def test_disabled(self):
+        timer = OngTimer(enabled=False)
+        with redirect_stdout(io.StringIO()) as stdout:
+            timer.tic("disabled")
+            timer.toc("disabled")
+            timer.toc_loop("never started")
+            with OngTimer(msg="disabled", enabled=False):
+                pass
+            self.assertEqual([], list(timer.msgs))
+            timer.enabled = True
+            timer.tic("enabled")
+            timer.toc("enabled")
+            timer.enabled = False
+            timer.tic("disabled again")
+        self.assertEqual(["enabled"], list(timer.msgs))
+        self.assertEqual(1, stdout.getvalue().count("Elapsed time"))
+
+    def test_overhead(self):
+        """Overhead of tic + toc_loop is checked with a margin, to avoid failures in slow or busy machines.
+        Run tests.benchmark_timers to check the actual bounds"""
+        with redirect_stdout(io.StringIO()):
+            self.assertLess(overhead_ns(True, iterations=10000), 10 * max_enabled_overhead_ns)
+            self.assertLess(overhead_ns(True, iterations=10000, tree=True), 10 * max_tree_overhead_ns)
+            self.assertLess(overhead_ns(False, iterations=10000), 10 * max_disabled_overhead_ns)
+
+
+if __name__ == '__main__':
+    unittest.main()